@@ -3,19 +3,34 @@
 __author__ = 'maxim'
 
 
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 import glob
+import multiprocessing
 import os
+import time
+
 import pandas as pd
 
-from data.fetcher import MAIN_EQUITIES
+from data.catalog import CATALOG_NAME, Catalog
+from data.fetcher import Period, canonical_name
+from data.instruments import MAIN_EQUITIES
 from data.loader import load, to_returns
 
 
 STORAGE = '.storage'
 
 
-def guess_path(ticker):
-  mask = os.path.join(STORAGE, '%s_*_day.txt' % (ticker, ))
+def guess_path(ticker, storage=STORAGE):
+  catalog_path = os.path.join(storage, CATALOG_NAME)
+  if os.path.exists(catalog_path):
+    path = Catalog(catalog_path).latest(ticker, Period.DAY)
+    if path is not None and os.path.exists(path):
+      return path
+  canonical = os.path.join(storage, canonical_name(ticker, Period.DAY))
+  if os.path.exists(canonical):
+    return canonical
+  mask = os.path.join(storage, '%s_*_day.txt' % (ticker, ))
   matched = glob.glob(mask)
   assert matched, 'No files match the mask: %s' % mask
   return max(matched)
@@ -36,17 +51,73 @@ def calc_sharpe(df, key='close_return'):
   return returns.std(), returns.mean(), k * returns.mean() / returns.std()
 
 
-def process(ticker):
-  path = guess_path(ticker)
-  df = get_returns(path)
-  print(df.head())
+# Universe panel: one aligned (timestamps x tickers) matrix, NaN where the instrument wasn't listed or traded.
+# A timestamp repeated in a file (e.g. an overlapping download) keeps its last bar.
+def build_panel(tickers, key='close', storage=STORAGE):
+  columns = {}
+  for ticker in tickers:
+    price = load(guess_path(ticker, storage))
+    series = pd.Series(price[key].values, index=pd.DatetimeIndex(price['timestamp'], name='timestamp'))
+    columns[ticker] = series[~series.index.duplicated(keep='last')]
+  return pd.DataFrame(columns, columns=list(tickers))
+
+
+def panel_returns(prices):
+  # Each return is relative to the previous bar of the same ticker, even if the other tickers traded in between.
+  filled = prices.ffill()
+  returns = filled / filled.shift(1) - 1
+  return returns.where(prices.notnull())
+
+
+def calc_sharpe_panel(prices):
+  returns = panel_returns(prices)
+  k = prices.notnull().sum() ** 0.5
+  mean = returns.mean()
+  std = returns.std()
+  return pd.DataFrame({'std': std, 'mean': mean, 'sharpe': k * mean / std}, columns=['std', 'mean', 'sharpe'])
+
+
+def process(ticker, verbose=False, storage=STORAGE, memo=None):
+  path = guess_path(ticker, storage)
+  df = memo.call(get_returns, path) if memo is not None else get_returns(path)
+  if verbose:
+    print(df.head())
   return calc_sharpe(df)
 
 
+# Parallel driver: the results come back in the order of the tickers, a failure of one task is recorded
+# in its result and doesn't abort the others.
+TaskResult = namedtuple('TaskResult', ['ticker', 'value', 'error', 'elapsed'])
+
+
+def _timed_call(func, ticker):
+  start = time.time()
+  try:
+    return TaskResult(ticker, func(ticker), None, time.time() - start)
+  except Exception as e:
+    return TaskResult(ticker, None, '%s: %s' % (type(e).__name__, e), time.time() - start)
+
+
+def run_parallel(tickers, func=process, workers=None):
+  workers = workers or multiprocessing.cpu_count()
+  with ProcessPoolExecutor(max_workers=workers) as executor:
+    futures = [executor.submit(_timed_call, func, ticker) for ticker in tickers]
+    results = []
+    for ticker, future in zip(tickers, futures):
+      try:
+        results.append(future.result())
+      except Exception as e:  # the worker process died or the result can't be pickled
+        results.append(TaskResult(ticker, None, '%s: %s' % (type(e).__name__, e), None))
+    return results
+
+
 if __name__ == '__main__':
-  all = []
-  for ticker in MAIN_EQUITIES:
-    values = process(ticker)
-    all.append((ticker, ) + values)
-  df = pd.DataFrame(all, columns=['ticker', 'std', 'mean', 'sharpe'])
+  results = run_parallel(MAIN_EQUITIES)
+  rows = [(result.ticker, ) + result.value + (result.elapsed, ) for result in results if result.error is None]
+  df = pd.DataFrame(rows, columns=['ticker', 'std', 'mean', 'sharpe', 'elapsed'])
   print(df)
+  for result in results:
+    if result.error is not None:
+      print('Failed %s: %s' % (result.ticker, result.error))
+  # The same statistics in one pass over the aligned universe of the loaded tickers.
+  print(calc_sharpe_panel(build_panel([result.ticker for result in results if result.error is None])))
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import itertools
+
+import numpy as np
+import pandas as pd
+
+__author__ = 'maxim'
+
+
+# Parameter sweeps over the returns panel (bars x tickers), e.g. `analysis.panel_returns(build_panel(...))`.
+# A signal function maps a batch of P parameter combinations to the positions (P, bars, tickers),
+# the evaluation is broadcast over all of them at once. The position decided at the bar t is held over t + 1.
+
+def momentum_signal(returns, lookback, threshold):
+  # Long/short by the sign of the log return over the last `lookback` bars, flat when it's within `threshold`.
+  log_returns = np.log1p(np.nan_to_num(returns)).astype(np.float32)
+  cumulative = np.vstack([np.zeros((1, returns.shape[1]), dtype=np.float32), np.cumsum(log_returns, axis=0)])
+  bars = np.arange(1, returns.shape[0] + 1)
+  start = bars[None, :] - np.asarray(lookback)[:, None]
+  momentum = cumulative[bars][None] - cumulative[np.maximum(start, 0)]
+  threshold = np.asarray(threshold, dtype=np.float32)[:, None, None]
+  positions = (momentum > threshold).astype(np.float32) - (momentum < -threshold)
+  positions[start < 0] = 0
+  return positions
+
+
+def threshold_signal(feature, threshold):
+  # Follows the direction of a feature panel (e.g. the first-hour return) when it's beyond `threshold`.
+  feature = np.asarray(feature)[None]
+  threshold = np.asarray(threshold)[:, None, None]
+  return np.where(np.abs(feature) > threshold, np.sign(feature), 0.0)
+
+
+def evaluate(returns, positions, cost=0.0):
+  # returns (bars, tickers), positions (..., bars, tickers); `cost` is per unit of the position change.
+  # Returns the (..., tickers) arrays of Sharpe (scaled as `analysis.calc_sharpe`), max drawdown and turnover.
+  # The drawdown is of the compounded equity (the P&L reinvested every bar), a fraction of the running peak.
+  # The bulk is computed in float32 with float64 accumulators: the sweeps are memory-bound.
+  listed = np.isfinite(returns)
+  clean = np.where(listed, returns, 0.0).astype(np.float32)
+  positions = np.asarray(positions, dtype=np.float32) * listed
+  pnl = positions[..., :-1, :] * clean[1:]
+  trades = np.abs(np.diff(positions, axis=-2))
+  trades = np.concatenate([np.abs(positions[..., :1, :]), trades[..., :-1, :]], axis=-2)
+  if cost:
+    pnl -= np.float32(cost) * trades
+
+  count = listed[1:].sum(axis=0)
+  total = pnl.sum(axis=-2, dtype=np.float64)
+  total_sq = np.einsum('...ti,...ti->...i', pnl, pnl, dtype=np.float64)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    mean = total / count
+    variance = (total_sq - count * mean ** 2) / (count - 1)
+    sharpe = np.sqrt(count) * mean / np.sqrt(variance)
+  with np.errstate(divide='ignore'):
+    equity = np.exp(np.cumsum(np.log1p(np.maximum(pnl, -1)), axis=-2, dtype=np.float64))
+  peak = np.maximum.accumulate(np.maximum(equity, 1), axis=-2)
+  drawdown = (1 - equity / peak).max(axis=-2)
+  turnover = trades.sum(axis=-2, dtype=np.float64) / count
+  return sharpe, drawdown, turnover
+
+
+def sweep(returns, signal, grid, cost=0.0, chunk=64):
+  # grid: {'lookback': [5, 10, 20], 'threshold': [0, 0.01]}, every combination is evaluated for every ticker.
+  # The combinations are processed in chunks of `chunk` to bound the memory.
+  tickers = list(returns.columns) if isinstance(returns, pd.DataFrame) else list(range(returns.shape[1]))
+  values = np.asarray(returns, dtype=np.float64)
+  names = list(grid.keys())
+  combos = list(itertools.product(*[grid[name] for name in names]))
+  frames = []
+  for begin in range(0, len(combos), chunk):
+    batch = combos[begin:begin + chunk]
+    params = {name: np.array([combo[i] for combo in batch]) for i, name in enumerate(names)}
+    sharpe, drawdown, turnover = evaluate(values, signal(values, **params), cost=cost)
+    frame = pd.DataFrame({name: np.repeat(params[name], len(tickers)) for name in names})
+    frame['ticker'] = np.tile(tickers, len(batch))
+    frame['sharpe'] = sharpe.ravel()
+    frame['drawdown'] = drawdown.ravel()
+    frame['turnover'] = turnover.ravel()
+    frames.append(frame)
+  return pd.concat(frames, ignore_index=True)
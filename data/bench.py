@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from data import analysis
+from data.fetcher import Period
+from data.kernels import returns_kernel
+from data.loader import COLUMNS, load, to_changes, to_returns
+from data.synthetic import TRADING_DAYS, generate, random_bars, session_timestamps, write_finam
+
+__author__ = 'maxim'
+
+
+# The exports write `%y` years, read back as 1969-2068: the sample spans at most this many years from 2010,
+# in the coarsest bars that fit, or in ticks.
+MAX_YEARS = 50
+SAMPLE_PERIODS = [Period.HOUR, Period.MIN_30, Period.MIN_15, Period.MIN_10, Period.MIN_5, Period.MIN_1]
+
+
+def random_frame(rows, ticker='SBER', seed=0):
+  # `rows` intraday bars in the `loader.load` layout, sorted, from 2010-01-04.
+  for period in SAMPLE_PERIODS:
+    per_day = len(session_timestamps(period, 1.0 / TRADING_DAYS))
+    years = int(np.ceil(float(rows) / (per_day * TRADING_DAYS)))
+    if years <= MAX_YEARS:
+      break
+  else:
+    period, years = Period.TICK, MAX_YEARS
+  ticks_per_day = int(np.ceil(float(rows) / (years * TRADING_DAYS)))
+  timestamps = session_timestamps(period, max(years, 1), ticks_per_day=ticks_per_day, seed=seed)[:rows]
+  return random_bars(timestamps, ticker, period, seed=seed)
+
+
+def write_sample(path, rows, ticker='SBER', seed=0):
+  write_finam(path, random_frame(rows, ticker, seed))
+
+
+def load_strptime(filename):
+  # The original loader: per-row `strptime` and inferred dtypes.
+  df = pd.read_csv(filename, names=COLUMNS, skiprows=1, dtype={'date': str, 'time': str})
+  timestamp = (df['date'] + ' ' + df['time']).map(lambda x: datetime.datetime.strptime(x, '%d/%m/%y %H:%M:%S'))
+  df.insert(0, 'timestamp', timestamp)
+  return df.drop(columns=['date', 'time'])
+
+
+def to_changes_pandas(raw):
+  # The original `to_changes`: a `pct_change` per column and a copy for the `[1:]` slice.
+  changes_df = pd.DataFrame(data={
+    'timestamp': raw.timestamp,
+    'high': raw.high.pct_change(),
+    'low': raw.low.pct_change(),
+    'open': raw.open.pct_change(),
+    'close': raw.close.pct_change(),
+    'volume': raw.volume.replace({0: 1e-5}).pct_change()
+  }, columns=['timestamp', 'high', 'low', 'open', 'close', 'volume'])
+  changes_df = changes_df.set_index('timestamp')
+  return changes_df[1:]
+
+
+def to_returns_pandas(raw, keys=('close',)):
+  # The original `to_returns`: an `assign` (a full copy) per key.
+  returns_df = raw
+  for key in keys:
+    returns_df = returns_df.assign(**{'%s_return' % key: raw[key].pct_change(1)})
+  return returns_df
+
+
+def measure(func, *args, **kwargs):
+  start = time.time()
+  result = func(*args, **kwargs)
+  return result, time.time() - start
+
+
+def best_of(repeat, func, *args, **kwargs):
+  best = None
+  for _ in range(repeat):
+    result, elapsed = measure(func, *args, **kwargs)
+    best = elapsed if best is None else min(best, elapsed)
+  return result, best
+
+
+def bench_load(path, repeat=3):
+  results = {}
+  load(path)  # warm up the sidecar cache
+  for name, func, kwargs in [('strptime', load_strptime, {}),
+                             ('vectorized', load, {'cache': False}),
+                             ('cached', load, {})]:
+    df, elapsed = best_of(repeat, func, path, **kwargs)
+    results[name] = (len(df), elapsed)
+  return results
+
+
+def bench_returns(rows, repeat=3):
+  df = random_frame(rows)
+  keys = ['open', 'high', 'low', 'close']
+  block = np.ascontiguousarray(df[keys].values.T)
+  out = np.empty(block.shape, dtype=np.float32)
+  results = {}
+  for name, func, args, kwargs in [('changes/pandas', to_changes_pandas, (df, ), {}),
+                                   ('changes/kernel', to_changes, (df, ), {}),
+                                   ('returns/pandas', to_returns_pandas, (df, keys), {}),
+                                   ('returns/kernel', to_returns, (df, keys), {}),
+                                   ('kernel/simple', returns_kernel, (block, ), {}),
+                                   ('kernel/log', returns_kernel, (block, ), {'kind': 'log'}),
+                                   ('kernel/f32+out', returns_kernel, (block, ), {'dtype': np.float32, 'out': out})]:
+    _, elapsed = best_of(repeat, func, *args, **kwargs)
+    results[name] = (rows, elapsed)
+  return results
+
+
+def print_results(results):
+  for name, (count, elapsed) in results.items():
+    print('%-16s %10d rows  %8.3fs  %12.0f rows/sec' % (name, count, elapsed, count / elapsed))
+
+
+# Suite: every pipeline stage over a synthetic storage of N tickers x Y years per period.
+# The results (wall time, throughput, peak traced memory) go to a JSON file and can be checked against a baseline.
+
+SUITE_PERIODS = [Period.DAY, Period.HOUR, Period.MIN_1, Period.TICK]
+
+
+def _peak_memory(func, *args, **kwargs):
+  tracemalloc.start()
+  try:
+    func(*args, **kwargs)
+    return tracemalloc.get_traced_memory()[1]
+  finally:
+    tracemalloc.stop()
+
+
+def _stages(storage, paths, period):
+  frames = [load(path) for path in paths]
+  tickers = [frame['ticker'].iloc[0] for frame in frames]
+  stages = [
+    ('load/parse', lambda: [load(path, cache=False) for path in paths]),
+    ('load/cached', lambda: [load(path) for path in paths]),
+    ('to_returns', lambda: [to_returns(frame, keys=('open', 'high', 'low', 'close')) for frame in frames]),
+    ('to_changes', lambda: [to_changes(frame) for frame in frames]),
+  ]
+  if period == Period.DAY:
+    stages += [
+      ('guess_path', lambda: [analysis.guess_path(ticker, storage=storage) for ticker in tickers]),
+      ('get_returns+calc_sharpe', lambda: [analysis.calc_sharpe(analysis.get_returns(path)) for path in paths]),
+    ]
+  rows = sum(len(frame) for frame in frames)
+  return rows, stages
+
+
+def run_suite(storage, tickers=10, years=2, periods=SUITE_PERIODS, repeat=3, seed=0):
+  names = ['T%03d' % i for i in range(tickers)]
+  results = []
+  for period in periods:
+    paths = generate(storage, names, years, period, seed=seed)
+    rows, stages = _stages(storage, paths, period)
+    for stage, func in stages:
+      _, elapsed = best_of(repeat, func)
+      results.append({
+        'stage': stage,
+        'period': period.slug(),
+        'rows': rows,
+        'seconds': elapsed,
+        'rows_per_sec': rows / elapsed if elapsed else None,
+        'peak_mb': _peak_memory(func) / 2.0 ** 20,
+      })
+  return results
+
+
+def save_results(path, results, **context):
+  report = dict(context, python=platform.python_version(), numpy=np.__version__, pandas=pd.__version__,
+                created=datetime.datetime.now().isoformat(), results=results)
+  with open(path, 'w') as file:
+    json.dump(report, file, indent=2)
+
+
+def compare(results, baseline_path, tolerance=0.25):
+  # The stages that got slower (or hungrier) than the baseline by more than `tolerance`.
+  with open(baseline_path) as file:
+    baseline = {(item['stage'], item['period']): item for item in json.load(file)['results']}
+  regressions = []
+  for item in results:
+    base = baseline.get((item['stage'], item['period']))
+    if base is None:
+      continue
+    for key in ('seconds', 'peak_mb'):
+      if base[key] and item[key] > base[key] * (1 + tolerance):
+        regressions.append((item['stage'], item['period'], key, base[key], item[key]))
+  return regressions
+
+
+# Cold import time of the entry points, each in a fresh interpreter (the best of `repeat`).
+IMPORT_MODULES = ['data.cli', 'data.instruments', 'data.fetcher', 'data.loader', 'data.analysis']
+
+
+def bench_imports(modules=IMPORT_MODULES, repeat=3):
+  root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+  results = {}
+  for module in modules:
+    code = 'import time; start = time.time(); import %s; print(time.time() - start)' % module
+    results[module] = min(float(subprocess.check_output([sys.executable, '-c', code], cwd=root))
+                          for _ in range(repeat))
+  return results
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Benchmarks of the loading and analysis stages')
+  commands = parser.add_subparsers(dest='command')
+  micro = commands.add_parser('micro', help='loader and returns kernels on a single series')
+  micro.add_argument('--rows', type=int, default=1000000)
+  micro.add_argument('--return-rows', type=int, default=10000000)
+  imports = commands.add_parser('imports', help='cold import time of the entry points')
+  imports.add_argument('--repeat', type=int, default=3)
+  suite = commands.add_parser('suite', help='all stages over a synthetic storage')
+  suite.add_argument('--tickers', type=int, default=10)
+  suite.add_argument('--years', type=float, default=2)
+  suite.add_argument('--periods', nargs='+', default=[period.slug() for period in SUITE_PERIODS])
+  suite.add_argument('--repeat', type=int, default=3)
+  suite.add_argument('--output', default='bench_results.json')
+  suite.add_argument('--baseline')
+  suite.add_argument('--tolerance', type=float, default=0.25)
+  args = parser.parse_args()
+
+  if args.command == 'imports':
+    for module, seconds in bench_imports(repeat=args.repeat).items():
+      print('%-20s %8.3fs' % (module, seconds))
+    return
+
+  if args.command == 'suite':
+    periods = [period for period in Period if period.slug() in args.periods]
+    with tempfile.TemporaryDirectory() as storage:
+      results = run_suite(storage, args.tickers, args.years, periods, args.repeat)
+    save_results(args.output, results, tickers=args.tickers, years=args.years)
+    for item in results:
+      print('%-24s %-6s %10d rows  %8.3fs  %12.0f rows/sec  %8.1f Mb' % (
+        item['stage'], item['period'], item['rows'], item['seconds'], item['rows_per_sec'] or 0, item['peak_mb']))
+    if args.baseline:
+      regressions = compare(results, args.baseline, args.tolerance)
+      for stage, period, key, before, after in regressions:
+        print('REGRESSION %s %s %s: %.3f -> %.3f' % (stage, period, key, before, after))
+      if regressions:
+        raise SystemExit(1)
+    return
+
+  rows = getattr(args, 'rows', 1000000)
+  return_rows = getattr(args, 'return_rows', 10000000)
+  with tempfile.TemporaryDirectory() as tmp:
+    path = os.path.join(tmp, 'SBER_hour.txt')
+    write_sample(path, rows)
+    results = bench_load(path)
+  print_results(results)
+  print('speedup: %.1fx parse, %.1fx cached' % (results['strptime'][1] / results['vectorized'][1],
+                                                results['strptime'][1] / results['cached'][1]))
+  print_results(bench_returns(return_rows))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+__author__ = 'maxim'
+
+
+# Bootstrap confidence intervals and p-values of the Sharpe ratio, scaled as `analysis.calc_sharpe`
+# (sqrt of the number of bars, the first bar without a return included). The resamples keep the serial
+# dependence of the returns by drawing blocks:
+#
+#   stationary  the blocks have geometric lengths with the mean `block` (Politis & Romano)
+#   block       the circular blocks of the fixed length `block`
+#
+# The resamples of a ticker are drawn at once as a (draws, bars) index array, in chunks bounded by
+# MAX_ELEMENTS. Every ticker has its own random stream derived from `seed`, so the results are the same
+# with any number of workers.
+
+MAX_ELEMENTS = 1 << 22
+
+
+def _indices(random, length, draws, block, kind):
+  # The (draws, length) resample indices. The draws are laid out as one flat stream of bars in which a block
+  # starts at every draw, and within a draw at the geometric (stationary) or the fixed (block) intervals;
+  # each block draws its start, the bars after it continue circularly.
+  total = draws * length
+  new_block = np.zeros(total, dtype=bool)
+  if kind == 'stationary':
+    # A block cut at the end of a draw is still geometric (memoryless), so the stream is split at once.
+    expected = total / float(block)
+    size = int(expected + 6 * np.sqrt(expected)) + 16
+    ends = np.cumsum(random.geometric(1.0 / block, size=size))
+    while ends[-1] < total:
+      ends = np.concatenate([ends, ends[-1] + np.cumsum(random.geometric(1.0 / block, size=size))])
+    new_block[ends[ends < total]] = True
+  elif kind == 'block':
+    new_block.reshape(draws, length)[:, ::block] = True
+  else:
+    raise ValueError('Unknown bootstrap kind: %s' % kind)
+  new_block[::length] = True
+  firsts = np.flatnonzero(new_block)
+  shift = random.randint(0, length, size=len(firsts)) - firsts % length
+  blocks = np.cumsum(new_block)
+  blocks -= 1
+  indices = shift.take(blocks).reshape(draws, length)
+  indices += np.arange(length)
+  indices[indices >= length] -= length
+  return indices
+
+
+def _sharpe(values, scale):
+  # Along the last axis, as `calc_sharpe`: the sample std (ddof=1), from the centered values for the precision.
+  count = values.shape[-1]
+  mean = values.mean(axis=-1)
+  centered = values - mean[..., None]
+  with np.errstate(divide='ignore', invalid='ignore'):
+    return scale * mean / np.sqrt(np.einsum('...i,...i->...', centered, centered) / (count - 1))
+
+
+def _bootstrap_one(values, scale, seed, draws, block, kind):
+  random = np.random.RandomState(seed)
+  length = len(values)
+  if length < 2:
+    return np.full(draws, np.nan)
+  chunk = max(1, MAX_ELEMENTS // max(length, 1))
+  resampled = np.empty(draws)
+  for begin in range(0, draws, chunk):
+    count = min(chunk, draws - begin)
+    resampled[begin:begin + count] = _sharpe(values[_indices(random, length, count, block, kind)], scale)
+  return resampled
+
+
+def _series(returns):
+  if isinstance(returns, pd.DataFrame):
+    returns = {ticker: returns[ticker] for ticker in returns.columns}
+  return {ticker: np.asarray(series, dtype=np.float64) for ticker, series in returns.items()}
+
+
+def bootstrap_sharpe(returns, draws=5000, block=None, kind='stationary', level=0.95, seed=0, workers=1,
+                     alternative='two-sided'):
+  # `returns` is a (bars x tickers) panel (NaN where not listed, e.g. `analysis.panel_returns`) or {ticker: returns}.
+  # `block` is the mean block length, n ** (1/3) of each ticker by default.
+  # The p-value is of the null Sharpe = 0: the resampled Sharpe ratios are centered at the estimate and
+  # compared with it, two-sided or 'greater' (the Sharpe is positive).
+  series = _series(returns)
+  tickers = list(series)
+  seeds = np.random.RandomState(seed).randint(0, 2 ** 31 - 1, size=len(tickers))
+  tasks = []
+  for ticker, ticker_seed in zip(tickers, seeds):
+    values = series[ticker]
+    values = values[np.isfinite(values)]
+    ticker_block = block or max(1, int(round(len(values) ** (1.0 / 3))))
+    tasks.append((values, np.sqrt(len(values) + 1), ticker_seed, draws, ticker_block, kind))
+
+  if workers > 1:
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+      resampled = list(executor.map(_bootstrap_one, *zip(*tasks))) if tasks else []
+  else:
+    resampled = [_bootstrap_one(*task) for task in tasks]
+
+  rows = []
+  tail = (1 - level) / 2 * 100
+  for (values, scale, _, _, ticker_block, _), sharpes in zip(tasks, resampled):
+    estimate = _sharpe(values, scale) if len(values) > 1 else np.nan
+    sharpes = sharpes[np.isfinite(sharpes)]
+    if not np.isfinite(estimate) or len(sharpes) < 2:
+      rows.append((estimate, np.nan, np.nan, np.nan, np.nan, len(values), ticker_block))
+      continue
+    if alternative == 'two-sided':
+      p_value = np.mean(np.abs(sharpes - estimate) >= abs(estimate))
+    elif alternative == 'greater':
+      p_value = np.mean(sharpes - estimate >= estimate)
+    else:
+      raise ValueError('Unknown alternative: %s' % alternative)
+    low, high = np.percentile(sharpes, [tail, 100 - tail])
+    rows.append((estimate, low, high, sharpes.std(ddof=1), p_value, len(values), ticker_block))
+  columns = ['sharpe', 'ci_low', 'ci_high', 'std_error', 'p_value', 'nobs', 'block']
+  return pd.DataFrame(rows, index=pd.Index(tickers, name='ticker'), columns=columns)
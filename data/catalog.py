@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from contextlib import contextmanager
+import glob
+import hashlib
+import os
+import sqlite3
+
+from data.fetcher import row_timestamp
+
+__author__ = 'maxim'
+
+
+# Persistent index of the stored series: which file covers which ticker/period and date range.
+# The lookups go through the SQLite index, the storage directory isn't scanned. The paths are absolute,
+# and an entry whose file has changed since it was registered (size or mtime) is refreshed on lookup,
+# or dropped if the file is gone, so a writer that doesn't register its files can't make it stale.
+
+CATALOG_NAME = 'catalog.sqlite'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS series (
+  path TEXT PRIMARY KEY,
+  ticker TEXT NOT NULL,
+  period TEXT NOT NULL,
+  first_ts TEXT,
+  last_ts TEXT,
+  rows INTEGER NOT NULL,
+  size INTEGER NOT NULL,
+  mtime REAL NOT NULL,
+  checksum TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS series_coverage ON series (ticker, period, first_ts, last_ts);
+'''
+
+
+def describe(path):
+  # Checksum and row count in one pass, the first/last timestamps from the head and the tail.
+  digest = hashlib.sha1()
+  newlines = 0
+  last_byte = b''
+  with open(path, 'rb') as file:
+    for block in iter(lambda: file.read(1 << 20), b''):
+      digest.update(block)
+      newlines += block.count(b'\n')
+      last_byte = block[-1:]
+    file.seek(0)
+    head = file.read(4096).split(b'\n')[:2]
+    file.seek(max(0, os.path.getsize(path) - 4096))
+    tail = [line for line in file.read().split(b'\n') if line.strip()]
+  rows = max(newlines + (last_byte not in (b'', b'\n')) - 1, 0)  # without the header
+  first = next((ts for ts in map(row_timestamp, head) if ts is not None), None)
+  last = row_timestamp(tail[-1]) if tail else None
+  first_ts = first.isoformat(' ') if first else None
+  last_ts = last.isoformat(' ') if last else None
+  return first_ts, last_ts, rows, digest.hexdigest()
+
+
+def split_name(path):
+  # `SBER_day.txt` and `SBER_2000-01-01_2018-07-21_day.txt` -> ('SBER', 'day').
+  parts = os.path.splitext(os.path.basename(path))[0].split('_')
+  return parts[0], parts[-1]
+
+
+class Catalog(object):
+  def __init__(self, path):
+    self.path = path
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+      os.makedirs(directory)
+    with self._connect() as connection:
+      connection.executescript(SCHEMA)
+
+  @contextmanager
+  def _connect(self):
+    # A connection per operation: the catalog is updated from the download threads.
+    connection = sqlite3.connect(self.path, timeout=30)
+    try:
+      with connection:  # commit or roll back
+        yield connection
+    finally:
+      connection.close()
+
+  def register(self, path):
+    ticker, period = split_name(path)
+    first_ts, last_ts, rows, checksum = describe(path)
+    stat = os.stat(path)
+    with self._connect() as connection:
+      connection.execute('INSERT OR REPLACE INTO series VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                         (os.path.abspath(path), ticker, period, first_ts, last_ts, rows,
+                          stat.st_size, stat.st_mtime, checksum))
+
+  def remove(self, path):
+    with self._connect() as connection:
+      connection.execute('DELETE FROM series WHERE path = ?', (os.path.abspath(path), ))
+
+  def rebuild(self, storage, pattern='*.txt'):
+    for path in glob.glob(os.path.join(storage, pattern)):
+      self.register(path)
+
+  def _refresh(self, ticker, period):
+    with self._connect() as connection:
+      entries = connection.execute('SELECT path, size, mtime FROM series WHERE ticker = ? AND period = ?',
+                                   (ticker, period.slug())).fetchall()
+    for path, size, mtime in entries:
+      if not os.path.exists(path):
+        self.remove(path)
+        continue
+      stat = os.stat(path)
+      if stat.st_size != size or stat.st_mtime != mtime:
+        self.register(path)
+
+  def find(self, ticker, period, start=None, end=None):
+    # The files of the ticker/period that cover [start, end], the longest coverage first.
+    self._refresh(ticker, period)
+    query = 'SELECT path, first_ts, last_ts, rows FROM series WHERE ticker = ? AND period = ?'
+    args = [ticker, period.slug()]
+    if start is not None:
+      query += ' AND first_ts <= ?'
+      args.append(str(start))
+    if end is not None:
+      query += ' AND last_ts >= ?'
+      args.append(str(end))
+    query += ' ORDER BY last_ts DESC, first_ts ASC'
+    with self._connect() as connection:
+      return connection.execute(query, args).fetchall()
+
+  def latest(self, ticker, period):
+    found = self.find(ticker, period)
+    return found[0][0] if found else None
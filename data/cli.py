@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+
+_START = time.time()
+
+import argparse
+from functools import partial
+import os
+import sys
+
+__author__ = 'maxim'
+
+
+# One entry point for the batch commands:
+#
+#   python -m data.cli fetch --period day --tickers SBER GAZP
+#   python -m data.cli load SBER --period hour
+#   python -m data.cli analyse --workers 4 --bootstrap 5000
+#   python -m data.cli poll --tickers SBER GAZP --periods 1min hour
+#
+# Only the modules of the chosen command are imported, `--timing` reports the startup and the run time.
+
+def _period(slug):
+  from data.fetcher import Period
+  periods = {period.slug(): period for period in Period}
+  if slug not in periods:
+    raise argparse.ArgumentTypeError('unknown period %s, expected one of: %s' % (slug, ', '.join(periods)))
+  return periods[slug]
+
+
+def _fetch(args):
+  from data import events
+  from data.fetcher import EXPORT_HOST, print_summary, update_all
+  with events.profile(args.profile):
+    results = update_all(args.tickers, _period(args.period), path=args.storage, workers=args.workers,
+                         host=args.host or EXPORT_HOST)
+  print_summary(results)
+  return int(any(result.status == 'failed' for result in results))
+
+
+def _load(args):
+  from data.fetcher import canonical_name
+  from data.loader import load
+  path = args.source
+  if not os.path.exists(path):
+    path = os.path.join(args.storage, canonical_name(args.source, _period(args.period)))
+  df = load(path, cache=not args.no_cache)
+  print('%s: %d rows' % (path, len(df)))
+  print(df.tail(args.rows))
+  return 0
+
+
+def _analyse(args):
+  import pandas as pd
+  from data.analysis import process, run_parallel
+  memo = None
+  if args.memo:
+    from data.memo import Memo
+    memo = Memo(os.path.join(args.storage, 'memo'))
+  results = run_parallel(args.tickers, func=partial(process, storage=args.storage, memo=memo), workers=args.workers)
+  rows = [(result.ticker, ) + result.value + (result.elapsed, ) for result in results if result.error is None]
+  print(pd.DataFrame(rows, columns=['ticker', 'std', 'mean', 'sharpe', 'elapsed']))
+  for result in results:
+    if result.error is not None:
+      print('Failed %s: %s' % (result.ticker, result.error))
+  if args.bootstrap:
+    from data.analysis import get_returns, guess_path
+    from data.bootstrap import bootstrap_sharpe
+    returns = {}
+    for result in results:
+      if result.error is None:
+        path = guess_path(result.ticker, args.storage)
+        returns[result.ticker] = (memo.call(get_returns, path) if memo is not None else get_returns(path))['close_return']
+    print(bootstrap_sharpe(returns, draws=args.bootstrap, workers=args.workers or 1))
+  if memo is not None:
+    counts, size = memo.stats()
+    for name, (hits, misses, evictions) in counts.items():
+      print('memo %s: %d hits, %d misses, %d evicted' % (name, hits, misses, evictions))
+    print('memo size: %d Kb' % (size / 1024))
+  return int(any(result.error is not None for result in results))
+
+
+def _poll(args):
+  import asyncio
+  from data import events
+  from data.fetcher import EXPORT_HOST
+  from data.poller import Poller
+  feeds = [(ticker, _period(slug)) for ticker in args.tickers for slug in args.periods]
+  store = None
+  if args.store:
+    from data.store import BarStore
+    store = BarStore(os.path.join(args.storage, 'bars'))
+  poller = Poller(feeds, storage=args.storage, host=args.host or EXPORT_HOST, store=store, history_days=args.history_days,
+                  status_path=os.path.join(args.storage, 'poll_status.json'))
+  with events.profile(args.profile):
+    try:
+      asyncio.run(poller.run())
+    except KeyboardInterrupt:
+      events.log('Stopped')
+  return 0
+
+
+def main(argv=None):
+  from data.instruments import MAIN_EQUITIES
+
+  parser = argparse.ArgumentParser(description='Finam market data: fetch, load and analyse')
+  parser.add_argument('--storage', default='.storage')
+  parser.add_argument('--quiet', action='store_true', help='no progress output')
+  parser.add_argument('--timing', action='store_true', help='report the startup and the run time to stderr')
+  commands = parser.add_subparsers(dest='command')
+
+  fetch = commands.add_parser('fetch', help='download or update the canonical files')
+  fetch.add_argument('--tickers', nargs='+', default=MAIN_EQUITIES)
+  fetch.add_argument('--period', default='day')
+  fetch.add_argument('--workers', type=int, default=8)
+  fetch.add_argument('--profile', help='write the timing report (JSON) to this path')
+  fetch.add_argument('--host', help='the export endpoint, e.g. a local fake one')
+  fetch.set_defaults(run=_fetch)
+
+  load = commands.add_parser('load', help='parse a file (or a ticker in the storage) and show the last bars')
+  load.add_argument('source', help='a path or a ticker')
+  load.add_argument('--period', default='day')
+  load.add_argument('--rows', type=int, default=10)
+  load.add_argument('--no-cache', action='store_true')
+  load.set_defaults(run=_load)
+
+  analyse = commands.add_parser('analyse', help='daily Sharpe ratios of the tickers')
+  analyse.add_argument('--tickers', nargs='+', default=MAIN_EQUITIES)
+  analyse.add_argument('--workers', type=int)
+  analyse.add_argument('--memo', action='store_true', help='reuse the returns computed by the previous runs')
+  analyse.add_argument('--bootstrap', type=int, metavar='DRAWS', help='confidence intervals and p-values of the Sharpe ratios')
+  analyse.set_defaults(run=_analyse)
+
+  poll = commands.add_parser('poll', help='keep the files up to date during the trading session')
+  poll.add_argument('--tickers', nargs='+', default=MAIN_EQUITIES)
+  poll.add_argument('--periods', nargs='+', default=['1min'])
+  poll.add_argument('--history-days', type=int, help='the history to download for a new feed (default: all)')
+  poll.add_argument('--store', action='store_true', help='update the column store too')
+  poll.add_argument('--host', help='the export endpoint, e.g. a local fake one')
+  poll.add_argument('--profile', help='write the timing report (JSON) to this path on exit')
+  poll.set_defaults(run=_poll)
+
+  args = parser.parse_args(argv)
+  if not args.command:
+    parser.print_help()
+    return 2
+  if args.quiet:
+    from data import events
+    events.set_quiet()
+
+  started = time.time()
+  try:
+    code = args.run(args)
+  except argparse.ArgumentTypeError as e:  # the periods are checked by the command, not to import it on parsing
+    parser.error(str(e))
+  if args.timing:
+    sys.stderr.write('startup %.3fs, %s %.3fs\n' % (started - _START, args.command, time.time() - started))
+  return code
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from collections import namedtuple
+from contextlib import contextmanager
+import json
+import os
+import tempfile
+import threading
+
+from six.moves import http_client
+from six.moves.urllib.parse import urljoin, urlsplit
+
+__author__ = 'maxim'
+
+
+# HTTP client of the fetcher: the keep-alive connections are pooled per host and shared by the jobs,
+# the downloads are resumable and conditional. The state of a download is kept next to the file:
+#
+#   <file>.part       the bytes received so far, resumed with `Range` (`If-Range` guards against a changed resource)
+#   <file>.http.json  the validators (ETag, Last-Modified) of the stored file and of the part, and whether
+#                     the stored export is empty
+#
+# A file is stored (renamed from the part) only when it is complete: the length is the announced one
+# and the last row is whole, or the whole export is just the header (a range without trading).
+
+Download = namedtuple('Download', ['status', 'path', 'size', 'received'])  # 'ok', 'resumed', 'not-modified', 'cached'
+
+BLOCK_SIZE = 64 * 1024
+PART_SUFFIX = '.part'
+META_SUFFIX = '.http.json'
+MAX_REDIRECTS = 5
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+
+class FetchError(IOError):
+  def __init__(self, url, status, reason):
+    super(FetchError, self).__init__('%s %s: %s' % (status, reason, url))
+    self.url = url
+    self.status = status
+
+
+def is_complete(path, expected_size=None, empty=False):
+  # A Finam export ends with a whole row (9 fields, the volume is an integer). Just the header is a whole transfer
+  # too (the days without trading), accepted with `empty`: see `is_stored` for the stored files.
+  size = os.path.getsize(path)
+  if not size or (expected_size is not None and size != expected_size):
+    return False
+  with open(path, 'rb') as file:
+    file.seek(max(0, size - 4096))
+    lines = [line for line in file.read().splitlines() if line.strip()]
+  if not lines:
+    return False
+  if lines[-1].startswith(b'<'):
+    return empty
+  fields = lines[-1].split(b',')
+  return len(fields) == 9 and fields[-1].strip().isdigit()
+
+
+def _load_meta(path):
+  try:
+    with open(path) as file:
+      return json.load(file)
+  except (IOError, OSError, ValueError):
+    return {}
+
+
+def _save_meta(path, meta):
+  fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+  with os.fdopen(fd, 'w') as file:
+    json.dump(meta, file)
+  os.replace(tmp_path, path)
+
+
+def is_stored(path):
+  # A complete stored file. A header-only one counts only when `download` has recorded it as an empty export,
+  # not when it is left by something else (e.g. a stub of a new series).
+  if not os.path.exists(path):
+    return False
+  stored = _load_meta(path + META_SUFFIX).get('stored') or {}
+  return is_complete(path, empty=bool(stored.get('empty')))
+
+
+def _validators(response):
+  return {'etag': response.getheader('ETag'), 'last_modified': response.getheader('Last-Modified')}
+
+
+def _remove(path):
+  if os.path.exists(path):
+    os.remove(path)
+
+
+class Client(object):
+  def __init__(self, timeout=60, max_idle=8):
+    self.timeout = timeout
+    self.max_idle = max_idle  # idle connections kept per host
+    self._lock = threading.Lock()
+    self._idle = {}
+
+  def _acquire(self, key):
+    with self._lock:
+      idle = self._idle.get(key)
+      if idle:
+        return idle.pop(), True
+    scheme, netloc = key
+    factory = http_client.HTTPSConnection if scheme == 'https' else http_client.HTTPConnection
+    return factory(netloc, timeout=self.timeout), False
+
+  def _release(self, key, connection, response):
+    if not response.will_close:
+      with self._lock:
+        idle = self._idle.setdefault(key, [])
+        if len(idle) < self.max_idle:
+          idle.append(connection)
+          return
+    connection.close()
+
+  def close(self):
+    with self._lock:
+      connections = [connection for idle in self._idle.values() for connection in idle]
+      self._idle.clear()
+    for connection in connections:
+      connection.close()
+
+  def _request(self, key, target, headers, timeout):
+    while True:
+      connection, reused = self._acquire(key)
+      connection.timeout = timeout
+      if connection.sock is not None:
+        connection.sock.settimeout(timeout)
+      try:
+        connection.request('GET', target, headers=headers)
+        return connection, connection.getresponse()
+      except (http_client.BadStatusLine, ConnectionError):
+        connection.close()
+        if not reused:
+          raise
+        # the server has dropped an idle connection, try the next one
+
+  def _send(self, url, headers, timeout):
+    for _ in range(MAX_REDIRECTS + 1):
+      parts = urlsplit(url)
+      key = (parts.scheme, parts.netloc)
+      target = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+      connection, response = self._request(key, target, headers, timeout)
+      location = response.getheader('Location')
+      if response.status not in REDIRECT_CODES or not location:
+        return key, connection, response
+      response.read()
+      self._release(key, connection, response)
+      url = urljoin(url, location)
+    raise FetchError(url, response.status, 'too many redirects')
+
+  @contextmanager
+  def open(self, url, headers=None, timeout=None):
+    # Yields the response after the redirects. The connection goes back to the pool if the body is read whole.
+    key, connection, response = self._send(url, headers or {}, timeout or self.timeout)
+    try:
+      yield response
+    except BaseException:
+      connection.close()
+      raise
+    if response.isclosed():
+      self._release(key, connection, response)
+    else:
+      connection.close()
+
+  def get(self, url, headers=None, timeout=None):
+    with self.open(url, headers, timeout) as response:
+      body = response.read()
+      if response.status != 200:
+        raise FetchError(url, response.status, response.reason)
+      return body
+
+  def download(self, url, full_path, refresh=False, timeout=None, progress=None):
+    # An existing complete file is kept as is, unless `refresh` asks to revalidate it with the server
+    # (a conditional request with its validators, an unconditional one without them).
+    # `progress(bytes_so_far, total_or_-1)` is called after every block.
+    part_path = full_path + PART_SUFFIX
+    meta_path = full_path + META_SUFFIX
+    meta = _load_meta(meta_path)
+    exists = is_stored(full_path)
+    if exists and not refresh:
+      return Download('cached', full_path, os.path.getsize(full_path), 0)
+
+    headers = {}
+    if exists:
+      stored = meta.get('stored') or {}
+      if stored.get('etag'):
+        headers['If-None-Match'] = stored['etag']
+      if stored.get('last_modified'):
+        headers['If-Modified-Since'] = stored['last_modified']
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    part = meta.get('part') or {}
+    if offset:
+      headers['Range'] = 'bytes=%d-' % offset
+      if part.get('etag') or part.get('last_modified'):
+        headers['If-Range'] = part.get('etag') or part.get('last_modified')
+
+    received = 0
+    with self.open(url, headers, timeout) as response:
+      if response.status == 304:
+        response.read()
+        _remove(part_path)
+        return Download('not-modified', full_path, os.path.getsize(full_path), 0)
+      if response.status == 416:
+        # Nothing after `offset`: the part must be the whole resource already.
+        response.read()
+        total = response.getheader('Content-Range', '').rpartition('/')[2]
+        total = int(total) if total.isdigit() else None
+      elif response.status in (200, 206):
+        if response.status == 206:
+          # Content-Range: bytes <first>-<last>/<total>
+          span, _, total = response.getheader('Content-Range', '').partition(' ')[2].partition('/')
+          if int(span.partition('-')[0]) != offset:
+            response.read()
+            _remove(part_path)
+            raise FetchError(url, response.status, 'unexpected range %s' % span)
+          total = int(total) if total.isdigit() else None
+          part = dict(part, total=total)
+        else:
+          offset = 0
+          length = response.getheader('Content-Length')
+          part = dict(_validators(response), total=int(length) if length else None)
+        total = part['total']
+        meta['part'] = part
+        _save_meta(meta_path, meta)
+        with open(part_path, 'ab' if offset else 'wb') as output:
+          while True:
+            block = response.read(BLOCK_SIZE)
+            if not block:
+              break
+            output.write(block)
+            received += len(block)
+            if progress is not None:
+              progress(offset + received, total if total is not None else -1)
+      else:
+        response.read()
+        raise FetchError(url, response.status, response.reason)
+
+    if not os.path.exists(part_path) or not is_complete(part_path, total, empty=True):
+      if response.status == 416:
+        _remove(part_path)  # the server can't continue it, start over next time
+      raise FetchError(url, response.status, 'incomplete download, %d bytes received' % received)
+    empty = not is_complete(part_path, total)
+    os.replace(part_path, full_path)
+    _save_meta(meta_path, {'stored': {'etag': part.get('etag'), 'last_modified': part.get('last_modified'),
+                                      'empty': empty}})
+    return Download('resumed' if offset else 'ok', full_path, os.path.getsize(full_path), received)
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_client():
+  # One pool for the whole process, so that the jobs reuse each other's connections.
+  global _shared
+  with _shared_lock:
+    if _shared is None:
+      _shared = Client()
+    return _shared
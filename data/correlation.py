@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+__author__ = 'maxim'
+
+
+# Rolling covariance and correlation matrices across the universe, e.g. over `analysis.panel_returns(...)`.
+# Every pair uses only the bars where both tickers have a value (as pandas `rolling(...).cov()` does),
+# so each window is described by the N x N sums over the masked rows:
+#
+#   n = V'V,  Sx = X'V,  Sxx = (X*X)'V,  Sxy = X'X      (X: the values with NaN -> 0, V: the validity mask)
+#
+# The sums are moved from one emitted bar to the next by adding the new rows and subtracting the rows that
+# left the window. Only the last `window + stride` rows are kept, the memory doesn't depend on the length
+# of the history.
+
+RollingResult = namedtuple('RollingResult', ['index', 'cov', 'corr', 'nobs'])
+
+# The sums are recomputed from the window rows after this many windows of updates, so that the rounding
+# errors of adding and subtracting don't accumulate over long histories.
+REFRESH_WINDOWS = 16
+
+# Up to this stride the sums at the emitted bars are taken from the cumulative sums of the per-row products
+# (vectorized over the bars, the temporaries are bounded by BATCH_BYTES), above it by a product per emission.
+SMALL_STRIDE = 2
+BATCH_BYTES = 4 * 1024 * 1024
+
+
+def _masked(rows):
+  valid = np.isfinite(rows)
+  return valid.astype(np.float64), np.where(valid, rows, 0.0)
+
+
+def _moments(rows):
+  mask, values = _masked(rows)
+  return np.stack([np.dot(mask.T, mask), np.dot(values.T, mask), np.dot((values * values).T, mask),
+                   np.dot(values.T, values)])
+
+
+class RollingMoments(object):
+  def __init__(self, size, window, stride=1, min_periods=None):
+    # Emits the matrices at the bars t = stride - 1, 2 * stride - 1, ... over the rows (t - window, t].
+    self.size = size
+    self.window = window
+    self.stride = stride
+    self.min_periods = min_periods or window
+    self._tail = np.empty((0, size))
+    self._seen = 0
+    self._at = -1
+    self._sums = None
+    self._updated = 0
+
+  def _stats(self, sums):
+    # sums: (4, ..., N, N) -> cov, corr, nobs (..., N, N)
+    n, sx, sxx, sxy = sums
+    with np.errstate(divide='ignore', invalid='ignore'):
+      cov = sx * np.swapaxes(sx, -1, -2)
+      cov /= n
+      np.subtract(sxy, cov, out=cov)
+      cov /= n - 1
+      var_x = sx * sx
+      var_x /= n
+      np.subtract(sxx, var_x, out=var_x)
+      var_x /= n - 1
+      var_x *= np.swapaxes(var_x, -1, -2)  # times the variance of the column ticker over the same pairwise rows
+      np.sqrt(var_x, out=var_x)
+      corr = np.divide(cov, var_x, out=var_x)
+    few = n < self.min_periods
+    cov[few] = np.nan
+    corr[few] = np.nan
+    return cov, corr, n.astype(np.int64)
+
+  def _rows(self, data, offset, begin, end):
+    # The absolute rows [begin, end), the ones before the first bar are NaN (contribute nothing).
+    rows = np.full((end - begin, self.size), np.nan)
+    if end > 0:
+      rows[max(begin, 0) - begin:] = data[max(begin, 0) - offset:end - offset]
+    return rows
+
+  def _advance(self, data, offset, points):
+    # The sums at the consecutive emitted `points` after `self._at`, via the cumulative sums of
+    # (the products of the row entering the window) - (the products of the row leaving it).
+    begin, end = self._at + 1, points[-1] + 1
+    mask_in, values_in = _masked(self._rows(data, offset, begin, end))
+    mask_out, values_out = _masked(self._rows(data, offset, begin - self.window, end - self.window))
+    factors = [(mask_in, mask_in, mask_out, mask_out), (values_in, mask_in, values_out, mask_out),
+               (values_in * values_in, mask_in, values_out * values_out, mask_out),
+               (values_in, values_in, values_out, values_out)]
+    sums = np.empty((4, len(points), self.size, self.size))
+    for k, (left_in, right_in, left_out, right_out) in enumerate(factors):
+      term = left_in[:, :, None] * right_in[:, None, :]
+      term -= left_out[:, :, None] * right_out[:, None, :]
+      np.cumsum(term, axis=0, out=term)
+      np.add(term[points - begin], self._sums[k], out=sums[k])
+    return sums
+
+  def _step(self, data, offset, at):
+    start = max(at - self.window + 1, 0)
+    added = _moments(data[self._at + 1 - offset:at + 1 - offset])
+    removed = _moments(data[max(self._at - self.window + 1, 0) - offset:start - offset])
+    return self._sums + added - removed
+
+  def update(self, block):
+    # Feeds the next bars (rows x tickers), returns [(bar number, cov, corr, nobs)] of the bars emitted in it.
+    block = np.asarray(block, dtype=np.float64).reshape(-1, self.size)
+    data = np.concatenate([self._tail, block])
+    offset = self._seen - len(self._tail)
+    end = self._seen + len(block)
+    points = np.arange(self._seen + (-(self._seen + 1)) % self.stride, end, self.stride)
+    batch = max(1, BATCH_BYTES // (2 * 4 * 8 * self.size ** 2 * self.stride))
+
+    results = []
+    i = 0
+    while i < len(points):
+      at = points[i]
+      step = at - self._at
+      if self._sums is None or step >= self.window or self._updated + step > REFRESH_WINDOWS * self.window:
+        self._sums = _moments(data[max(at - self.window + 1, 0) - offset:at + 1 - offset])
+        self._updated = 0
+        sums, chunk = self._sums[:, None], points[i:i + 1]
+      elif self.stride <= SMALL_STRIDE:
+        chunk = points[i:i + batch]
+        sums = self._advance(data, offset, chunk)
+        self._sums = sums[:, -1]
+        self._updated += chunk[-1] - self._at
+      else:
+        chunk = points[i:i + 1]
+        self._sums = self._step(data, offset, at)
+        self._updated += step
+        sums = self._sums[:, None]
+      self._at = chunk[-1]
+      cov, corr, nobs = self._stats(sums)
+      results.extend(zip(chunk.tolist(), cov, corr, nobs))
+      i += len(chunk)
+
+    self._tail = data[-(self.window + self.stride):]
+    self._seen = end
+    return results
+
+
+def iter_rolling(chunks, window, stride=1, min_periods=None):
+  # `chunks` is a (bars x tickers) frame or an iterable of them with the same columns, e.g. read month by month.
+  # Yields (timestamp, cov, corr, nobs) at every `stride` bars.
+  if isinstance(chunks, pd.DataFrame):
+    chunks = [chunks]
+  moments = None
+  base = 0
+  for chunk in chunks:
+    if moments is None:
+      moments = RollingMoments(chunk.shape[1], window, stride, min_periods)
+    emitted = moments.update(chunk.values)
+    if emitted:
+      labels = chunk.index[[item[0] - base for item in emitted]]
+      for label, (_, cov, corr, nobs) in zip(labels, emitted):
+        yield label, cov, corr, nobs
+    base += len(chunk)
+
+
+def rolling_cov_corr(returns, window, stride=1, min_periods=None):
+  # All the emitted matrices stacked: cov, corr (T, N, N) and nobs. For the long histories with a small stride
+  # the output itself is the memory bound, consume `iter_rolling` instead.
+  emitted = list(iter_rolling(returns, window, stride, min_periods))
+  size = returns.shape[1]
+  if not emitted:
+    empty = np.empty((0, size, size))
+    return RollingResult(returns.index[:0], empty, empty, empty.astype(np.int64))
+  index, cov, corr, nobs = zip(*emitted)
+  return RollingResult(pd.Index(index, name=returns.index.name), np.stack(cov), np.stack(corr), np.stack(nobs))
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from collections import defaultdict
+from contextlib import contextmanager
+import json
+import os
+import sys
+import threading
+import time
+
+__author__ = 'maxim'
+
+
+# Instrumentation of the fetch, parse and compute stages. The code emits named events with fields
+# (`bytes`, `rows`, `elapsed`, `message`, ...), the listeners decide what to do with them: the console
+# prints the messages and the download progress (`path`, `bytes`, `total`), `Metrics` aggregates the numbers.
+#
+# Events: fetch.progress, fetch.done, fetch.retry, fetch.failed, fetch.cached, cache.hit, cache.miss,
+#         parse, compute.returns, compute.changes, memo.hit, memo.miss, memo.evict, poll.done, poll.failed, log.
+
+_listeners = []
+_lock = threading.Lock()
+
+
+def subscribe(listener):
+  with _lock:
+    _listeners.append(listener)
+  return listener
+
+
+def unsubscribe(listener):
+  with _lock:
+    if listener in _listeners:
+      _listeners.remove(listener)
+
+
+def emit(name, **fields):
+  if not _listeners:
+    return
+  for listener in list(_listeners):
+    listener(name, fields)
+
+
+def log(message):
+  emit('log', message=message)
+
+
+@contextmanager
+def stage(name, **fields):
+  # Times the block and emits `name` with `elapsed`; the block can add the fields, e.g. `rows`.
+  start = time.time()
+  try:
+    yield fields
+  finally:
+    emit(name, elapsed=time.time() - start, **fields)
+
+
+class Console(object):
+  # The messages go to stdout. The download progress goes to stderr, one whole line per download and step
+  # (every PROGRESS_STEP percent, or PROGRESS_BYTES when the size is unknown) named by its file, so that
+  # the concurrent downloads don't garble each other's lines.
+  PROGRESS_STEP = 10
+  PROGRESS_BYTES = 1 << 20
+
+  def __init__(self, stream=None, progress_stream=None):
+    self.stream = stream
+    self.progress_stream = progress_stream
+    self._lock = threading.Lock()
+    self._reported = {}  # path -> the last reported step
+
+  def __call__(self, name, fields):
+    if name == 'log':
+      (self.stream or sys.stdout).write('%s\n' % fields['message'])
+    elif name == 'fetch.progress':
+      self._progress(fields.get('path'), fields['bytes'], fields['total'])
+
+  def _progress(self, path, read_so_far, total_size):
+    finished = 0 < total_size <= read_so_far
+    step = read_so_far * 100 // (total_size * self.PROGRESS_STEP) if total_size > 0 else \
+      read_so_far // self.PROGRESS_BYTES
+    with self._lock:
+      if not finished and self._reported.get(path, -1) >= step:
+        return
+      if finished:
+        self._reported.pop(path, None)
+      else:
+        self._reported[path] = step
+    label = os.path.basename(path) if path else 'download'
+    if total_size > 0:
+      line = '%s %5.1f%% %*d / %d\n' % (label, read_so_far * 1e2 / total_size, len(str(total_size)), read_so_far,
+                                        total_size)
+    else:  # total size is unknown
+      line = '%s read %d\n' % (label, read_so_far)
+    (self.progress_stream or sys.stderr).write(line)
+
+
+console = subscribe(Console())
+
+
+def set_quiet(quiet=True):
+  # Quiet mode for the batch jobs: no messages and no progress, the other listeners still get the events.
+  if quiet:
+    unsubscribe(console)
+  elif console not in _listeners:
+    subscribe(console)
+
+
+class Metrics(object):
+  def __init__(self):
+    self._lock = threading.Lock()
+    self.counts = defaultdict(int)
+    self.totals = defaultdict(lambda: defaultdict(float))
+    self.latencies = defaultdict(list)
+    self.lags = {}  # name -> the last and the max `lag` (seconds the data is behind)
+
+  def __call__(self, name, fields):
+    if name in ('log', 'fetch.progress'):
+      return
+    with self._lock:
+      self.counts[name] += 1
+      for key in ('bytes', 'rows'):
+        if key in fields:
+          self.totals[name][key] += fields[key]
+      if 'elapsed' in fields:
+        self.latencies[name].append(fields['elapsed'])
+      if fields.get('lag') is not None:
+        last, worst = fields['lag'], self.lags.get(name, {}).get('max_lag', 0.0)
+        self.lags[name] = {'lag': last, 'max_lag': max(worst, last)}
+
+  def summary(self):
+    report = {}
+    with self._lock:
+      for name, count in sorted(self.counts.items()):
+        item = dict(count=count, **self.totals[name])
+        item.update(self.lags.get(name, {}))
+        latencies = self.latencies.get(name)
+        if latencies:
+          total = sum(latencies)
+          item.update(seconds=total, mean_seconds=total / len(latencies), max_seconds=max(latencies))
+          for key in ('bytes', 'rows'):
+            if key in item and total > 0:
+              item['%s_per_sec' % key] = item[key] / total
+        report[name] = item
+    return report
+
+
+@contextmanager
+def profile(path=None):
+  # Collects the metrics of the block and writes the timing report to `path` (JSON), if given.
+  metrics = subscribe(Metrics())
+  start = time.time()
+  try:
+    yield metrics
+  finally:
+    unsubscribe(metrics)
+    if path:
+      with open(path, 'w') as file:
+        json.dump({'wall_seconds': time.time() - start, 'stages': metrics.summary()}, file, indent=2)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+
+from data.fetcher import Period
+from data.resample import bucket_keys
+
+__author__ = 'maxim'
+
+
+# Per-session features from the intraday bars of many tickers at once, in the spirit of `strategy1`:
+#
+#   first_close_return, first_high_return, first_low_return
+#                      the close / the highest high / the lowest low of the first N bars vs the previous session close
+#   gap                the session open vs the previous session close
+#   close_return_lagK  the daily close return K sessions ago
+#
+# and the targets `close_return`, `high_return` (daily `pct_change` of the close and the high, as `to_returns`).
+# All tickers are stacked into one array, the sessions are found from the changes of (ticker, day),
+# every feature is a reduction or a shift over the session boundaries.
+
+def _stack(bars):
+  if isinstance(bars, dict):
+    frames = [df.assign(ticker=ticker) for ticker, df in bars.items()]
+    bars = pd.concat(frames, ignore_index=True)
+  bars = bars.assign(ticker=bars['ticker'].astype(str))
+  return bars.sort_values(['ticker', 'timestamp'], kind='mergesort')
+
+
+def _shift(values, owners, lag):
+  # values[i - lag] where it belongs to the same ticker as values[i], NaN otherwise.
+  if lag < 0:
+    raise ValueError('Negative lag: %d' % lag)
+  if lag == 0:
+    return values.astype(np.float64)
+  result = np.full(len(values), np.nan)
+  if lag < len(values):
+    same = owners[lag:] == owners[:-lag]
+    result[lag:] = np.where(same, values[:-lag], np.nan)
+  return result
+
+
+def build_features(bars, first_bars=1, lags=(1, ), session_shift=None):
+  # `bars` is a dict {ticker: intraday frame} or one frame with the `ticker` column (the `loader.load` layout).
+  df = _stack(bars)
+  size = len(df)
+  codes, names = pd.factorize(df['ticker'].values)
+  days = bucket_keys(df['timestamp'].values, Period.DAY, session_shift)
+  new_session = np.r_[True, (codes[1:] != codes[:-1]) | (days[1:] != days[:-1])] if size else np.array([], bool)
+  starts = np.flatnonzero(new_session)
+  ends = np.r_[starts[1:], size] - 1
+  columns = ['first_close_return', 'first_high_return', 'first_low_return', 'gap'] + \
+            ['close_return_lag%d' % lag for lag in lags] + ['close_return', 'high_return']
+  if not size:
+    return pd.DataFrame(columns=columns, index=pd.MultiIndex.from_arrays([[], []], names=['ticker', 'day']))
+
+  position = np.arange(size) - np.repeat(starts, ends - starts + 1)
+  in_first = position < first_bars
+  high = df['high'].values.astype(np.float64)
+  low = df['low'].values.astype(np.float64)
+  close = df['close'].values.astype(np.float64)
+
+  owners = codes[starts]
+  session_open = df['open'].values[starts].astype(np.float64)
+  session_close = close[ends]
+  session_high = np.maximum.reduceat(high, starts)
+  first_close = close[starts + np.minimum(first_bars, ends - starts + 1) - 1]
+  first_high = np.maximum.reduceat(np.where(in_first, high, -np.inf), starts)
+  first_low = np.minimum.reduceat(np.where(in_first, low, np.inf), starts)
+
+  prev_close = _shift(session_close, owners, 1)
+  prev_high = _shift(session_high, owners, 1)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    close_return = session_close / prev_close - 1
+    features = {
+      'first_close_return': first_close / prev_close - 1,
+      'first_high_return': first_high / prev_close - 1,
+      'first_low_return': first_low / prev_close - 1,
+      'gap': session_open / prev_close - 1,
+      'close_return': close_return,
+      'high_return': session_high / prev_high - 1,
+    }
+  for lag in lags:
+    features['close_return_lag%d' % lag] = _shift(close_return, owners, lag)
+
+  index = pd.MultiIndex.from_arrays([names[owners], days[starts].view('datetime64[ns]')], names=['ticker', 'day'])
+  return pd.DataFrame(features, index=index, columns=columns)
@@ -1,42 +1,52 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-from datetime import datetime
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from enum import Enum
 import os
-import sys
+import shutil
+import tempfile
+import threading
+import time
 
-from six.moves import urllib
+from data import events
+from data.instruments import MAIN_EQUITIES, MOEX_CODES, MOEX_EQUITIES, registry
 
 __author__ = 'maxim'
 
+# The network (six.moves.urllib, the client), numpy and the loader, and the catalog (which imports this module)
+# are imported where they are used: most scripts import this module only for `Period`.
 
-def download_if_needed(url, path, filename=None):
+def download_if_needed(url, path, filename=None, refresh=False):
+  # A complete stored file (or a recorded empty export) is not downloaded again, a truncated one is resumed
+  # or replaced. `refresh` revalidates the stored file with a conditional request.
+  from data.client import is_stored, shared_client
   if not os.path.exists(path):
     os.makedirs(path)
   filename = filename or os.path.basename(url)
   full_path = os.path.join(path, filename)
-  if not os.path.exists(full_path):
-    print('Downloading %s, please wait...' % filename)
-    result_path, _ = urllib.request.urlretrieve(url, full_path, _report_hook)
-    stat = os.stat(result_path)
-    print('Successfully downloaded "%s" (%d Kb)' % (filename, stat.st_size / 1024))
-    return result_path
+  if refresh or not is_stored(full_path):
+    events.log('Downloading %s, please wait...' % filename)
+    start = time.time()
+    result = shared_client().download(url, full_path, refresh=refresh, progress=_report_hook(full_path))
+    events.emit('fetch.done', path=full_path, bytes=result.received, elapsed=time.time() - start)
+    if result.status == 'not-modified':
+      events.log('Not modified: %s' % full_path)
+    else:
+      events.log('Successfully downloaded "%s" (%d Kb)' % (filename, result.size / 1024))
+    return full_path
   else:
-    print('Already downloaded:', full_path)
+    events.emit('fetch.cached', path=full_path)
+    events.log('Already downloaded: %s' % full_path)
   return full_path
 
 
-def _report_hook(block_num, block_size, total_size):
-  read_so_far = block_num * block_size
-  if total_size > 0:
-    percent = read_so_far * 1e2 / total_size
-    s = '\r%5.1f%% %*d / %d' % (percent, len(str(total_size)), read_so_far, total_size)
-    sys.stdout.write(s)
-    if read_so_far >= total_size:  # near the end
-      sys.stdout.write('\n')
-  else:  # total size is unknown
-    sys.stdout.write('read %d\n' % (read_so_far,))
+def _report_hook(full_path):
+  def report(read_so_far, total_size):
+    events.emit('fetch.progress', path=full_path, bytes=read_so_far, total=total_size)
+  return report
 
 
 # Data source:
@@ -47,7 +57,9 @@ def _report_hook(block_num, block_size, total_size):
 #   df=1&mf=0&yf=2015&from=01.01.2015&dt=21&mt=6&yt=2018&to=21.07.2018&p=7&f=SBER_150101_180721&e=.txt&cn=SBER&
 #   dtf=4&tmf=3&MSOR=1&mstime=on&mstimever=1&sep=1&sep2=1&datf=1&at=1
 
-URL_PATTERN = 'http://export.finam.ru/{name}{ext}?market={market}&em={em}&code={code}&apply=0&' \
+EXPORT_HOST = 'http://export.finam.ru'
+
+URL_PATTERN = '{host}/{name}{ext}?market={market}&em={em}&code={code}&apply=0&' \
               'df={from_day}&mf={from_month}&yf={from_year}&from={from_str}&' \
               'dt={to_day}&mt={to_month}&yt={to_year}&to={to_str}&' \
               'p={period}&f={name}&e={ext}&cn={code}&dtf={date_format}&tmf={time_format}&' \
@@ -113,9 +125,10 @@ class Market(Enum):
   ARCHIVE_SECTORS = -1    # Отрасли
 
 
-def generate_url(code, em, period, from_dt, to_dt, market=Market.MOEX_STOCK):
+def generate_url(code, em, period, from_dt, to_dt, market=Market.MOEX_STOCK, host=EXPORT_HOST):
   name = '%s_%s_%s_%s' % (code, from_dt.strftime('%Y-%m-%d'), to_dt.strftime('%Y-%m-%d'), period.slug())
   url = URL_PATTERN.format(
+    host = host,
     name = name,
     ext = '.txt',
     code = code,
@@ -140,314 +153,336 @@ def generate_url(code, em, period, from_dt, to_dt, market=Market.MOEX_STOCK):
   return url, '%s.txt' % name
 
 
-MOEX_EQUITIES = [
-  {'name': u'МосЭнерго', 'code': '6', 'ticker': 'MSNG'},
-  {'name': u'AGRO-гдр', 'code': '399716', 'ticker': 'AGRO'},
-  {'name': u'ENPL-гдр', 'code': '489354', 'ticker': ''},
-  {'name': u'FIVE-гдр', 'code': '491944', 'ticker': 'FIVE'},
-  {'name': u'GTL ао', 'code': '152876', 'ticker': ''},
-  {'name': u'Polymetal', 'code': '175924', 'ticker': 'POLY'},
-  {'name': u'RUSAL plc', 'code': '414279', 'ticker': ''},
-  {'name': u'Raven', 'code': '498713', 'ticker': ''},
-  {'name': u'Yandex clA', 'code': '388383', 'ticker': 'YNDX'},
-  {'name': u'iQIWI', 'code': '181610', 'ticker': 'QIWI'},
-  {'name': u'iАвиастКао', 'code': '22843', 'ticker': ''},
-  {'name': u'iДонскЗР', 'code': '74744', 'ticker': ''},
-  {'name': u'iДонскЗР п', 'code': '74745', 'ticker': ''},
-  {'name': u'iЗаводДИОД', 'code': '35363', 'ticker': ''},
-  {'name': u'iИСКЧ ао', 'code': '17137', 'ticker': ''},
-  {'name': u'iЛевенгук', 'code': '152517', 'ticker': ''},
-  {'name': u'iНПОНаука', 'code': '81992', 'ticker': ''},
-  {'name': u'iНаукаСвяз', 'code': '81929', 'ticker': ''},
-  {'name': u'iРоллман', 'code': '152677', 'ticker': ''},
-  {'name': u'iРоллман-п', 'code': '388313', 'ticker': ''},
-  {'name': u'iФармсинтз', 'code': '74584', 'ticker': ''},
-  {'name': u'АВТОВАЗ ао', 'code': '39', 'ticker': ''},
-  {'name': u'АВТОВАЗ ап', 'code': '40', 'ticker': ''},
-  {'name': u'АЛРОСА ао', 'code': '81820', 'ticker': 'ALRS'},
-  {'name': u'АЛРОСА-Нюр', 'code': '81882', 'ticker': ''},
-  {'name': u'АСКО ао', 'code': '484229', 'ticker': ''},
-  {'name': u'АбрауДюрсо', 'code': '82460', 'ticker': ''},
-  {'name': u'Авангрд-ао', 'code': '82843', 'ticker': ''},
-  {'name': u'Акрон', 'code': '17564', 'ticker': ''},
-  {'name': u'Аптеки36и6', 'code': '13855', 'ticker': ''},
-  {'name': u'Армада', 'code': '19676', 'ticker': ''},
-  {'name': u'Арсагера', 'code': '19915', 'ticker': ''},
-  {'name': u'АстрЭнСб', 'code': '16452', 'ticker': ''},
-  {'name': u'АшинскийМЗ', 'code': '20702', 'ticker': ''},
-  {'name': u'Аэрофлот', 'code': '29', 'ticker': 'AFLT'},
-  {'name': u'БСП ао', 'code': '20066', 'ticker': ''},
-  {'name': u'БУДУЩЕЕ ао', 'code': '462599', 'ticker': ''},
-  {'name': u'БашИнСв ао', 'code': '35242', 'ticker': ''},
-  {'name': u'БашИнСв ап', 'code': '35243', 'ticker': ''},
-  {'name': u'Башнефт ао', 'code': '81757', 'ticker': ''},
-  {'name': u'Башнефт ап', 'code': '81758', 'ticker': ''},
-  {'name': u'Белон ао', 'code': '21078', 'ticker': ''},
-  {'name': u'Белуга ао', 'code': '19651', 'ticker': ''},
-  {'name': u'БестЭфБ ао', 'code': '82616', 'ticker': ''},
-  {'name': u'БурЗолото', 'code': '81901', 'ticker': ''},
-  {'name': u'ВСМПО-АВСМ', 'code': '15965', 'ticker': ''},
-  {'name': u'ВТБ ао', 'code': '19043', 'ticker': 'VTB'},
-  {'name': u'ВТОРРЕСао', 'code': '82886', 'ticker': ''},
-  {'name': u'ВХЗ-ао', 'code': '17257', 'ticker': ''},
-  {'name': u'ВЭК 01 ао', 'code': '16352', 'ticker': ''},
-  {'name': u'Варьеган', 'code': '81954', 'ticker': ''},
-  {'name': u'Варьеган-п', 'code': '81955', 'ticker': ''},
-  {'name': u'Возрожд-ао', 'code': '17068', 'ticker': ''},
-  {'name': u'Возрожд-п', 'code': '17067', 'ticker': ''},
-  {'name': u'ВолгЭнСб', 'code': '16456', 'ticker': ''},
-  {'name': u'ВолгЭнСб-п', 'code': '16457', 'ticker': ''},
-  {'name': u'ВыбСудЗ ао', 'code': '83251', 'ticker': ''},
-  {'name': u'ВыбСудЗ ап', 'code': '83252', 'ticker': ''},
-  {'name': u'ГАЗ ао', 'code': '81997', 'ticker': ''},
-  {'name': u'ГАЗ ап', 'code': '81998', 'ticker': ''},
-  {'name': u'ГАЗ-Тек ао', 'code': '82115', 'ticker': ''},
-  {'name': u'ГАЗ-сервис', 'code': '81399', 'ticker': ''},
-  {'name': u'ГАЗКОН-ао', 'code': '81398', 'ticker': ''},
-  {'name': u'ГАЗПРОМ ао', 'code': '16842', 'ticker': 'GAZP'},
-  {'name': u'ГЕОТЕК ао', 'code': '436120', 'ticker': ''},
-  {'name': u'ГИТ ао', 'code': '449114', 'ticker': ''},
-  {'name': u'ГМКНорНик', 'code': '795', 'ticker': 'GMNK'},
-  {'name': u'ГТМ ао', 'code': '488918', 'ticker': ''},
-  {'name': u'ГазпРнД ао', 'code': '152397', 'ticker': ''},
-  {'name': u'Газпрнефть', 'code': '2', 'ticker': 'SIBN'},
-  {'name': u'Галс-Девел', 'code': '17698', 'ticker': ''},
-  {'name': u'ГлТоргПрод', 'code': '175842', 'ticker': ''},
-  {'name': u'ДВМП ао', 'code': '20708', 'ticker': ''},
-  {'name': u'ДЭК ао', 'code': '19724', 'ticker': ''},
-  {'name': u'ДагСб ао', 'code': '16825', 'ticker': ''},
-  {'name': u'ДетскийМир', 'code': '473181', 'ticker': ''},
-  {'name': u'ЕТС ао', 'code': '419504', 'ticker': ''},
-  {'name': u'ЕвроЭлтех', 'code': '487432', 'ticker': ''},
-  {'name': u'ЗВЕЗДА ао', 'code': '82001', 'ticker': ''},
-  {'name': u'ЗИЛ ао', 'code': '81918', 'ticker': ''},
-  {'name': u'ИКРУСС-ИНВ', 'code': '81786', 'ticker': ''},
-  {'name': u'ИНГРАД ао', 'code': '20711', 'ticker': ''},
-  {'name': u'ИРКУТ-3', 'code': '15547', 'ticker': ''},
-  {'name': u'ИСУ-КП', 'code': '386452', 'ticker': ''},
-  {'name': u'Ижсталь ап', 'code': '81887', 'ticker': ''},
-  {'name': u'Ижсталь2ао', 'code': '81885', 'ticker': ''},
-  {'name': u'Инв-Девел', 'code': '409486', 'ticker': ''},
-  {'name': u'ИнтерРАОао', 'code': '20516', 'ticker': ''},
-  {'name': u'ИркЭнерго', 'code': '9', 'ticker': ''},
-  {'name': u'КАМАЗ', 'code': '15544', 'ticker': ''},
-  {'name': u'КЗМС ао', 'code': '17359', 'ticker': ''},
-  {'name': u'КМЗ', 'code': '22525', 'ticker': ''},
-  {'name': u'КСБ ао', 'code': '16284', 'ticker': ''},
-  {'name': u'КСБ ап', 'code': '16285', 'ticker': ''},
-  {'name': u'КУЗОЦМ ао', 'code': '81943', 'ticker': ''},
-  {'name': u'КалужскСК', 'code': '16329', 'ticker': ''},
-  {'name': u'КамчатЭ ао', 'code': '20030', 'ticker': ''},
-  {'name': u'КамчатЭ ап', 'code': '20498', 'ticker': ''},
-  {'name': u'Квадра', 'code': '18310', 'ticker': ''},
-  {'name': u'Квадра-п', 'code': '18391', 'ticker': ''},
-  {'name': u'Кокс ао', 'code': '75094', 'ticker': ''},
-  {'name': u'КоршГОК ао', 'code': '20710', 'ticker': ''},
-  {'name': u'КосогМЗ ао', 'code': '81903', 'ticker': ''},
-  {'name': u'КрасОкт-1п', 'code': '511', 'ticker': ''},
-  {'name': u'КрасОкт-ао', 'code': '510', 'ticker': ''},
-  {'name': u'Красэсб ао', 'code': '20912', 'ticker': ''},
-  {'name': u'Красэсб ап', 'code': '20913', 'ticker': ''},
-  {'name': u'Кубанэнр', 'code': '522', 'ticker': ''},
-  {'name': u'КузбТК ао', 'code': '35285', 'ticker': ''},
-  {'name': u'КузнецкийБ', 'code': '83165', 'ticker': ''},
-  {'name': u'Куйбазот', 'code': '81941', 'ticker': ''},
-  {'name': u'Куйбазот-п', 'code': '81942', 'ticker': ''},
-  {'name': u'КурганГКао', 'code': '83261', 'ticker': ''},
-  {'name': u'КурганГКап', 'code': '152350', 'ticker': ''},
-  {'name': u'ЛСР ао', 'code': '19736', 'ticker': ''},
-  {'name': u'ЛУКОЙЛ', 'code': '8', 'ticker': 'LKOH'},
-  {'name': u'ЛЭСК ао', 'code': '16276', 'ticker': ''},
-  {'name': u'Лензол. ап', 'code': '22094', 'ticker': ''},
-  {'name': u'Лензолото', 'code': '21004', 'ticker': ''},
-  {'name': u'Лента др', 'code': '385792', 'ticker': ''},
-  {'name': u'Ленэнерг-п', 'code': '542', 'ticker': ''},
-  {'name': u'Ленэнерго', 'code': '31', 'ticker': 'LSGN'},
-  {'name': u'М.видео', 'code': '19737', 'ticker': ''},
-  {'name': u'МГТС-4ап', 'code': '12983', 'ticker': ''},
-  {'name': u'МГТС-5ао', 'code': '12984', 'ticker': ''},
-  {'name': u'МЕРИДИАН', 'code': '20947', 'ticker': ''},
-  {'name': u'МКБ ао', 'code': '420694', 'ticker': ''},
-  {'name': u'ММК', 'code': '16782', 'ticker': ''},
-  {'name': u'МН-фонд ао', 'code': '80390', 'ticker': ''},
-  {'name': u'МОЭСК', 'code': '16917', 'ticker': ''},
-  {'name': u'МРСК СЗ', 'code': '20309', 'ticker': ''},
-  {'name': u'МРСК СК', 'code': '20412', 'ticker': ''},
-  {'name': u'МРСК Ур', 'code': '20402', 'ticker': ''},
-  {'name': u'МРСК ЦП', 'code': '20107', 'ticker': 'MRKP'},
-  {'name': u'МРСК Центр', 'code': '20235', 'ticker': ''},
-  {'name': u'МРСКВол', 'code': '20286', 'ticker': ''},
-  {'name': u'МРСКСиб', 'code': '20346', 'ticker': ''},
-  {'name': u'МРСКЮга ао', 'code': '20681', 'ticker': ''},
-  {'name': u'МТС-ао', 'code': '15523', 'ticker': 'MTS'},
-  {'name': u'МагадЭн ао', 'code': '74562', 'ticker': ''},
-  {'name': u'МагадЭн ап', 'code': '74563', 'ticker': ''},
-  {'name': u'Магнит ао', 'code': '17086', 'ticker': 'MGNT'},
-  {'name': u'МариЭнСб-п', 'code': '16331', 'ticker': ''},
-  {'name': u'МегаФон ао', 'code': '152516', 'ticker': 'MFON'},
-  {'name': u'Мегион-ао', 'code': '30', 'ticker': ''},
-  {'name': u'Мегион-ап', 'code': '51', 'ticker': ''},
-  {'name': u'МедиаВиМ', 'code': '81829', 'ticker': ''},
-  {'name': u'Медиахолд', 'code': '20737', 'ticker': ''},
-  {'name': u'Мечел ао', 'code': '21018', 'ticker': ''},
-  {'name': u'Мечел ап', 'code': '80745', 'ticker': ''},
-  {'name': u'МордЭнСб', 'code': '16359', 'ticker': ''},
-  {'name': u'Морион ао', 'code': '81944', 'ticker': ''},
-  {'name': u'МосБиржа', 'code': '152798', 'ticker': 'MOEX'},
-  {'name': u'МосОблБанк', 'code': '82890', 'ticker': ''},
-  {'name': u'Мостотрест', 'code': '74549', 'ticker': ''},
-  {'name': u'МультиСис', 'code': '152676', 'ticker': ''},
-  {'name': u'МурмТЭЦ-ао', 'code': '81945', 'ticker': ''},
-  {'name': u'МурмТЭЦ-п', 'code': '81946', 'ticker': ''},
-  {'name': u'НКНХ ао', 'code': '20100', 'ticker': ''},
-  {'name': u'НКНХ ап', 'code': '20101', 'ticker': ''},
-  {'name': u'НКХП ао', 'code': '450432', 'ticker': ''},
-  {'name': u'НЛМК ао', 'code': '17046', 'ticker': ''},
-  {'name': u'НМТП ао', 'code': '19629', 'ticker': ''},
-  {'name': u'Нефтекамск', 'code': '81287', 'ticker': ''},
-  {'name': u'Нижкамшина', 'code': '81947', 'ticker': ''},
-  {'name': u'Новатэк ао', 'code': '17370', 'ticker': 'NVTK'},
-  {'name': u'ОВК ао', 'code': '414560', 'ticker': ''},
-  {'name': u'ОГК-2 ао', 'code': '18684', 'ticker': 'OGKB'},
-  {'name': u'ОКС ао', 'code': '175781', 'ticker': ''},
-  {'name': u'ОМЗ-ап', 'code': '15844', 'ticker': ''},
-  {'name': u'ОР ао', 'code': '488674', 'ticker': ''},
-  {'name': u'ОргСинт ао', 'code': '81856', 'ticker': ''},
-  {'name': u'ОргСинт ап', 'code': '81857', 'ticker': ''},
-  {'name': u'ПИК ао', 'code': '18654', 'ticker': ''},
-  {'name': u'ПРОТЕК ао', 'code': '35247', 'ticker': ''},
-  {'name': u'ПавлАвт ао', 'code': '81896', 'ticker': ''},
-  {'name': u'ПермьЭнС-п', 'code': '16909', 'ticker': ''},
-  {'name': u'ПермьЭнСб', 'code': '16908', 'ticker': ''},
-  {'name': u'Плазмек', 'code': '81241', 'ticker': ''},
-  {'name': u'Полюс', 'code': '17123', 'ticker': 'PLZL'},
-  {'name': u'Приморье', 'code': '80818', 'ticker': ''},
-  {'name': u'РБК ао', 'code': '74779', 'ticker': ''},
-  {'name': u'РГС СК ао', 'code': '181934', 'ticker': ''},
-  {'name': u'РДБанк ао', 'code': '181755', 'ticker': ''},
-  {'name': u'РН-ЗапСиб', 'code': '81933', 'ticker': ''},
-  {'name': u'РОСИНТЕРао', 'code': '20637', 'ticker': ''},
-  {'name': u'Распадская', 'code': '17713', 'ticker': 'RASP'},
-  {'name': u'Росбанк ао', 'code': '16866', 'ticker': ''},
-  {'name': u'Роснефть', 'code': '17273', 'ticker': 'ROSN'},
-  {'name': u'Россети ао', 'code': '20971', 'ticker': ''},
-  {'name': u'Россети ап', 'code': '20972', 'ticker': ''},
-  {'name': u'Ростел -ао', 'code': '7', 'ticker': 'RTKM'},
-  {'name': u'Ростел -ап', 'code': '15', 'ticker': 'RTKMP'},
-  {'name': u'РусАква ао', 'code': '35238', 'ticker': ''},
-  {'name': u'РусГидро', 'code': '20266', 'ticker': 'HYDR'},
-  {'name': u'Русгрэйн', 'code': '66893', 'ticker': ''},
-  {'name': u'Русолово', 'code': '181316', 'ticker': ''},
-  {'name': u'Русполимет', 'code': '20712', 'ticker': ''},
-  {'name': u'РуссНфт ао', 'code': '465236', 'ticker': ''},
-  {'name': u'РязЭнСб', 'code': '16455', 'ticker': ''},
-  {'name': u'САФМАР ао', 'code': '491359', 'ticker': ''},
-  {'name': u'СЗПароход', 'code': '22401', 'ticker': ''},
-  {'name': u'СМЗ-ао', 'code': '20892', 'ticker': ''},
-  {'name': u'СОЛЛЕРС', 'code': '16080', 'ticker': ''},
-  {'name': u'СамарЭн-ао', 'code': '445', 'ticker': ''},
-  {'name': u'СамарЭн-ап', 'code': '70', 'ticker': ''},
-  {'name': u'СаратНПЗ', 'code': '81891', 'ticker': ''},
-  {'name': u'СаратНПЗ-п', 'code': '81892', 'ticker': ''},
-  {'name': u'СаратЭн-ао', 'code': '11', 'ticker': ''},
-  {'name': u'СаратЭн-ап', 'code': '24', 'ticker': ''},
-  {'name': u'Сахэнер ао', 'code': '473000', 'ticker': ''},
-  {'name': u'Сбербанк', 'code': '3', 'ticker': 'SBER'},
-  {'name': u'Сбербанк-п', 'code': '23', 'ticker': ''},
-  {'name': u'СевСт-ао', 'code': '16136', 'ticker': 'CHMF'},
-  {'name': u'Селигдар', 'code': '81360', 'ticker': ''},
-  {'name': u'Селигдар-п', 'code': '82610', 'ticker': ''},
-  {'name': u'СибГост ао', 'code': '436091', 'ticker': ''},
-  {'name': u'Система ао', 'code': '19715', 'ticker': 'AFKS'},
-  {'name': u'Слав-ЯНОСп', 'code': '15723', 'ticker': ''},
-  {'name': u'Славн-ЯНОС', 'code': '15722', 'ticker': ''},
-  {'name': u'СтаврЭнСб', 'code': '20087', 'ticker': ''},
-  {'name': u'СтаврЭнСбп', 'code': '20088', 'ticker': ''},
-  {'name': u'Сургнфгз', 'code': '4', 'ticker': ''},
-  {'name': u'Сургнфгз-п', 'code': '13', 'ticker': ''},
-  {'name': u'ТАНТАЛ ао', 'code': '81914', 'ticker': ''},
-  {'name': u'ТАНТАЛ ап', 'code': '81915', 'ticker': ''},
-  {'name': u'ТГК-1', 'code': '18382', 'ticker': ''},
-  {'name': u'ТГК-14', 'code': '18176', 'ticker': ''},
-  {'name': u'ТГК-2', 'code': '17597', 'ticker': ''},
-  {'name': u'ТГК-2 ап', 'code': '18189', 'ticker': ''},
-  {'name': u'ТЗА ао', 'code': '20716', 'ticker': ''},
-  {'name': u'ТКЗ ао', 'code': '81899', 'ticker': ''},
-  {'name': u'ТКЗКК ао', 'code': '81905', 'ticker': ''},
-  {'name': u'ТКЗКК ап', 'code': '81906', 'ticker': ''},
-  {'name': u'ТКСМ ао', 'code': '74746', 'ticker': ''},
-  {'name': u'ТМК ао', 'code': '18441', 'ticker': ''},
-  {'name': u'ТНСэКубань', 'code': '19916', 'ticker': ''},
-  {'name': u'ТНСэнВор-п', 'code': '16547', 'ticker': ''},
-  {'name': u'ТНСэнВорон', 'code': '16546', 'ticker': ''},
-  {'name': u'ТНСэнМарЭл', 'code': '16330', 'ticker': ''},
-  {'name': u'ТНСэнНН ао', 'code': '16615', 'ticker': ''},
-  {'name': u'ТНСэнНН ап', 'code': '16616', 'ticker': ''},
-  {'name': u'ТНСэнРст', 'code': '16783', 'ticker': ''},
-  {'name': u'ТНСэнРст-п', 'code': '16784', 'ticker': ''},
-  {'name': u'ТНСэнЯр', 'code': '16342', 'ticker': ''},
-  {'name': u'ТНСэнЯр-п', 'code': '16343', 'ticker': ''},
-  {'name': u'ТНСэнрг ао', 'code': '420644', 'ticker': ''},
-  {'name': u'ТРК ао', 'code': '16797', 'ticker': ''},
-  {'name': u'ТРК ап', 'code': '16798', 'ticker': ''},
-  {'name': u'ТамбЭнСб', 'code': '16265', 'ticker': ''},
-  {'name': u'ТамбЭнСб-п', 'code': '16266', 'ticker': ''},
-  {'name': u'Татнфт 3ао', 'code': '825', 'ticker': ''},
-  {'name': u'Татнфт 3ап', 'code': '826', 'ticker': ''},
-  {'name': u'Таттел. ао', 'code': '18371', 'ticker': ''},
-  {'name': u'Телеграф', 'code': '21002', 'ticker': ''},
-  {'name': u'Телеграф-п', 'code': '81575', 'ticker': ''},
-  {'name': u'ТрансК ао', 'code': '74561', 'ticker': ''},
-  {'name': u'ТрансФ ао', 'code': '497210', 'ticker': ''},
-  {'name': u'Транснф ап', 'code': '1012', 'ticker': ''},
-  {'name': u'УрКузница', 'code': '82611', 'ticker': ''},
-  {'name': u'УралСиб ао', 'code': '81953', 'ticker': ''},
-  {'name': u'Уркалий-ао', 'code': '19623', 'ticker': ''},
-  {'name': u'ФСК ЕЭС ао', 'code': '20509', 'ticker': 'FSK'},
-  {'name': u'Физика ао', 'code': '81858', 'ticker': ''},
-  {'name': u'ФосАгро ао', 'code': '81114', 'ticker': 'PHOR'},
-  {'name': u'Химпром ао', 'code': '81939', 'ticker': ''},
-  {'name': u'Химпром ап', 'code': '81940', 'ticker': ''},
-  {'name': u'ЦМТ ао', 'code': '19095', 'ticker': ''},
-  {'name': u'ЦМТ ап', 'code': '19096', 'ticker': ''},
-  {'name': u'ЧЗПСН ао', 'code': '83121', 'ticker': ''},
-  {'name': u'ЧКПЗ ао', 'code': '21000', 'ticker': ''},
-  {'name': u'ЧМК ао', 'code': '21001', 'ticker': ''},
-  {'name': u'ЧТПЗ ао', 'code': '20999', 'ticker': ''},
-  {'name': u'ЧелябЭС ао', 'code': '16712', 'ticker': ''},
-  {'name': u'ЧелябЭС ап', 'code': '16713', 'ticker': ''},
-  {'name': u'ЧеркизГ-ао', 'code': '20125', 'ticker': ''},
-  {'name': u'Электрцинк', 'code': '81934', 'ticker': ''},
-  {'name': u'ЭнелРос ао', 'code': '16440', 'ticker': ''},
-  {'name': u'ЭнергияРКК', 'code': '20321', 'ticker': ''},
-  {'name': u'ЮТэйр ао', 'code': '15522', 'ticker': ''},
-  {'name': u'ЮУНК ао', 'code': '82493', 'ticker': ''},
-  {'name': u'ЮжКузб. ао', 'code': '20717', 'ticker': ''},
-  {'name': u'Юнипро ао', 'code': '18584', 'ticker': ''},
-  {'name': u'ЯТЭК ао', 'code': '81917', 'ticker': ''},
-  {'name': u'Якутскэн-п', 'code': '81769', 'ticker': ''},
-  {'name': u'Якутскэнрг', 'code': '81766', 'ticker': ''},
-]
-
-MOEX_CODES = {i['ticker']: i['code'] for i in MOEX_EQUITIES if i['ticker']}
-
-MAIN_EQUITIES = [
-  'AFLT', 'AGRO', 'ALRS', 'AFKS', 'CHMF', 'FIVE', 'FSK', 'GAZP', 'GMNK', 'HYDR', 'LKOH', 'LSGN',
-  'MFON', 'MGNT', 'MSNG', 'MRKP',
-  'MOEX', 'MTS', 'NVTK', 'OGKB', 'PHOR', 'PLZL', 'RASP', 'RTKM', 'SBER', 'SIBN', 'VTB', 'YNDX',
-]
+# Bulk download: the jobs are run through a bounded thread pool, the requests to the same host are rate-limited.
+Job = namedtuple('Job', ['ticker', 'period', 'from_dt', 'to_dt'])
+JobResult = namedtuple('JobResult', ['job', 'status', 'path', 'size', 'attempts', 'elapsed', 'error'])
+
+
+# Spaces out the requests to the same host by at least `min_interval` seconds.
+class RateLimiter(object):
+  def __init__(self, min_interval):
+    self.min_interval = min_interval
+    self._lock = threading.Lock()
+    self._next_slot = {}
+
+  def wait(self, host):
+    with self._lock:
+      now = time.time()
+      slot = max(now, self._next_slot.get(host, now))
+      self._next_slot[host] = slot + self.min_interval
+    delay = slot - now
+    if delay > 0:
+      time.sleep(delay)
+
+
+def _retrieve_atomic(url, full_path, timeout, refresh=False):
+  # The client writes into `<file>.part` and renames it only when it's complete, so a failed/killed
+  # download never leaves a truncated file in the storage, and the next attempt resumes the part.
+  from data.client import shared_client
+  return shared_client().download(url, full_path, refresh=refresh, timeout=timeout,
+                                  progress=_report_hook(full_path)).size
+
+
+def retrying(action, url, limiter, retries, backoff):
+  # Runs `action` with the rate limit and the exponential backoff. Returns (result, attempts, error repr or None).
+  from six.moves import urllib
+  error = None
+  for attempt in range(1, retries + 2):
+    limiter.wait(urllib.parse.urlparse(url).netloc)
+    try:
+      return action(), attempt, None
+    except Exception as e:
+      error = e
+      events.emit('fetch.retry', url=url, attempt=attempt, error=repr(e))
+      if attempt <= retries:
+        time.sleep(backoff * 2 ** (attempt - 1))
+  return None, retries + 1, repr(error)
+
+
+# Long ranges are split into windows by period: a multi-year minute or tick export is one huge transfer
+# that restarts from zero on any failure. The windows are downloaded concurrently into `<file>.parts/`
+# and stay there until the whole range is stitched, so a retry fetches only the windows that failed.
+WINDOW_DAYS = {
+  Period.TICK: 1,
+  Period.MIN_1: 30,
+  Period.MIN_5: 90,
+  Period.MIN_10: 180,
+  Period.MIN_15: 180,
+  Period.MIN_30: 365,
+  Period.HOUR: 365,
+}
+
+FINAM_HEADER = b'<TICKER>,<PER>,<DATE>,<TIME>,<OPEN>,<HIGH>,<LOW>,<CLOSE>,<VOL>'
+
+
+def midnight(dt):
+  return datetime(dt.year, dt.month, dt.day)
+
+
+def split_range(period, from_dt, to_dt, days=None):
+  # [(first day, last day)] of the windows, both inclusive as in the export.
+  days = days or WINDOW_DAYS.get(period)
+  start, last = midnight(from_dt), midnight(to_dt)
+  if not days:
+    return [(start, last)]
+  windows = []
+  while start <= last:
+    end = min(start + timedelta(days=days - 1), last)
+    windows.append((start, end))
+    start = end + timedelta(days=1)
+  return windows
+
+
+def _window_lines(data, start, end):
+  # The rows of the window's own days in the time order. The rows outside (an overlapping boundary)
+  # belong to the neighbour window. The sort is stable: the ticks of the same second keep their order.
+  import numpy as np
+  from data.loader import parse_timestamps
+  lines = [line for line in data.splitlines() if line.strip() and not line.startswith(b'<')]
+  if not lines:
+    return []
+  fields = [line.split(b',', 4) for line in lines]
+  stamps = parse_timestamps([field[2].decode() for field in fields], [field[3].decode() for field in fields])
+  owned = (stamps >= np.datetime64(start)) & (stamps < np.datetime64(end + timedelta(days=1)))
+  return [lines[i] for i in np.argsort(stamps, kind='mergesort') if owned[i]]
+
+
+def _stitch(parts, windows, full_path):
+  # One window at a time, the memory is bounded by the largest window.
+  fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(full_path) or '.', suffix='.part')
+  try:
+    with os.fdopen(fd, 'wb') as output:
+      output.write(FINAM_HEADER + b'\n')
+      for part, (start, end) in zip(parts, windows):
+        with open(part, 'rb') as file:
+          lines = _window_lines(file.read(), start, end)
+        if lines:
+          output.write(b'\n'.join(lines) + b'\n')
+    os.replace(tmp_path, full_path)
+  except BaseException:
+    if os.path.exists(tmp_path):
+      os.remove(tmp_path)
+    raise
+  return os.path.getsize(full_path)
+
+
+def _fetch_windows(ticker, period, windows, full_path, limiter, retries, backoff, timeout, host, workers):
+  # Returns (size, attempts, error) as `retrying`.
+  parts_path = full_path + '.parts'
+  if not os.path.exists(parts_path):
+    os.makedirs(parts_path)
+
+  def fetch(window):
+    start, end = window
+    part = os.path.join(parts_path, '%s_%s.txt' % (start.strftime('%Y%m%d'), end.strftime('%Y%m%d')))
+    if os.path.exists(part):
+      return part, 0, None  # done by a previous run
+    url, _ = generate_url(code=ticker, em=registry.em(ticker), period=period, from_dt=start, to_dt=end, host=host)
+    _, attempts, error = retrying(lambda: _retrieve_atomic(url, part, timeout), url, limiter, retries, backoff)
+    return part, attempts, error
+
+  with ThreadPoolExecutor(max_workers=workers) as executor:
+    results = list(executor.map(fetch, windows))
+  attempts = sum(result[1] for result in results)
+  failed = [(window, result[2]) for window, result in zip(windows, results) if result[2]]
+  if failed:
+    (start, end), error = failed[0]
+    return None, attempts, '%d of %d windows failed, e.g. %s..%s: %s' % (
+      len(failed), len(windows), start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d'), error)
+  size = _stitch([result[0] for result in results], windows, full_path)
+  shutil.rmtree(parts_path)
+  return size, attempts, None
+
+
+def download_range(ticker, period, from_dt, to_dt, full_path, limiter, retries, backoff, timeout, host, window_days,
+                   window_workers, refresh=False):
+  # Downloads the export into `full_path` atomically, in windows if the range is long. Returns as `retrying`.
+  # `refresh` revalidates a stored file, e.g. an empty export of a range that is still open.
+  windows = split_range(period, from_dt, to_dt, window_days)
+  if len(windows) > 1:
+    return _fetch_windows(ticker, period, windows, full_path, limiter, retries, backoff, timeout, host, window_workers)
+  url, _ = generate_url(code=ticker, em=registry.em(ticker), period=period, from_dt=from_dt, to_dt=to_dt, host=host)
+  return retrying(lambda: _retrieve_atomic(url, full_path, timeout, refresh), url, limiter, retries, backoff)
+
+
+def _finished(result):
+  # One event per job: `fetch.cached`, `fetch.failed` or `fetch.done` with the bytes and the latency.
+  name = {'cached': 'fetch.cached', 'failed': 'fetch.failed'}.get(result.status, 'fetch.done')
+  events.emit(name, ticker=result.job.ticker, period=result.job.period.slug(), status=result.status,
+              bytes=result.size, attempts=result.attempts, elapsed=result.elapsed, error=result.error)
+  return result
+
+
+def _run_job(job, path, limiter, retries, backoff, timeout, host, catalog, window_days, window_workers):
+  from data.client import is_stored
+  url, name = generate_url(code=job.ticker, em=registry.em(job.ticker), period=job.period,
+                           from_dt=job.from_dt, to_dt=job.to_dt, host=host)
+  full_path = os.path.join(path, name)
+  start = time.time()
+  if is_stored(full_path):
+    return _finished(JobResult(job, 'cached', full_path, os.path.getsize(full_path), 0, 0.0, None))
+
+  size, attempts, error = download_range(job.ticker, job.period, job.from_dt, job.to_dt, full_path, limiter, retries,
+                                         backoff, timeout, host, window_days, window_workers)
+  if error:
+    return _finished(JobResult(job, 'failed', full_path, 0, attempts, time.time() - start, error))
+  catalog.register(full_path)
+  return _finished(JobResult(job, 'ok', full_path, size, attempts, time.time() - start, None))
+
+
+def bulk_download(jobs, path='.storage', workers=8, min_interval=0.5, retries=3, backoff=1.0, timeout=60,
+                  host=EXPORT_HOST, window_days=None, window_workers=4):
+  from data.catalog import CATALOG_NAME, Catalog
+  if not os.path.exists(path):
+    os.makedirs(path)
+  limiter = RateLimiter(min_interval)
+  catalog = Catalog(os.path.join(path, CATALOG_NAME))
+  with ThreadPoolExecutor(max_workers=workers) as executor:
+    futures = [executor.submit(_run_job, job, path, limiter, retries, backoff, timeout, host, catalog,
+                               window_days, window_workers)
+               for job in jobs]
+    return [future.result() for future in futures]
+
+
+def print_summary(results):
+  for result in results:
+    job = result.job
+    events.log('%-6s %-6s %s..%s  %-7s %8d Kb  attempts=%d  %6.2fs  %s' % (
+      job.ticker, job.period.slug(), job.from_dt.strftime('%Y-%m-%d'), job.to_dt.strftime('%Y-%m-%d'),
+      result.status, result.size / 1024, result.attempts, result.elapsed, result.error or ''))
+
+
+# Incremental update: each ticker/period is kept in one canonical file, e.g. `SBER_day.txt`.
+# Only the range since the last stored bar is requested, the overlapping bars are replaced by the fresh ones.
+HISTORY_START = datetime(year=2000, month=1, day=1)
+TIMESTAMP_FORMAT = '%d/%m/%y %H:%M:%S'
+
+
+def canonical_name(ticker, period):
+  return '%s_%s.txt' % (ticker, period.slug())
+
+
+def row_timestamp(line):
+  # The timestamp of an export row (bytes), None for the header or a broken row.
+  fields = line.split(b',')
+  try:
+    return datetime.strptime('%s %s' % (fields[2].decode(), fields[3].decode()), TIMESTAMP_FORMAT)
+  except (IndexError, ValueError):
+    return None  # header or garbage
+
+
+def _iter_lines_reversed(file, block_size=64 * 1024):
+  # Yields (offset, line) from the end of the file, so that the tail is read in O(tail).
+  file.seek(0, os.SEEK_END)
+  position = file.tell()
+  remainder = b''
+  while position > 0:
+    read_size = min(block_size, position)
+    position -= read_size
+    file.seek(position)
+    lines = (file.read(read_size) + remainder).split(b'\n')
+    remainder = lines.pop(0)
+    offset = position + len(remainder) + 1
+    chunks = []
+    for line in lines:
+      chunks.append((offset, line))
+      offset += len(line) + 1
+    for offset, line in reversed(chunks):
+      if line.strip():
+        yield offset, line
+  if remainder.strip():
+    yield 0, remainder
+
+
+def last_timestamp(full_path):
+  with open(full_path, 'rb') as file:
+    for _, line in _iter_lines_reversed(file):
+      timestamp = row_timestamp(line)
+      if timestamp is not None:
+        return timestamp
+  return None
+
+
+def fetch_bytes(url, timeout):
+  from data.client import shared_client
+  return shared_client().get(url, timeout=timeout)
+
+
+def append_rows(full_path, rows):
+  # Appends the export rows (bytes) to the stored file, replacing the stored bars from the first new one on.
+  first_new = row_timestamp(rows[0])
+  with open(full_path, 'r+b') as file:
+    # Drop the stored bars that the fresh data overlaps (the last one might have been incomplete).
+    cut = None
+    for offset, line in _iter_lines_reversed(file):
+      timestamp = row_timestamp(line)
+      if timestamp is None or timestamp < first_new:
+        break
+      cut = offset
+    if cut is None:
+      file.seek(0, os.SEEK_END)
+      if file.tell() > 0:
+        file.seek(-1, os.SEEK_END)
+        if file.read(1) != b'\n':
+          file.write(b'\n')
+    else:
+      file.seek(cut)
+      file.truncate()
+    data = b'\n'.join(rows) + b'\n'
+    file.write(data)
+  return len(data)
+
+
+def _run_update(ticker, period, path, limiter, retries, backoff, timeout, host, catalog, window_days,
+                window_workers):
+  full_path = os.path.join(path, canonical_name(ticker, period))
+  start = time.time()
+  last = last_timestamp(full_path) if os.path.exists(full_path) else None
+  from_dt = datetime(last.year, last.month, last.day) if last else HISTORY_START
+  job = Job(ticker, period, from_dt, datetime.now())
+  url, _ = generate_url(code=ticker, em=registry.em(ticker), period=period,
+                        from_dt=job.from_dt, to_dt=job.to_dt, host=host)
+
+  if last is None:  # a new series, or one that was empty so far: the range is still open, revalidate it
+    size, attempts, error = download_range(ticker, period, job.from_dt, job.to_dt, full_path, limiter, retries,
+                                           backoff, timeout, host, window_days, window_workers,
+                                           refresh=True)
+    status = 'created'
+  else:
+    body, attempts, error = retrying(lambda: fetch_bytes(url, timeout), url, limiter, retries, backoff)
+    size, status = 0, 'up-to-date'
+    if body is not None:
+      rows = [line for line in body.splitlines() if row_timestamp(line) is not None]
+      if rows and row_timestamp(rows[-1]) >= last:
+        size = append_rows(full_path, rows)
+        status = 'updated' if row_timestamp(rows[-1]) > last else 'up-to-date'
+  if error:
+    return _finished(JobResult(job, 'failed', full_path, 0, attempts, time.time() - start, error))
+  catalog.register(full_path)  # 'up-to-date' still rewrites the overlapping bars
+  return _finished(JobResult(job, status, full_path, size, attempts, time.time() - start, None))
+
+
+def update_all(tickers, period, path='.storage', workers=8, min_interval=0.5, retries=3, backoff=1.0, timeout=60,
+               host=EXPORT_HOST, window_days=None, window_workers=4):
+  from data.catalog import CATALOG_NAME, Catalog
+  if not os.path.exists(path):
+    os.makedirs(path)
+  limiter = RateLimiter(min_interval)
+  catalog = Catalog(os.path.join(path, CATALOG_NAME))
+  with ThreadPoolExecutor(max_workers=workers) as executor:
+    futures = [executor.submit(_run_update, ticker, period, path, limiter, retries, backoff, timeout, host, catalog,
+                               window_days, window_workers)
+               for ticker in tickers]
+    return [future.result() for future in futures]
 
 
 # Interesting periods:
 #   url, name = generate_url(code='SBER', period=Period.DAY, from_dt=datetime(year=2000, month=1, day=1), to_dt=datetime.now())
 #   url, name = generate_url(code='SBER', period=Period.HOUR, from_dt=datetime(year=2015, month=1, day=1), to_dt=datetime.now())
 def main():
-  for ticker in MAIN_EQUITIES:
-    url, name = generate_url(code=ticker, em=MOEX_CODES[ticker],
-                             period=Period.DAY,
-                             from_dt=datetime(year=2000, month=1, day=1),
-                             to_dt=datetime.now())
-    download_if_needed(url, path='.storage', filename=name)
+  with events.profile(os.path.join('.storage', 'update_profile.json')):
+    results = update_all(MAIN_EQUITIES, Period.DAY, path='.storage')
+  print_summary(results)
 
 
 if __name__ == '__main__':
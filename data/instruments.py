@@ -0,0 +1,403 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from collections import namedtuple
+import threading
+
+from six.moves import collections_abc
+
+__author__ = 'maxim'
+
+
+# Instrument registry: Finam `em` codes of the instruments, indexed by ticker, code, name and market.
+# The table is kept as plain text and parsed on the first lookup, so importing costs nothing.
+
+Instrument = namedtuple('Instrument', ['ticker', 'code', 'name', 'market'])
+
+
+# Parsed from https://www.finam.ru/profile/mosbirzha-fyuchersy
+# <em code> <ticker or '-'> <name>
+MOEX_STOCK = u'''
+6      MSNG  МосЭнерго
+399716 AGRO  AGRO-гдр
+489354 -     ENPL-гдр
+491944 FIVE  FIVE-гдр
+152876 -     GTL ао
+175924 POLY  Polymetal
+414279 -     RUSAL plc
+498713 -     Raven
+388383 YNDX  Yandex clA
+181610 QIWI  iQIWI
+22843  -     iАвиастКао
+74744  -     iДонскЗР
+74745  -     iДонскЗР п
+35363  -     iЗаводДИОД
+17137  -     iИСКЧ ао
+152517 -     iЛевенгук
+81992  -     iНПОНаука
+81929  -     iНаукаСвяз
+152677 -     iРоллман
+388313 -     iРоллман-п
+74584  -     iФармсинтз
+39     -     АВТОВАЗ ао
+40     -     АВТОВАЗ ап
+81820  ALRS  АЛРОСА ао
+81882  -     АЛРОСА-Нюр
+484229 -     АСКО ао
+82460  -     АбрауДюрсо
+82843  -     Авангрд-ао
+17564  -     Акрон
+13855  -     Аптеки36и6
+19676  -     Армада
+19915  -     Арсагера
+16452  -     АстрЭнСб
+20702  -     АшинскийМЗ
+29     AFLT  Аэрофлот
+20066  -     БСП ао
+462599 -     БУДУЩЕЕ ао
+35242  -     БашИнСв ао
+35243  -     БашИнСв ап
+81757  -     Башнефт ао
+81758  -     Башнефт ап
+21078  -     Белон ао
+19651  -     Белуга ао
+82616  -     БестЭфБ ао
+81901  -     БурЗолото
+15965  -     ВСМПО-АВСМ
+19043  VTB   ВТБ ао
+82886  -     ВТОРРЕСао
+17257  -     ВХЗ-ао
+16352  -     ВЭК 01 ао
+81954  -     Варьеган
+81955  -     Варьеган-п
+17068  -     Возрожд-ао
+17067  -     Возрожд-п
+16456  -     ВолгЭнСб
+16457  -     ВолгЭнСб-п
+83251  -     ВыбСудЗ ао
+83252  -     ВыбСудЗ ап
+81997  -     ГАЗ ао
+81998  -     ГАЗ ап
+82115  -     ГАЗ-Тек ао
+81399  -     ГАЗ-сервис
+81398  -     ГАЗКОН-ао
+16842  GAZP  ГАЗПРОМ ао
+436120 -     ГЕОТЕК ао
+449114 -     ГИТ ао
+795    GMNK  ГМКНорНик
+488918 -     ГТМ ао
+152397 -     ГазпРнД ао
+2      SIBN  Газпрнефть
+17698  -     Галс-Девел
+175842 -     ГлТоргПрод
+20708  -     ДВМП ао
+19724  -     ДЭК ао
+16825  -     ДагСб ао
+473181 -     ДетскийМир
+419504 -     ЕТС ао
+487432 -     ЕвроЭлтех
+82001  -     ЗВЕЗДА ао
+81918  -     ЗИЛ ао
+81786  -     ИКРУСС-ИНВ
+20711  -     ИНГРАД ао
+15547  -     ИРКУТ-3
+386452 -     ИСУ-КП
+81887  -     Ижсталь ап
+81885  -     Ижсталь2ао
+409486 -     Инв-Девел
+20516  -     ИнтерРАОао
+9      -     ИркЭнерго
+15544  -     КАМАЗ
+17359  -     КЗМС ао
+22525  -     КМЗ
+16284  -     КСБ ао
+16285  -     КСБ ап
+81943  -     КУЗОЦМ ао
+16329  -     КалужскСК
+20030  -     КамчатЭ ао
+20498  -     КамчатЭ ап
+18310  -     Квадра
+18391  -     Квадра-п
+75094  -     Кокс ао
+20710  -     КоршГОК ао
+81903  -     КосогМЗ ао
+511    -     КрасОкт-1п
+510    -     КрасОкт-ао
+20912  -     Красэсб ао
+20913  -     Красэсб ап
+522    -     Кубанэнр
+35285  -     КузбТК ао
+83165  -     КузнецкийБ
+81941  -     Куйбазот
+81942  -     Куйбазот-п
+83261  -     КурганГКао
+152350 -     КурганГКап
+19736  -     ЛСР ао
+8      LKOH  ЛУКОЙЛ
+16276  -     ЛЭСК ао
+22094  -     Лензол. ап
+21004  -     Лензолото
+385792 -     Лента др
+542    -     Ленэнерг-п
+31     LSGN  Ленэнерго
+19737  -     М.видео
+12983  -     МГТС-4ап
+12984  -     МГТС-5ао
+20947  -     МЕРИДИАН
+420694 -     МКБ ао
+16782  -     ММК
+80390  -     МН-фонд ао
+16917  -     МОЭСК
+20309  -     МРСК СЗ
+20412  -     МРСК СК
+20402  -     МРСК Ур
+20107  MRKP  МРСК ЦП
+20235  -     МРСК Центр
+20286  -     МРСКВол
+20346  -     МРСКСиб
+20681  -     МРСКЮга ао
+15523  MTS   МТС-ао
+74562  -     МагадЭн ао
+74563  -     МагадЭн ап
+17086  MGNT  Магнит ао
+16331  -     МариЭнСб-п
+152516 MFON  МегаФон ао
+30     -     Мегион-ао
+51     -     Мегион-ап
+81829  -     МедиаВиМ
+20737  -     Медиахолд
+21018  -     Мечел ао
+80745  -     Мечел ап
+16359  -     МордЭнСб
+81944  -     Морион ао
+152798 MOEX  МосБиржа
+82890  -     МосОблБанк
+74549  -     Мостотрест
+152676 -     МультиСис
+81945  -     МурмТЭЦ-ао
+81946  -     МурмТЭЦ-п
+20100  -     НКНХ ао
+20101  -     НКНХ ап
+450432 -     НКХП ао
+17046  -     НЛМК ао
+19629  -     НМТП ао
+81287  -     Нефтекамск
+81947  -     Нижкамшина
+17370  NVTK  Новатэк ао
+414560 -     ОВК ао
+18684  OGKB  ОГК-2 ао
+175781 -     ОКС ао
+15844  -     ОМЗ-ап
+488674 -     ОР ао
+81856  -     ОргСинт ао
+81857  -     ОргСинт ап
+18654  -     ПИК ао
+35247  -     ПРОТЕК ао
+81896  -     ПавлАвт ао
+16909  -     ПермьЭнС-п
+16908  -     ПермьЭнСб
+81241  -     Плазмек
+17123  PLZL  Полюс
+80818  -     Приморье
+74779  -     РБК ао
+181934 -     РГС СК ао
+181755 -     РДБанк ао
+81933  -     РН-ЗапСиб
+20637  -     РОСИНТЕРао
+17713  RASP  Распадская
+16866  -     Росбанк ао
+17273  ROSN  Роснефть
+20971  -     Россети ао
+20972  -     Россети ап
+7      RTKM  Ростел -ао
+15     RTKMP Ростел -ап
+35238  -     РусАква ао
+20266  HYDR  РусГидро
+66893  -     Русгрэйн
+181316 -     Русолово
+20712  -     Русполимет
+465236 -     РуссНфт ао
+16455  -     РязЭнСб
+491359 -     САФМАР ао
+22401  -     СЗПароход
+20892  -     СМЗ-ао
+16080  -     СОЛЛЕРС
+445    -     СамарЭн-ао
+70     -     СамарЭн-ап
+81891  -     СаратНПЗ
+81892  -     СаратНПЗ-п
+11     -     СаратЭн-ао
+24     -     СаратЭн-ап
+473000 -     Сахэнер ао
+3      SBER  Сбербанк
+23     -     Сбербанк-п
+16136  CHMF  СевСт-ао
+81360  -     Селигдар
+82610  -     Селигдар-п
+436091 -     СибГост ао
+19715  AFKS  Система ао
+15723  -     Слав-ЯНОСп
+15722  -     Славн-ЯНОС
+20087  -     СтаврЭнСб
+20088  -     СтаврЭнСбп
+4      -     Сургнфгз
+13     -     Сургнфгз-п
+81914  -     ТАНТАЛ ао
+81915  -     ТАНТАЛ ап
+18382  -     ТГК-1
+18176  -     ТГК-14
+17597  -     ТГК-2
+18189  -     ТГК-2 ап
+20716  -     ТЗА ао
+81899  -     ТКЗ ао
+81905  -     ТКЗКК ао
+81906  -     ТКЗКК ап
+74746  -     ТКСМ ао
+18441  -     ТМК ао
+19916  -     ТНСэКубань
+16547  -     ТНСэнВор-п
+16546  -     ТНСэнВорон
+16330  -     ТНСэнМарЭл
+16615  -     ТНСэнНН ао
+16616  -     ТНСэнНН ап
+16783  -     ТНСэнРст
+16784  -     ТНСэнРст-п
+16342  -     ТНСэнЯр
+16343  -     ТНСэнЯр-п
+420644 -     ТНСэнрг ао
+16797  -     ТРК ао
+16798  -     ТРК ап
+16265  -     ТамбЭнСб
+16266  -     ТамбЭнСб-п
+825    -     Татнфт 3ао
+826    -     Татнфт 3ап
+18371  -     Таттел. ао
+21002  -     Телеграф
+81575  -     Телеграф-п
+74561  -     ТрансК ао
+497210 -     ТрансФ ао
+1012   -     Транснф ап
+82611  -     УрКузница
+81953  -     УралСиб ао
+19623  -     Уркалий-ао
+20509  FSK   ФСК ЕЭС ао
+81858  -     Физика ао
+81114  PHOR  ФосАгро ао
+81939  -     Химпром ао
+81940  -     Химпром ап
+19095  -     ЦМТ ао
+19096  -     ЦМТ ап
+83121  -     ЧЗПСН ао
+21000  -     ЧКПЗ ао
+21001  -     ЧМК ао
+20999  -     ЧТПЗ ао
+16712  -     ЧелябЭС ао
+16713  -     ЧелябЭС ап
+20125  -     ЧеркизГ-ао
+81934  -     Электрцинк
+16440  -     ЭнелРос ао
+20321  -     ЭнергияРКК
+15522  -     ЮТэйр ао
+82493  -     ЮУНК ао
+20717  -     ЮжКузб. ао
+18584  -     Юнипро ао
+81917  -     ЯТЭК ао
+81769  -     Якутскэн-п
+81766  -     Якутскэнрг
+'''
+
+MAIN_EQUITIES = [
+  'AFLT', 'AGRO', 'ALRS', 'AFKS', 'CHMF', 'FIVE', 'FSK', 'GAZP', 'GMNK', 'HYDR', 'LKOH', 'LSGN',
+  'MFON', 'MGNT', 'MSNG', 'MRKP',
+  'MOEX', 'MTS', 'NVTK', 'OGKB', 'PHOR', 'PLZL', 'RASP', 'RTKM', 'SBER', 'SIBN', 'VTB', 'YNDX',
+]
+
+
+def _market_value(market):
+  return getattr(market, 'value', market)
+
+
+class Registry(object):
+  def __init__(self, tables):
+    # tables: [(market, text)], `market` is a `fetcher.Market` or its value.
+    self._tables = tables
+    self._lock = threading.Lock()
+    self._instruments = None
+
+  def _load(self):
+    if self._instruments is None:
+      with self._lock:
+        if self._instruments is None:
+          instruments = []
+          for market, text in self._tables:
+            for line in text.splitlines():
+              if line.strip():
+                code, ticker, name = line.split(None, 2)
+                instruments.append(Instrument(ticker if ticker != '-' else '', code, name, _market_value(market)))
+          self._by_ticker = {i.ticker: i for i in instruments if i.ticker}
+          self._by_code = {i.code: i for i in instruments}
+          self._by_name = {i.name: i for i in instruments}
+          self._instruments = instruments
+    return self._instruments
+
+  def __iter__(self):
+    return iter(self._load())
+
+  def __len__(self):
+    return len(self._load())
+
+  def by_ticker(self, ticker):
+    self._load()
+    return self._by_ticker[ticker]
+
+  def by_code(self, code):
+    self._load()
+    return self._by_code[str(code)]
+
+  def by_name(self, name):
+    self._load()
+    return self._by_name[name]
+
+  def by_market(self, market):
+    value = _market_value(market)
+    return [i for i in self._load() if i.market == value]
+
+  def em(self, ticker):
+    return self.by_ticker(ticker).code
+
+
+registry = Registry([(1, MOEX_STOCK)])  # Market.MOEX_STOCK
+
+
+# The tables of `fetcher` before the registry, as views over it (parsed on the first access too).
+
+class _Equities(collections_abc.Sequence):
+  # [{'name', 'code', 'ticker'}], built on the first access.
+  _items = None
+
+  def _list(self):
+    if self._items is None:
+      self._items = [dict(name=i.name, code=i.code, ticker=i.ticker) for i in registry]
+    return self._items
+
+  def __getitem__(self, index):
+    return self._list()[index]
+
+  def __len__(self):
+    return len(registry)
+
+
+class _Codes(collections_abc.Mapping):
+  # {ticker: em code}
+  def __getitem__(self, ticker):
+    return registry.em(ticker)
+
+  def __iter__(self):
+    return (i.ticker for i in registry if i.ticker)
+
+  def __len__(self):
+    return sum(1 for _ in self)
+
+
+MOEX_EQUITIES = _Equities()
+MOEX_CODES = _Codes()
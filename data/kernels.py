@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+__author__ = 'maxim'
+
+
+# Fused return kernels over a contiguous (columns x rows) block, e.g. the OHLCV series stacked one per row,
+# which is also the layout of a pandas float block. The result goes to `out` when given,
+# so the repeated calls don't allocate.
+
+def returns_kernel(block, kind='simple', relative_to=None, dtype=np.float64, out=None, skip_first=False):
+  # kind='simple': x[t] / x[t-1] - 1 (the same as `pct_change`)
+  # kind='log':    log(x[t] / x[t-1])
+  # relative_to:   a 1-D array (or a row index) r, the return is (r[t] - x[t]) / x[t]
+  # skip_first:    drop the first bar instead of filling it with NaN
+  block = np.asarray(block)
+  if block.ndim == 1:
+    block = block[None, :]
+  columns, rows = block.shape
+  if skip_first and relative_to is None:
+    rows = max(rows - 1, 0)
+  if out is None:
+    out = np.empty((columns, rows), dtype=dtype)
+  assert out.shape == (columns, rows), 'Expected the output of shape %s, got %s' % ((columns, rows), out.shape)
+
+  with np.errstate(divide='ignore', invalid='ignore'):
+    if relative_to is not None:
+      base = block[relative_to] if np.ndim(relative_to) == 0 else np.asarray(relative_to)
+      np.subtract(base[None, :], block, out=out, casting='same_kind')
+      np.divide(out, block, out=out, casting='same_kind')
+      if kind == 'log':
+        np.log1p(out, out=out)
+      return out
+
+    target = out if skip_first else out[:, 1:]
+    if not skip_first and rows:
+      out[:, 0] = np.nan
+    np.divide(block[:, 1:], block[:, :-1], out=target, casting='same_kind')
+    if kind == 'log':
+      np.log(target, out=target)
+    else:
+      np.subtract(target, 1, out=target, casting='same_kind')
+  return out
@@ -1,71 +1,255 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import datetime
-import matplotlib.pyplot as plt
+import io
+import os
+import tempfile
+
+import numpy as np
 import pandas as pd
 
+from data import events
+from data.kernels import returns_kernel
+
 __author__ = 'maxim'
 
 
-def load(filename):
-  df = pd.read_csv(filename,
-                   names=['ticker', 'period', 'date', 'time', 'open', 'high', 'low', 'close', 'volume'],
-                   parse_dates={'timestamp': ['date', 'time']},
-                   date_parser=lambda x: datetime.datetime.strptime(x, '%d/%m/%y %H:%M:%S'),
-                   skiprows=1)
+COLUMNS = ['ticker', 'period', 'date', 'time', 'open', 'high', 'low', 'close', 'volume']
+PRICE_COLUMNS = ['open', 'high', 'low', 'close']
+
+
+def _digits(strings, width):
+  # ASCII strings -> (n, width) matrix of digits, the padding and the separators are kept as (byte - '0').
+  raw = np.asarray(strings, dtype='S%d' % width)
+  return raw.view(np.uint8).reshape(-1, width).astype(np.int64) - ord('0')
+
+
+def _is_fixed(digits, separator):
+  expected = ord(separator) - ord('0')
+  return (digits[:, 2] == expected).all() and (digits[:, 5] == expected).all() and (digits[:, 8] == -ord('0')).all()
+
+
+def parse_timestamps(dates, times):
+  # Vectorized equivalent of `strptime(date + ' ' + time, '%d/%m/%y %H:%M:%S')`.
+  if not len(dates):
+    return np.array([], dtype='datetime64[ns]')
+  d = _digits(dates, 9)
+  t = _digits(times, 9)
+  if not (_is_fixed(d, '/') and _is_fixed(t, ':')):
+    combined = pd.Series(dates, dtype=str) + ' ' + pd.Series(times, dtype=str)
+    return pd.to_datetime(combined, format='%d/%m/%y %H:%M:%S').values.astype('datetime64[ns]')
+  day = d[:, 0] * 10 + d[:, 1]
+  month = d[:, 3] * 10 + d[:, 4]
+  year = d[:, 6] * 10 + d[:, 7]
+  year += np.where(year < 69, 2000, 1900)  # the same pivot as `%y` in strptime
+  seconds = (t[:, 0] * 10 + t[:, 1]) * 3600 + (t[:, 3] * 10 + t[:, 4]) * 60 + t[:, 6] * 10 + t[:, 7]
+  months = ((year - 1970) * 12 + month - 1).astype('datetime64[M]')
+  days = months.astype('datetime64[D]') + (day - 1).astype('timedelta64[D]')
+  return days.astype('datetime64[ns]') + seconds.astype('timedelta64[s]')
+
+
+def _dtypes(price_dtype):
+  dtypes = {'ticker': 'category', 'period': 'category', 'date': str, 'time': str, 'volume': np.int64}
+  dtypes.update({key: price_dtype for key in PRICE_COLUMNS})
+  return dtypes
+
+
+def _finalize(df):
+  df.insert(0, 'timestamp', parse_timestamps(df['date'].values, df['time'].values))
+  return df.drop(columns=['date', 'time'])
+
+
+# Binary sidecar cache: `SBER_day.txt` -> `SBER_day.txt.npz` with one raw array per column.
+# The sidecar is valid as long as the source mtime and size are the same as at the moment of parsing.
+CACHE_SUFFIX = '.npz'
+CACHE_VERSION = 1
+CATEGORY_COLUMNS = ['ticker', 'period']
+
+
+def _source_key(filename, params=()):
+  stat = os.stat(filename)
+  return np.array([CACHE_VERSION, stat.st_mtime_ns, stat.st_size] + list(params), dtype=np.int64)
+
+
+def _to_arrays(df):
+  arrays = {'timestamp': df['timestamp'].values.astype('datetime64[ns]')}
+  for key in CATEGORY_COLUMNS:
+    arrays[key + '_codes'] = df[key].cat.codes.values
+    arrays[key + '_categories'] = np.asarray(df[key].cat.categories, dtype=str)
+  for key in PRICE_COLUMNS + ['volume']:
+    arrays[key] = df[key].values
+  return arrays
+
+
+def _from_arrays(arrays, price_dtype):
+  df = pd.DataFrame({'timestamp': arrays['timestamp']})
+  for key in CATEGORY_COLUMNS:
+    df[key] = pd.Categorical.from_codes(arrays[key + '_codes'], categories=arrays[key + '_categories'])
+  for key in PRICE_COLUMNS:
+    df[key] = arrays[key].astype(price_dtype, copy=False)
+  df['volume'] = arrays['volume']
   return df
 
 
-def to_changes(raw):
-  changes_df = pd.DataFrame(data={
-    'timestamp': raw.timestamp,
-    'high': raw.high.pct_change(),
-    'low': raw.low.pct_change(),
-    'open': raw.open.pct_change(),
-    'close': raw.close.pct_change(),
-    'volume': raw.volume.replace({0: 1e-5}).pct_change()
-  }, columns=['timestamp', 'high', 'low', 'open', 'close', 'volume'])
-  changes_df = changes_df.set_index('timestamp')
-  changes_df = changes_df[1:]
-  return changes_df
+def _read_cache(path, key):
+  try:
+    with np.load(path, allow_pickle=False) as data:
+      if not np.array_equal(data['key'], key):
+        return None
+      return {name: data[name] for name in data.files}
+  except Exception:
+    return None  # missing, stale format or half-written by a crashed process
+
 
+def _write_cache(path, key, arrays):
+  # Each writer uses its own temp file and atomically renames it: the concurrent writers can only
+  # overwrite each other with the complete sidecars, the readers never see a partial one.
+  try:
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.part')
+  except OSError:
+    return  # read-only storage: just don't cache
+  try:
+    with os.fdopen(fd, 'wb') as file:
+      np.savez(file, key=key, **arrays)
+    os.replace(tmp_path, path)
+  except OSError:
+    if os.path.exists(tmp_path):
+      os.remove(tmp_path)
+
+
+def parse(filename, price_dtype=np.float64):
+  with events.stage('parse', path=filename, bytes=os.path.getsize(filename)) as fields:
+    df = pd.read_csv(filename, names=COLUMNS, dtype=_dtypes(price_dtype), skiprows=1)
+    df = _finalize(df)
+    fields['rows'] = len(df)
+  return df
 
-def return_series(raw, key='close', relative_to=None):
-  name = '%s_return' % key
-  if relative_to:
-    returns = (raw[relative_to] - raw[key]) / raw[key]
-  else:
-    returns = raw[key].pct_change(1)
-  return name, returns
 
+def parse_lines(lines, price_dtype=np.float64):
+  # The data rows of an export (bytes, without the header), e.g. the tail fetched by the poller.
+  df = pd.read_csv(io.BytesIO(b'\n'.join(lines)), names=COLUMNS, dtype=_dtypes(price_dtype))
+  return _finalize(df)
 
-def to_returns(raw, keys=('close',), relative_to=None):
-  columns = {}
-  for key in keys:
-    name, series = return_series(raw, key=key, relative_to=relative_to)
-    columns[name] = series
-  returns_df = raw.assign(**columns)
-  return returns_df
+
+def load_cached(filename, build, suffix=CACHE_SUFFIX, params=(), price_dtype=np.float64):
+  # Returns `build()` (a frame in the `load` layout derived from `filename`) through a sidecar
+  # `filename + suffix`. The integer `params` of the derivation are a part of the cache key.
+  key = _source_key(filename, params)
+  cache_path = filename + suffix
+  arrays = _read_cache(cache_path, key)
+  if arrays is not None:
+    events.emit('cache.hit', path=cache_path, rows=len(arrays['timestamp']))
+    return _from_arrays(arrays, price_dtype)
+  events.emit('cache.miss', path=cache_path)
+  # Always cache the full precision, the narrower dtypes are cast on read.
+  arrays = _to_arrays(build())
+  _write_cache(cache_path, key, arrays)
+  return _from_arrays(arrays, price_dtype)
+
+
+def load(filename, price_dtype=np.float64, cache=True):
+  if not cache:
+    return parse(filename, price_dtype)
+  return load_cached(filename, lambda: parse(filename), price_dtype=price_dtype)
+
+
+CHANGE_COLUMNS = ['high', 'low', 'open', 'close', 'volume']
+
+
+def to_changes(raw, dtype=np.float64):
+  with events.stage('compute.changes', rows=len(raw)):
+    return _to_changes(raw, dtype)
+
+
+def _to_changes(raw, dtype):
+  block = np.empty((len(CHANGE_COLUMNS), len(raw)))
+  for i, key in enumerate(CHANGE_COLUMNS):
+    block[i] = raw[key].values
+  volume = block[-1]
+  volume[volume == 0] = 1e-5
+  changes = returns_kernel(block, dtype=dtype, skip_first=True)
+  index = pd.DatetimeIndex(raw.timestamp.values[1:], name='timestamp')
+  return pd.DataFrame(changes.T, index=index, columns=CHANGE_COLUMNS, copy=False)
+
+
+def to_returns(raw, keys=('close',), relative_to=None, kind='simple', dtype=np.float64):
+  # The key columns are stacked into one (keys x rows) block, one kernel call for all of them.
+  keys = list(keys)
+  base = raw[relative_to].values if relative_to else None
+  with events.stage('compute.returns', rows=len(raw)):
+    block = np.empty((len(keys), len(raw)))
+    for i, key in enumerate(keys):
+      block[i] = raw[key].values
+    returns = returns_kernel(block, kind=kind, relative_to=base, dtype=dtype)
+  columns = {'%s_return' % key: returns[i] for i, key in enumerate(keys)}
+  return raw.assign(**columns)
+
+
+# Streaming: the file is read in fixed-size typed chunks, so that the minute and tick histories
+# are processed in constant memory. The previous bar is carried across the chunk boundaries,
+# the results are the same as of the in-memory functions.
+def _file_categories(filename, chunksize):
+  # The sorted values of the category columns in the whole file, as `read_csv` makes them in `load`.
+  values = {key: set() for key in CATEGORY_COLUMNS}
+  reader = pd.read_csv(filename, names=COLUMNS, usecols=CATEGORY_COLUMNS, dtype=str, skiprows=1, chunksize=chunksize)
+  for chunk in reader:
+    for key in CATEGORY_COLUMNS:
+      values[key].update(chunk[key].unique())
+  return {key: sorted(values[key]) for key in CATEGORY_COLUMNS}
+
+
+def load_chunks(filename, chunksize=1000000, price_dtype=np.float64, categories=None):
+  # All the chunks share the categories of `ticker`, `period`: the given ones ({column: values}, required for
+  # a stream) or the file's, found by a first pass over these two columns. So the concatenated chunks are
+  # the `load` frame.
+  categories = categories or _file_categories(filename, chunksize)
+  dtypes = _dtypes(price_dtype)
+  dtypes.update({key: pd.CategoricalDtype(categories[key]) for key in CATEGORY_COLUMNS})
+  reader = pd.read_csv(filename, names=COLUMNS, dtype=dtypes, skiprows=1, chunksize=chunksize)
+  for chunk in reader:
+    yield _finalize(chunk)
+
+
+def _with_carry(chunks, func):
+  previous = None
+  for chunk in chunks:
+    if previous is None:
+      yield func(chunk, first=True)
+    else:
+      yield func(pd.concat([previous, chunk]), first=False)
+    previous = chunk.iloc[-1:]
+
+
+def iter_changes(chunks):
+  # `to_changes` drops the first row: either the very first bar or the carried one.
+  return _with_carry(chunks, lambda chunk, first: to_changes(chunk))
+
+
+def iter_returns(chunks, keys=('close',), relative_to=None):
+  def func(chunk, first):
+    returns_df = to_returns(chunk, keys=keys, relative_to=relative_to)
+    return returns_df if first else returns_df.iloc[1:]
+  return _with_carry(chunks, func)
 
 
 def main():
+  import matplotlib.pyplot as plt
+  plt.style.use('ggplot')
   df = load('.storage/SBER_2000-01-01_2018-07-21_day.txt')
 
   close_df = df[['timestamp', 'close']]
   close_df = close_df.set_index('timestamp')
-  close_df = close_df.ix['2009-01-01':]
+  close_df = close_df.loc['2009-01-01':]
   close_df.plot(figsize=(10, 10))
   plt.show()
 
   changes = to_changes(df)
-  changes = changes.ix['2009-01-01':]
+  changes = changes.loc['2009-01-01':]
   changes.plot(subplots=True, figsize=(10, 10))
   plt.show()
 
 
 if __name__ == '__main__':
-  plt.style.use('ggplot')
   pd.options.display.max_rows = 50
   pd.set_option('max_columns', 50)
   pd.set_option('max_colwidth', 50)
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from contextlib import contextmanager
+import functools
+import hashlib
+import inspect
+import marshal
+import os
+import pickle
+import sqlite3
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from data import events
+
+__author__ = 'maxim'
+
+
+# Disk memoization of the derived series: `memo.call(get_returns, path)`, `memo.call(to_returns, raw, keys=...)`,
+# `memo.call(build_features, bars, first_bars=3)`. The key is the content of the inputs (the files by their sha1,
+# the frames and the arrays by the hash of their values) plus the function, its source and the other arguments
+# (with the defaults applied, so `f(x)` and `f(x, flag=None)` are the same entry). An entry is reused by any script
+# as long as the data and the function are the same. The functions it calls are not hashed: bump MEMO_VERSION
+# when their results change. The results are pickled into `<root>/<key>.pkl`, the SQLite index keeps the sizes
+# and the access times for the LRU eviction above `max_bytes`, and the hit/miss counts per function.
+
+MEMO_VERSION = 1
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entries (
+  key TEXT PRIMARY KEY,
+  function TEXT NOT NULL,
+  size INTEGER NOT NULL,
+  last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_lru ON entries (last_used);
+CREATE TABLE IF NOT EXISTS stats (
+  function TEXT PRIMARY KEY,
+  hits INTEGER NOT NULL,
+  misses INTEGER NOT NULL,
+  evictions INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sources (
+  path TEXT PRIMARY KEY,
+  mtime_ns INTEGER NOT NULL,
+  size INTEGER NOT NULL,
+  sha1 TEXT NOT NULL
+);
+'''
+
+
+def _function_name(func):
+  return '%s.%s' % (func.__module__, getattr(func, '__qualname__', func.__name__))
+
+
+_code_hashes = {}
+
+
+def _code_hash(func):
+  # The sha1 of the function's source, or of its code object (with the constants) when the source isn't available.
+  if func not in _code_hashes:
+    try:
+      code = inspect.getsource(inspect.unwrap(func)).encode()
+    except (OSError, TypeError):
+      code = marshal.dumps(func.__code__) if hasattr(func, '__code__') else b''
+    _code_hashes[func] = hashlib.sha1(code).hexdigest()
+  return _code_hashes[func]
+
+
+def _arguments(func, args, kwargs):
+  # {parameter: value} with the defaults applied, or the call as is for the callables without a signature.
+  try:
+    bound = inspect.signature(func).bind(*args, **kwargs)
+  except (TypeError, ValueError):
+    return {'args': list(args), 'kwargs': kwargs}
+  bound.apply_defaults()
+  return dict(bound.arguments)
+
+
+class Memo(object):
+  def __init__(self, root='.storage/memo', max_bytes=2 << 30):
+    self.root = root
+    self.max_bytes = max_bytes
+    if not os.path.exists(root):
+      os.makedirs(root)
+    self.index_path = os.path.join(root, 'index.sqlite')
+    with self._connect() as connection:
+      connection.executescript(SCHEMA)
+
+  @contextmanager
+  def _connect(self):
+    # A connection per operation: the memo is shared by the worker processes.
+    connection = sqlite3.connect(self.index_path, timeout=30)
+    try:
+      with connection:  # commit or roll back
+        yield connection
+    finally:
+      connection.close()
+
+  def _file_hash(self, path):
+    # The sha1 of a file, recomputed only when its mtime or size changes.
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    with self._connect() as connection:
+      row = connection.execute('SELECT mtime_ns, size, sha1 FROM sources WHERE path = ?', (path, )).fetchone()
+    if row and row[0] == stat.st_mtime_ns and row[1] == stat.st_size:
+      return row[2]
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+      for block in iter(lambda: file.read(1 << 20), b''):
+        digest.update(block)
+    with self._connect() as connection:
+      connection.execute('INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?)',
+                         (path, stat.st_mtime_ns, stat.st_size, digest.hexdigest()))
+    return digest.hexdigest()
+
+  def _digest(self, value, digest):
+    if isinstance(value, pd.Series):
+      value = value.to_frame()
+    if isinstance(value, pd.DataFrame):
+      digest.update(b'frame')
+      digest.update(repr([(name, str(dtype)) for name, dtype in value.dtypes.items()]).encode())
+      digest.update(repr(list(value.index.names)).encode())
+      digest.update(pd.util.hash_pandas_object(value, index=True).values.tobytes())
+    elif isinstance(value, np.ndarray):
+      digest.update(b'array')
+      digest.update(repr((value.dtype.str, value.shape)).encode())
+      digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, dict):
+      digest.update(b'dict')
+      for key in sorted(value, key=repr):
+        digest.update(repr(key).encode())
+        self._digest(value[key], digest)
+    elif isinstance(value, (list, tuple)):
+      digest.update(type(value).__name__.encode())
+      for item in value:
+        self._digest(item, digest)
+    elif isinstance(value, str) and os.path.isfile(value):
+      digest.update(b'file')
+      digest.update(self._file_hash(value).encode())
+    else:
+      digest.update(repr(value).encode())
+
+  def key(self, func, args, kwargs):
+    digest = hashlib.sha1()
+    digest.update(('%s:%s:%d' % (_function_name(func), _code_hash(func), MEMO_VERSION)).encode())
+    self._digest(_arguments(func, args, kwargs), digest)
+    return digest.hexdigest()
+
+  def _count(self, connection, name, hits=0, misses=0, evictions=0):
+    connection.execute('INSERT OR IGNORE INTO stats VALUES (?, 0, 0, 0)', (name, ))
+    connection.execute('UPDATE stats SET hits = hits + ?, misses = misses + ?, evictions = evictions + ? '
+                       'WHERE function = ?', (hits, misses, evictions, name))
+
+  def _read(self, key):
+    try:
+      with open(os.path.join(self.root, key + '.pkl'), 'rb') as file:
+        return True, pickle.load(file)
+    except Exception:
+      return False, None  # missing, evicted by another process, or unreadable (truncated, a class that is gone)
+
+  def _write(self, key, value):
+    # Atomic as the sidecar caches: the readers never see a partial entry.
+    fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix='.part')
+    try:
+      with os.fdopen(fd, 'wb') as file:
+        pickle.dump(value, file, protocol=pickle.HIGHEST_PROTOCOL)
+      path = os.path.join(self.root, key + '.pkl')
+      os.replace(tmp_path, path)
+    except BaseException:
+      if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+      raise
+    return os.path.getsize(path)
+
+  def _evict(self, connection):
+    total = connection.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+    if total <= self.max_bytes:
+      return
+    for key, name, size in connection.execute('SELECT key, function, size FROM entries ORDER BY last_used').fetchall():
+      if total <= self.max_bytes:
+        break
+      path = os.path.join(self.root, key + '.pkl')
+      if os.path.exists(path):
+        os.remove(path)
+      connection.execute('DELETE FROM entries WHERE key = ?', (key, ))
+      self._count(connection, name, evictions=1)
+      events.emit('memo.evict', function=name, bytes=size)
+      total -= size
+
+  def call(self, func, *args, **kwargs):
+    name = _function_name(func)
+    key = self.key(func, args, kwargs)
+    start = time.time()
+    found, value = self._read(key)
+    if found:
+      with self._connect() as connection:
+        connection.execute('UPDATE entries SET last_used = ? WHERE key = ?', (time.time(), key))
+        self._count(connection, name, hits=1)
+      events.emit('memo.hit', function=name, elapsed=time.time() - start)
+      return value
+
+    value = func(*args, **kwargs)
+    size = self._write(key, value)
+    with self._connect() as connection:
+      connection.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)', (key, name, size, time.time()))
+      self._count(connection, name, misses=1)
+      self._evict(connection)
+    events.emit('memo.miss', function=name, bytes=size, elapsed=time.time() - start)
+    return value
+
+  def wrap(self, func):
+    # `get_returns = memo.wrap(get_returns)`
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+      return self.call(func, *args, **kwargs)
+    return wrapper
+
+  def stats(self):
+    # {function: (hits, misses, evictions)} and the total size of the entries.
+    with self._connect() as connection:
+      rows = connection.execute('SELECT function, hits, misses, evictions FROM stats ORDER BY function').fetchall()
+      size = connection.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+    return {row[0]: row[1:] for row in rows}, size
+
+  def clear(self):
+    with self._connect() as connection:
+      for (key, ) in connection.execute('SELECT key FROM entries').fetchall():
+        path = os.path.join(self.root, key + '.pkl')
+        if os.path.exists(path):
+          os.remove(path)
+      connection.execute('DELETE FROM entries')
+      connection.execute('DELETE FROM stats')
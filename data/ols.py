@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from collections import namedtuple
+
+import numpy as np
+
+__author__ = 'maxim'
+
+
+# Many OLS problems at once via the normal equations. The leading axes of `x` (..., nobs, k) and `y` (..., nobs)
+# are the batch, e.g. the tickers. The rows with a NaN anywhere are excluded per problem.
+# The statistics follow `statsmodels.OLS`: when the design has no constant column, R^2 is uncentered.
+
+OLSResult = namedtuple('OLSResult', ['params', 'bse', 'tvalues', 'rsquared', 'nobs'])
+
+# The rolling sums start over from the rows every this many windows; the expanding ones are carried over
+# the blocks of this many bars.
+REFRESH_WINDOWS = 16
+EXPANDING_BLOCK = 1 << 14
+
+
+def _masked(x, y):
+  x = np.asarray(x, dtype=np.float64)
+  y = np.asarray(y, dtype=np.float64)
+  valid = np.isfinite(y) & np.isfinite(x).all(axis=-1)
+  x = np.where(valid[..., None], x, 0.0)
+  y = np.where(valid, y, 0.0)
+  return x, y, valid
+
+
+def _intercept(x, valid):
+  # 1 / c at the first constant column (the same non-zero value c in all the valid rows) of each problem, 0 elsewhere.
+  big = np.where(valid[..., None], x, np.nan)
+  with np.errstate(invalid='ignore'):
+    low = np.nanmin(big, axis=-2)
+    high = np.nanmax(big, axis=-2)
+  constant = (low == high) & (low != 0)
+  first = constant & (np.cumsum(constant, axis=-1) == 1)
+  return np.where(first, 1.0 / np.where(first, low, 1.0), 0.0)
+
+
+def _has_constant(x, valid):
+  return (_intercept(x, valid) != 0).any(axis=-1)
+
+
+def _solve(xtx, xty, yty, ysum, nobs, k, centered, shift=None):
+  # `shift` (intercept, shift_x, shift_y): the sums are of x - shift_x and y - shift_y (shift_x is 0 at the constant
+  # column), which has the same slopes and residuals; the intercept and its variance are moved back here.
+  with np.errstate(divide='ignore', invalid='ignore'):
+    inverse = np.linalg.pinv(xtx)
+    params = np.einsum('...ij,...j->...i', inverse, xty)
+    # RSS = y'y - 2 b'X'y + b'X'X b = y'y - b'X'y for the least squares b.
+    rss = yty - np.einsum('...i,...i->...', params, xty)
+    if shift is not None:
+      intercept, shift_x, shift_y = shift
+      # b = T b~ + e_c shift_y / c,  T = I - e_c shift_x' / c
+      transform = np.eye(k) - intercept[..., :, None] * shift_x[..., None, :]
+      params = np.einsum('...ij,...j->...i', transform, params) + intercept * shift_y[..., None]
+      inverse = np.matmul(np.matmul(transform, inverse), np.swapaxes(transform, -1, -2))
+    df_resid = nobs - k
+    scale = rss / df_resid
+    bse = np.sqrt(np.diagonal(inverse, axis1=-2, axis2=-1) * scale[..., None])
+    tss = np.where(centered, yty - ysum ** 2 / nobs, yty)
+    rsquared = 1 - rss / tss
+    return OLSResult(params, bse, params / bse, rsquared, nobs)
+
+
+def batch_ols(x, y, has_constant=None):
+  x, y, valid = _masked(x, y)
+  k = x.shape[-1]
+  xtx = np.einsum('...ni,...nj->...ij', x, x)
+  xty = np.einsum('...ni,...n->...i', x, y)
+  yty = np.einsum('...n,...n->...', y, y)
+  nobs = valid.sum(axis=-1)
+  centered = _has_constant(x, valid) if has_constant is None else np.asarray(has_constant)
+  return _solve(xtx, xty, yty, y.sum(axis=-1), nobs, k, centered)
+
+
+def _windowed(total, offset, window):
+  # The sums over the windows ending at the rows offset, offset + 1, ... of `total` (the cumulative sums along
+  # the first axis); the windows that start before the first row are shorter.
+  result = total[offset:].copy()
+  first = max(window - offset, 0)
+  result[first:] -= total[offset + first - window:len(total) - window]
+  return result
+
+
+def rolling_ols(x, y, window=None, min_nobs=None, has_constant=None):
+  # The fit at every bar t over the rows (t - window, t], or over all the rows up to t when `window` is None
+  # (expanding). The cross-product sums are moved along the bars by adding the new rows and dropping the old ones,
+  # as the differences of the cumulative sums over a block of REFRESH_WINDOWS windows; every block starts over
+  # from its rows, so the sums don't grow with the history and their rounding errors don't accumulate.
+  # The expanding sums are carried from block to block. The memory is bounded by the block (and the output).
+  # Not a recursive least squares (a rank-one update of the inverse per row): the add/drop of the sums is
+  # vectorized over all the bars of a block, and every window is solved from its own normal equations,
+  # so there is no inverse carried from row to row to lose its precision.
+  x, y, valid = _masked(x, y)
+  k = x.shape[-1]
+  min_nobs = min_nobs or k + 1
+  centered = _has_constant(x, valid) if has_constant is None else np.asarray(has_constant)
+  intercept = _intercept(x, valid)
+  # The bars go first: (n, ..., k), (n, ...).
+  x, y, valid = np.moveaxis(x, -2, 0), np.moveaxis(y, -1, 0), np.moveaxis(valid, -1, 0)
+  size = len(x)
+  step = REFRESH_WINDOWS * window if window else EXPANDING_BLOCK
+
+  results = []
+  carry = shift = None
+  for begin in range(0, size, step):
+    end = min(begin + step, size)
+    low = max(begin - window, 0) if window else begin
+    xs, ys, vs = x[low:end], y[low:end], valid[low:end]
+    if window or shift is None:
+      # With a constant, the data is centered at the block means: the price-scale cross-products of the raw
+      # values cancel in the normal equations. The expanding sums keep the shift of the first block.
+      count = np.maximum(vs.sum(axis=0), 1)
+      has_intercept = (intercept != 0).any(axis=-1)
+      shift_x = np.where(has_intercept[..., None] & (intercept == 0), xs.sum(axis=0) / count[..., None], 0.0)
+      shift_y = np.where(has_intercept, ys.sum(axis=0) / count, 0.0)
+      shift = (intercept, shift_x, shift_y)
+    xs = np.where(vs[..., None], xs - shift[1], 0.0)
+    ys = np.where(vs, ys - shift[2], 0.0)
+    sums = [np.einsum('n...i,n...j->n...ij', xs, xs), xs * ys[..., None], ys * ys, ys, vs.astype(np.int64)]
+    sums = [np.cumsum(values, axis=0) for values in sums]
+    if window:
+      sums = [_windowed(total, begin - low, window) for total in sums]
+    else:
+      if carry is not None:
+        sums = [total + last for total, last in zip(sums, carry)]
+      carry = [total[-1] for total in sums]
+    xtx, xty, yty, ysum, nobs = sums
+    result = _solve(xtx, xty, yty, ysum, nobs, k, centered, shift)
+    enough = nobs >= min_nobs
+    results.append(OLSResult(np.where(enough[..., None], result.params, np.nan),
+                             np.where(enough[..., None], result.bse, np.nan),
+                             np.where(enough[..., None], result.tvalues, np.nan),
+                             np.where(enough, result.rsquared, np.nan),
+                             nobs))
+
+  if not results:
+    empty = np.empty((0, ) + x.shape[1:])
+    results.append(OLSResult(empty, empty, empty, empty[..., 0], empty[..., 0].astype(np.int64)))
+  params, bse, tvalues, rsquared, nobs = [np.concatenate(parts) for parts in zip(*results)]
+  return OLSResult(np.moveaxis(params, 0, -2), np.moveaxis(bse, 0, -2), np.moveaxis(tvalues, 0, -2),
+                   np.moveaxis(rsquared, 0, -1), np.moveaxis(nobs, 0, -1))
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+import os
+import tempfile
+import time
+
+import pandas as pd
+
+from data import events
+from data.catalog import CATALOG_NAME, Catalog
+from data.client import FetchError, shared_client
+from data.fetcher import EXPORT_HOST, Period, generate_url
+from data.instruments import MAIN_EQUITIES, registry
+from data.loader import load_chunks
+from data.resample import FINAM_PERIOD
+from data.store import BarStore
+
+__author__ = 'maxim'
+
+
+# Download-to-parse pipeline: the HTTP response is parsed in chunks while it is being downloaded
+# and every chunk goes straight to the binary store. The raw text is archived only on request.
+
+class _TeeReader(object):
+  def __init__(self, source, sink=None):
+    self.source = source
+    self.sink = sink
+    self.bytes_read = 0
+
+  def read(self, size=-1):
+    data = self.source.read(size)
+    self.bytes_read += len(data)
+    if self.sink is not None:
+      self.sink.write(data)
+    return data
+
+
+def stream_to_store(ticker, period, from_dt, to_dt, store=None, archive_path=None, chunk_rows=100000,
+                    timeout=60, host=EXPORT_HOST):
+  # Returns (rows, bytes). The stored bars from the first received timestamp on are replaced,
+  # so a failed pull can simply be retried.
+  store = store or BarStore()
+  url, _ = generate_url(code=ticker, em=registry.em(ticker), period=period, from_dt=from_dt, to_dt=to_dt, host=host)
+  archive = tmp_path = None
+  rows = 0
+  start = time.time()
+  try:
+    if archive_path:
+      directory = os.path.dirname(archive_path) or '.'
+      if not os.path.exists(directory):
+        os.makedirs(directory)
+      fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.part')
+      archive = os.fdopen(fd, 'wb')
+    with shared_client().open(url, timeout=timeout) as response:
+      if response.status != 200:
+        response.read()
+        raise FetchError(url, response.status, response.reason)
+      reader = _TeeReader(response, archive)
+      try:
+        # A stream can't be read twice for its categories: it's one ticker and period (the store keeps neither).
+        categories = {'ticker': [ticker], 'period': [FINAM_PERIOD[period]]}
+        for chunk in load_chunks(reader, chunksize=chunk_rows, categories=categories):
+          store.append(ticker, period, chunk)
+          rows += len(chunk)
+      except pd.errors.EmptyDataError:
+        pass  # no bars in the range
+      response.read()  # the rest, if any: the connection goes back to the pool only when drained
+  except BaseException:
+    if archive is not None:
+      archive.close()
+    if tmp_path is not None and os.path.exists(tmp_path):
+      os.remove(tmp_path)
+    raise
+
+  if archive is not None:
+    archive.close()
+    os.replace(tmp_path, archive_path)
+    Catalog(os.path.join(os.path.dirname(archive_path), CATALOG_NAME)).register(archive_path)
+  events.emit('fetch.done', ticker=ticker, period=period.slug(), bytes=reader.bytes_read, rows=rows,
+              elapsed=time.time() - start)
+  return rows, reader.bytes_read
+
+
+def main():
+  store = BarStore()
+  for ticker in MAIN_EQUITIES:
+    start = time.time()
+    rows, size = stream_to_store(ticker, Period.HOUR, datetime(year=2012, month=1, day=1), datetime.now(), store)
+    events.log('%-6s %8d rows  %8d Kb  %6.2fs' % (ticker, rows, size / 1024, time.time() - start))
+
+
+if __name__ == '__main__':
+  main()
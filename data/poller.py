@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time as day_time, timedelta, timezone
+import heapq
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+from data import events
+from data.catalog import CATALOG_NAME, Catalog
+from data.fetcher import EXPORT_HOST, HISTORY_START, Period, RateLimiter, append_rows, canonical_name, download_range, \
+  fetch_bytes, generate_url, last_timestamp, midnight, retrying
+from data.instruments import registry
+from data.loader import load, parse_lines
+from data.resample import INTRADAY_SECONDS
+from data.stats import save_json, update_stats
+
+__author__ = 'maxim'
+
+
+# Near-real-time updates: a long-running asyncio scheduler polls the feeds (ticker, period) during the MOEX
+# session shortly after each bar closes, once more after the close for the last bars, and sleeps till the next
+# session. A poll requests only the days since the last stored bar and appends the rows at or after it
+# (that bar might have been still forming), then updates the derived data in place:
+#
+#   <storage>/SBER_1min.txt             the canonical file, as `fetcher.update_all` keeps it
+#   <storage>/SBER_1min.stats.json      the running moments of the returns (`stats.update_stats`), closed bars only
+#   <storage>/bars/SBER/1min/...        the column store (`store.BarStore.append`), if given, closed bars only,
+#                                       appended past the stored rows
+#
+# Events: poll.done (rows appended, bytes received, elapsed, lag = seconds since the close of the last stored bar),
+# poll.failed. `Poller.status()` has the lag of every feed, `status_path` gets it as JSON after each round.
+# The clock is injected: `Clock` is the wall clock in Moscow time, `VirtualClock` skips the waits, so a day of
+# polling against a fake endpoint (`synthetic.FakeFinam`) with the same clock runs without the waits.
+
+MOSCOW = timezone(timedelta(hours=3))  # no DST since 2014
+SESSION = (day_time(10, 0), day_time(18, 50))
+PUBLISH_DELAY = timedelta(seconds=5)   # a closed bar shows up in the export a few seconds later
+AFTER_CLOSE = timedelta(minutes=2)
+
+# Seconds between the polls within the session; None polls only after the close.
+POLL_SECONDS = {
+  Period.TICK: 10,
+  Period.MIN_1: 60,
+  Period.MIN_5: 5 * 60,
+  Period.MIN_10: 10 * 60,
+  Period.MIN_15: 15 * 60,
+  Period.MIN_30: 30 * 60,
+  Period.HOUR: 60 * 60,
+  Period.DAY: None,
+}
+
+Feed = namedtuple('Feed', ['ticker', 'period'])
+
+
+class Clock(object):
+  def now(self):
+    return datetime.now(MOSCOW).replace(tzinfo=None)
+
+  async def sleep(self, seconds):
+    await asyncio.sleep(seconds)
+
+
+class VirtualClock(Clock):
+  # The time moves only when the scheduler sleeps, and at once.
+  def __init__(self, start):
+    self.current = start
+
+  def now(self):
+    return self.current
+
+  async def sleep(self, seconds):
+    self.current += timedelta(seconds=max(seconds, 0))
+    await asyncio.sleep(0)
+
+
+def next_poll(period, now, session=SESSION):
+  # The poll after `now`: at the bar boundaries (plus the publishing delay) within the session,
+  # then after the close, then the next weekday. The holidays are polled too, they just bring no rows.
+  open_at = datetime.combine(now.date(), session[0])
+  last_at = datetime.combine(now.date(), session[1]) + AFTER_CLOSE
+  if now.weekday() >= 5 or now >= last_at:
+    day = now.date() + timedelta(days=1)
+    while day.weekday() >= 5:
+      day += timedelta(days=1)
+    return next_poll(period, datetime.combine(day, day_time(0)), session)
+  interval = POLL_SECONDS[period]
+  if interval is None:
+    return last_at
+  day_start = midnight(now)
+  since = (max(now, open_at) - day_start - PUBLISH_DELAY).total_seconds()
+  due = day_start + timedelta(seconds=(math.floor(since / interval) + 1) * interval) + PUBLISH_DELAY
+  return min(due, last_at)
+
+
+def closed_until(period, now, session=SESSION):
+  # The bars opened at or before this time are closed (the timestamps are the bar open times).
+  # Out of the session nothing is forming: the last bar of the day is final after the close, however short.
+  in_session = now.weekday() < 5 and session[0] <= now.time() < session[1]
+  if period == Period.TICK:
+    return now
+  if period == Period.DAY:
+    today = midnight(now)
+    return today if now >= datetime.combine(now.date(), session[1]) else today - timedelta(days=1)
+  if not in_session:
+    return now
+  return now - timedelta(seconds=INTRADAY_SECONDS[period])
+
+
+def _lag(period, now, last, session):
+  # Seconds from the close of the last stored bar, 0 while it's still forming.
+  if period == Period.TICK:
+    end = last
+  elif period == Period.DAY:
+    end = datetime.combine(last.date(), session[1])
+  else:
+    end = last + timedelta(seconds=INTRADAY_SECONDS[period])
+  return max((now - end).total_seconds(), 0.0)
+
+
+class Poller(object):
+  def __init__(self, feeds, storage='.storage', clock=None, host=EXPORT_HOST, session=SESSION, store=None,
+               workers=4, min_interval=0.5, retries=2, backoff=1.0, timeout=30, history_days=None, status_path=None):
+    # `feeds` is [(ticker, period)]. A missing file is downloaded first, from `history_days` ago or the whole history.
+    self.feeds = [Feed(ticker, period) for ticker, period in feeds]
+    for feed in self.feeds:
+      assert feed.period in POLL_SECONDS, 'Period is not polled: %s' % feed.period.slug()
+    self.storage = storage
+    self.clock = clock or Clock()
+    self.host = host
+    self.session = session
+    self.store = store
+    self.workers = workers
+    self.limiter = RateLimiter(min_interval)
+    self.retries = retries
+    self.backoff = backoff
+    self.timeout = timeout
+    self.history_days = history_days
+    self.status_path = status_path
+    self.metrics = events.Metrics()
+    self.catalog = Catalog(os.path.join(storage, CATALOG_NAME))
+    self._lock = threading.Lock()
+    self._state = {}  # feed -> {last_bar, lag, polls, rows, failures}
+    if not os.path.exists(storage):
+      os.makedirs(storage)
+
+  def _fetch_tail(self, feed, full_path, last, now):
+    # Appends the rows at or after `last`, returns them with the number of the bytes received.
+    url, _ = generate_url(code=feed.ticker, em=registry.em(feed.ticker), period=feed.period,
+                          from_dt=midnight(last), to_dt=now, host=self.host)
+    body, attempts, error = retrying(lambda: fetch_bytes(url, self.timeout), url, self.limiter, self.retries,
+                                     self.backoff)
+    lines = [line for line in (body or b'').splitlines() if line.strip() and not line.startswith(b'<')]
+    if error or not lines:
+      return None, len(body or b''), attempts, error
+    frame = parse_lines(lines)
+    fresh = np.flatnonzero(frame['timestamp'].values >= np.datetime64(last))
+    if not len(fresh):
+      return None, len(body), attempts, None
+    append_rows(full_path, [lines[i] for i in fresh])
+    return frame.iloc[fresh].reset_index(drop=True), len(body), attempts, None
+
+  def poll(self, feed):
+    # One poll, blocking (the scheduler runs it in a thread). Returns the number of the rows received.
+    now = self.clock.now()
+    start = time.time()
+    full_path = os.path.join(self.storage, canonical_name(feed.ticker, feed.period))
+    with self._lock:
+      state = self._state.setdefault(feed, dict(last_bar=None, lag=None, polls=0, rows=0, failures=0))
+    last = state['last_bar'] or (last_timestamp(full_path) if os.path.exists(full_path) else None)
+
+    from_dt = now - timedelta(days=self.history_days) if self.history_days else HISTORY_START
+    if not os.path.exists(full_path):
+      size, attempts, error = download_range(feed.ticker, feed.period, from_dt, now, full_path, self.limiter,
+                                             self.retries, self.backoff, self.timeout, self.host, None, self.workers)
+      if error is None:
+        self.catalog.register(full_path)  # the appends are picked up by the catalog lookups (by mtime)
+      frame = load(full_path) if error is None else None
+    else:
+      frame, size, attempts, error = self._fetch_tail(feed, full_path, last or from_dt, now)
+
+    if error:
+      with self._lock:
+        state['polls'] += 1
+        state['failures'] += 1
+      events.emit('poll.failed', ticker=feed.ticker, period=feed.period.slug(), attempts=attempts,
+                  elapsed=time.time() - start, error=error)
+      events.log('Poll failed %s %s: %s' % (feed.ticker, feed.period.slug(), error))
+      return 0
+
+    rows = 0 if frame is None else len(frame)
+    if rows:
+      # The forming bar goes to the text file only: it would make the store rewrite its tail on every poll,
+      # and it's received again (at or after the last bar) once it's closed. The store gets only the rows after
+      # its own (not the last stored bar received again), so that its appends never rewrite the committed rows.
+      closed = frame[frame['timestamp'].values <= np.datetime64(closed_until(feed.period, now, self.session))]
+      if self.store is not None:
+        unseen = self.store.unseen(feed.ticker, feed.period, closed)
+        if len(unseen):
+          self.store.append(feed.ticker, feed.period, unseen, replace=False)
+      update_stats(full_path, closed)
+      last = frame['timestamp'].iloc[-1].to_pydatetime()
+    lag = _lag(feed.period, now, last, self.session) if last is not None else None
+    with self._lock:
+      state.update(last_bar=last, lag=lag, polls=state['polls'] + 1, rows=state['rows'] + rows)
+    events.emit('poll.done', ticker=feed.ticker, period=feed.period.slug(), rows=rows, bytes=size or 0,
+                attempts=attempts, elapsed=time.time() - start, lag=lag)
+    return rows
+
+  def status(self):
+    # {'SBER_1min': {last_bar, lag, polls, rows, failures}} and the throughput of the polls.
+    with self._lock:
+      feeds = {'%s_%s' % (feed.ticker, feed.period.slug()): dict(state, last_bar=state['last_bar'] and
+                                                                state['last_bar'].isoformat(' '))
+               for feed, state in self._state.items()}
+    return {'time': self.clock.now().isoformat(' '), 'feeds': feeds, 'metrics': self.metrics.summary()}
+
+  async def run(self, until=None):
+    # Polls until the clock reaches `until`, or forever. Every feed is polled at the start to catch up.
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=self.workers)
+    events.subscribe(self.metrics)
+    queue = [(self.clock.now(), i) for i in range(len(self.feeds))]
+    heapq.heapify(queue)
+    try:
+      while queue and (until is None or queue[0][0] <= until):
+        delay = (queue[0][0] - self.clock.now()).total_seconds()
+        if delay > 0:
+          await self.clock.sleep(delay)
+        now = self.clock.now()
+        batch = []
+        while queue and queue[0][0] <= now:
+          batch.append(heapq.heappop(queue)[1])
+        results = await asyncio.gather(*[loop.run_in_executor(executor, self.poll, self.feeds[i]) for i in batch],
+                                       return_exceptions=True)
+        for i, result in zip(batch, results):
+          if isinstance(result, Exception):  # a bug or a broken file must not stop the other feeds
+            feed = self.feeds[i]
+            events.emit('poll.failed', ticker=feed.ticker, period=feed.period.slug(), error=repr(result))
+            events.log('Poll failed %s %s: %r' % (feed.ticker, feed.period.slug(), result))
+          heapq.heappush(queue, (next_poll(self.feeds[i].period, self.clock.now(), self.session), i))
+        if self.status_path:
+          save_json(self.status_path, self.status())
+    finally:
+      events.unsubscribe(self.metrics)
+      executor.shutdown(wait=True)
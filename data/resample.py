@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+
+from data.fetcher import Period
+from data.loader import CACHE_SUFFIX, load, load_cached
+
+__author__ = 'maxim'
+
+
+# Derives the coarser bars from the stored finer ones, so that only the finest period needs to be downloaded.
+# The timestamps are the bar open times (the fetcher requests `MSOR=1`), so a bar belongs to the bucket its
+# open time falls in.
+
+SECOND = 10 ** 9
+DAY = 24 * 3600 * SECOND
+
+INTRADAY_SECONDS = {
+  Period.MIN_1: 60,
+  Period.MIN_5: 5 * 60,
+  Period.MIN_10: 10 * 60,
+  Period.MIN_15: 15 * 60,
+  Period.MIN_30: 30 * 60,
+  Period.HOUR: 60 * 60,
+}
+
+# The `<PER>` column of the Finam export.
+FINAM_PERIOD = {
+  Period.TICK: '0',
+  Period.MIN_1: '1',
+  Period.MIN_5: '5',
+  Period.MIN_10: '10',
+  Period.MIN_15: '15',
+  Period.MIN_30: '30',
+  Period.HOUR: '60',
+  Period.DAY: 'D',
+  Period.WEEK: 'W',
+  Period.MONTH: 'M',
+}
+
+
+SOURCE_PERIODS = {code: period for period, code in FINAM_PERIOD.items()}
+
+
+def is_coarser(target, source):
+  # Every `source` bar falls into one `target` bucket: the intraday lengths divide, a week doesn't fit in a month.
+  if source == Period.TICK:
+    return target != Period.TICK
+  if source in INTRADAY_SECONDS:
+    if target in INTRADAY_SECONDS:
+      return target != source and INTRADAY_SECONDS[target] % INTRADAY_SECONDS[source] == 0
+    return True
+  return source == Period.DAY and target in (Period.WEEK, Period.MONTH)
+
+
+def bucket_keys(timestamps, period, session_shift=None):
+  # `session_shift` moves the day boundary for DAY/WEEK/MONTH. E.g. on FORTS the evening session belongs
+  # to the next trading day, so the shift of 5 hours makes a session day run from 19:00 to 19:00.
+  ns = np.asarray(timestamps).astype('datetime64[ns]').view(np.int64)
+  if period in INTRADAY_SECONDS:
+    length = INTRADAY_SECONDS[period] * SECOND
+    return ns // length * length
+  if session_shift is not None:
+    ns = ns + pd.Timedelta(session_shift).value
+  days = ns // DAY
+  if period == Period.DAY:
+    return days * DAY
+  if period == Period.WEEK:
+    return ((days + 3) // 7 * 7 - 3) * DAY  # 1970-01-01 is Thursday, the weeks start on Monday
+  if period == Period.MONTH:
+    return days.astype('datetime64[D]').astype('datetime64[M]').astype('datetime64[ns]').view(np.int64)
+  raise ValueError('Cannot resample to %s' % period.name)
+
+
+def resample(df, period, session_shift=None):
+  # `df` is in the `loader.load` layout, sorted by timestamp.
+  source = SOURCE_PERIODS.get(str(df['period'].iloc[0])) if len(df) else None
+  if source is not None and not is_coarser(period, source):
+    raise ValueError('Cannot resample %s bars to %s' % (source.name, period.name))
+  keys = bucket_keys(df['timestamp'].values, period, session_shift)
+  if len(keys):
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    ends = np.r_[starts[1:], len(keys)] - 1
+  else:
+    starts = ends = np.array([], dtype=np.int64)
+
+  def reduce(func, key):
+    values = df[key].values
+    return func.reduceat(values, starts) if len(starts) else values[:0]
+
+  return pd.DataFrame({
+    'timestamp': keys[starts].view('datetime64[ns]'),
+    'ticker': pd.Categorical(df['ticker'].values[starts]),
+    'period': pd.Categorical([FINAM_PERIOD[period]] * len(starts)),
+    'open': df['open'].values[starts],
+    'high': reduce(np.maximum, 'high'),
+    'low': reduce(np.minimum, 'low'),
+    'close': df['close'].values[ends],
+    'volume': reduce(np.add, 'volume'),
+  }, columns=['timestamp', 'ticker', 'period', 'open', 'high', 'low', 'close', 'volume'])
+
+
+def load_resampled(filename, period, session_shift=None):
+  # Cached next to the source: `SBER_hour.txt` -> `SBER_hour.txt.day.npz`.
+  shift = pd.Timedelta(session_shift).value if session_shift is not None else 0
+  return load_cached(filename, lambda: resample(load(filename), period, session_shift),
+                     suffix='.%s%s' % (period.slug(), CACHE_SUFFIX), params=(period.value, shift))
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from collections import deque
+import json
+import math
+import os
+import tempfile
+
+import pandas as pd
+
+__author__ = 'maxim'
+
+
+def save_json(path, state):
+  fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.part')
+  with os.fdopen(fd, 'w') as file:
+    json.dump(state, file)
+  os.replace(tmp_path, path)
+
+
+# The returns of a price stream. The last price, its timestamp and the number of the rows fed at that timestamp
+# (the ticks of one second) are kept, so that a stream is continued from a file without a row lost or repeated.
+class _PriceStream(object):
+  def add_price(self, price, timestamp=None):
+    if self.last_price is not None:
+      self.add_return(price / self.last_price - 1)
+    self.last_price = price
+    same = timestamp is not None and timestamp == self.last_timestamp
+    self.last_count = self.last_count + 1 if same else 1
+    self.last_timestamp = timestamp
+    self.bars += 1
+
+  def add_prices(self, prices, timestamps=None):
+    timestamps = timestamps if timestamps is not None else [None] * len(prices)
+    for price, timestamp in zip(prices, timestamps):
+      self.add_price(float(price), None if timestamp is None else pd.Timestamp(timestamp).isoformat())
+
+  def unseen(self, df):
+    # The rows of `df` (sorted by timestamp) after the ones fed already.
+    if self.last_timestamp is None:
+      return df
+    last = pd.Timestamp(self.last_timestamp)
+    left = df['timestamp'].searchsorted(last, side='left')
+    right = df['timestamp'].searchsorted(last, side='right')
+    return df.iloc[min(left + self.last_count, right):]
+
+
+# Running moments (Welford): O(1) per new return, numerically stable.
+# `bars` counts the price bars, so that `sharpe()` uses the same `k = sqrt(len(df))` as `analysis.calc_sharpe`,
+# where the first bar has no return.
+class RunningStats(_PriceStream):
+  def __init__(self, count=0, mean=0.0, m2=0.0, bars=0, last_price=None, last_timestamp=None, last_count=1):
+    self.count = count
+    self.mean = mean
+    self.m2 = m2
+    self.bars = bars
+    self.last_price = last_price
+    self.last_timestamp = last_timestamp
+    self.last_count = last_count
+
+  def add_return(self, value):
+    if value is None or math.isnan(value):
+      return
+    self.count += 1
+    delta = value - self.mean
+    self.mean += delta / self.count
+    self.m2 += delta * (value - self.mean)
+
+  def variance(self):
+    return self.m2 / (self.count - 1) if self.count > 1 else float('nan')
+
+  def std(self):
+    return math.sqrt(self.variance())
+
+  def sharpe(self):
+    return self.bars ** 0.5 * self.mean / self.std()
+
+  def values(self):
+    # The same tuple as `analysis.calc_sharpe`.
+    return self.std(), self.mean, self.sharpe()
+
+  def state(self):
+    return dict(count=self.count, mean=self.mean, m2=self.m2, bars=self.bars,
+                last_price=self.last_price, last_timestamp=self.last_timestamp, last_count=self.last_count)
+
+  def save(self, path):
+    save_json(path, self.state())
+
+  @classmethod
+  def load(cls, path):
+    if not os.path.exists(path):
+      return cls()
+    with open(path) as file:
+      return cls(**json.load(file))
+
+
+# The rolling sums are recomputed from the window after this many windows of updates, as in `correlation`,
+# so that the rounding errors of adding and subtracting don't accumulate over long streams.
+REFRESH_WINDOWS = 16
+
+
+# Moments over the last `window` returns: O(1) per update by adding the new value and removing the oldest one.
+class RollingStats(_PriceStream):
+  def __init__(self, window, values=(), last_price=None, last_timestamp=None, last_count=1, bars=0):
+    self.window = window
+    self.values = deque(maxlen=window)
+    self.total = 0.0
+    self.total_sq = 0.0
+    self._updates = 0
+    for value in values:
+      self.add_return(value)
+    self.bars = bars
+    self.last_price = last_price
+    self.last_timestamp = last_timestamp
+    self.last_count = last_count
+
+  def add_return(self, value):
+    if value is None or math.isnan(value):
+      return
+    if len(self.values) == self.window:
+      oldest = self.values[0]
+      self.total -= oldest
+      self.total_sq -= oldest * oldest
+    self.values.append(value)
+    self._updates += 1
+    if self._updates >= REFRESH_WINDOWS * self.window:
+      self.total = math.fsum(self.values)
+      self.total_sq = math.fsum(value * value for value in self.values)
+      self._updates = 0
+    else:
+      self.total += value
+      self.total_sq += value * value
+
+  def mean(self):
+    return self.total / len(self.values) if self.values else float('nan')
+
+  def variance(self):
+    n = len(self.values)
+    if n < 2:
+      return float('nan')
+    return max(self.total_sq - self.total * self.total / n, 0.0) / (n - 1)
+
+  def std(self):
+    return math.sqrt(self.variance())
+
+  def sharpe(self):
+    return len(self.values) ** 0.5 * self.mean() / self.std()
+
+  def state(self):
+    return dict(window=self.window, values=list(self.values), bars=self.bars, last_price=self.last_price,
+                last_timestamp=self.last_timestamp, last_count=self.last_count)
+
+  def save(self, path):
+    save_json(path, self.state())
+
+  @classmethod
+  def load(cls, path, window):
+    if not os.path.exists(path):
+      return cls(window)
+    with open(path) as file:
+      state = json.load(file)
+    return cls(window, values=state['values'][-window:], last_price=state['last_price'],
+               last_timestamp=state.get('last_timestamp'), last_count=state.get('last_count', 1),
+               bars=state.get('bars', 0))
+
+
+def stats_path(data_path, name='stats'):
+  # The state lives next to the data: `.storage/SBER_day.txt` -> `.storage/SBER_day.stats.json`.
+  return '%s.%s.json' % (os.path.splitext(data_path)[0], name)
+
+
+def update_stats(data_path, df, key='close'):
+  # Feeds only the rows after the ones seen before (the frame is sorted by timestamp).
+  path = stats_path(data_path)
+  stats = RunningStats.load(path)
+  df = stats.unseen(df)
+  stats.add_prices(df[key].values, df['timestamp'].values)
+  stats.save(path)
+  return stats
+
+
+def update_rolling_stats(data_path, df, window, key='close'):
+  # The same for the moments of the last `window` returns, in `<data>.rolling<window>.json`.
+  path = stats_path(data_path, 'rolling%d' % window)
+  stats = RollingStats.load(path, window)
+  df = stats.unseen(df)
+  stats.add_prices(df[key].values, df['timestamp'].values)
+  stats.save(path)
+  return stats
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from data.loader import PRICE_COLUMNS, load
+
+__author__ = 'maxim'
+
+
+# On-disk layout, one directory per ticker/period:
+#
+#   .storage/bars/SBER/day/meta.json         {"rows": 4650, "generation": 3}
+#   .storage/bars/SBER/day/timestamp.3.bin   int64 nanoseconds, sorted
+#   .storage/bars/SBER/day/open.3.bin        float64
+#   ...
+#   .storage/bars/SBER/day/volume.3.bin      int64
+#
+# The column files are raw contiguous arrays, so they can be memory-mapped and shared between processes
+# through the page cache. `meta.json` is the commit point: it is replaced atomically after the data is written,
+# the readers never look past `rows`, and a full rewrite goes to a new generation of files.
+
+DEFAULT_ROOT = os.path.join('.storage', 'bars')
+STORE_COLUMNS = ['timestamp'] + PRICE_COLUMNS + ['volume']
+STORE_DTYPES = dict([('timestamp', np.int64), ('volume', np.int64)] + [(key, np.float64) for key in PRICE_COLUMNS])
+
+
+def _to_ns(value):
+  return pd.Timestamp(value).value
+
+
+class BarStore(object):
+  def __init__(self, root=DEFAULT_ROOT):
+    self.root = root
+
+  def _dir(self, ticker, period):
+    return os.path.join(self.root, ticker, period.slug())
+
+  def _column_path(self, ticker, period, key, generation):
+    return os.path.join(self._dir(ticker, period), '%s.%d.bin' % (key, generation))
+
+  def meta(self, ticker, period):
+    path = os.path.join(self._dir(ticker, period), 'meta.json')
+    if not os.path.exists(path):
+      return None
+    with open(path) as file:
+      return json.load(file)
+
+  def _commit(self, ticker, period, meta):
+    directory = self._dir(ticker, period)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.part')
+    with os.fdopen(fd, 'w') as file:
+      json.dump(meta, file)
+    os.replace(tmp_path, os.path.join(directory, 'meta.json'))
+
+  def exists(self, ticker, period):
+    return self.meta(ticker, period) is not None
+
+  def rows(self, ticker, period):
+    meta = self.meta(ticker, period)
+    return meta['rows'] if meta else 0
+
+  @staticmethod
+  def _timestamps(df):
+    timestamp = df['timestamp'].values if 'timestamp' in df.columns else df.index.values
+    return np.asarray(timestamp).astype('datetime64[ns]').view(np.int64)
+
+  @classmethod
+  def _arrays(cls, df):
+    arrays = {'timestamp': cls._timestamps(df)}
+    for key in STORE_COLUMNS[1:]:
+      arrays[key] = np.ascontiguousarray(df[key].values, dtype=STORE_DTYPES[key])
+    return arrays
+
+  def write(self, ticker, period, df):
+    directory = self._dir(ticker, period)
+    if not os.path.exists(directory):
+      os.makedirs(directory)
+    old = self.meta(ticker, period)
+    generation = old['generation'] + 1 if old else 0
+    arrays = self._arrays(df)
+    for key in STORE_COLUMNS:
+      arrays[key].tofile(self._column_path(ticker, period, key, generation))
+    self._commit(ticker, period, {'rows': len(df), 'generation': generation})
+    if old:
+      # The processes that still map the old generation keep their pages until they unmap them.
+      for key in STORE_COLUMNS:
+        os.remove(self._column_path(ticker, period, key, old['generation']))
+
+  def append(self, ticker, period, df, replace=True):
+    # Appends the bars; the stored bars at or after the first new timestamp are replaced. The committed rows are
+    # never written in place: the new bars past `rows` go into the current files (the readers don't look there),
+    # a replaced tail goes to a new generation. Either way meta.json commits the change.
+    # `replace=False` keeps all the stored bars, e.g. for the rows from `unseen` that continue the ticks
+    # of the last stored second.
+    meta = self.meta(ticker, period)
+    if meta is None:
+      return self.write(ticker, period, df)
+    arrays = self._arrays(df)
+    if not len(arrays['timestamp']):
+      return
+    stored = self.columns(ticker, period)
+    if replace:
+      cut = int(np.searchsorted(stored['timestamp'], arrays['timestamp'][0], side='left'))
+    else:
+      cut = meta['rows']
+      assert not cut or stored['timestamp'][-1] <= arrays['timestamp'][0], 'Not past the stored bars: %s %s' % (
+        ticker, period.slug())
+    if cut < meta['rows']:
+      generation = meta['generation'] + 1
+      for key in STORE_COLUMNS:
+        with open(self._column_path(ticker, period, key, generation), 'wb') as file:
+          stored[key][:cut].tofile(file)
+          arrays[key].tofile(file)
+    else:
+      generation = meta['generation']
+      for key in STORE_COLUMNS:
+        with open(self._column_path(ticker, period, key, generation), 'r+b') as file:
+          file.seek(cut * np.dtype(STORE_DTYPES[key]).itemsize)
+          file.write(arrays[key].tobytes())
+          file.truncate()  # the leftovers of an interrupted append
+    del stored
+    self._commit(ticker, period, {'rows': cut + len(df), 'generation': generation})
+    if generation != meta['generation']:
+      for key in STORE_COLUMNS:
+        os.remove(self._column_path(ticker, period, key, meta['generation']))
+
+  def unseen(self, ticker, period, df):
+    # The rows of `df` (sorted by timestamp) after the stored ones, to `append` without rewriting the committed
+    # rows: the earlier timestamps are skipped, and at the last stored timestamp as many rows as are stored there
+    # (the ticks of one second).
+    meta = self.meta(ticker, period)
+    if not meta or not meta['rows']:
+      return df
+    stored = self.columns(ticker, period)['timestamp']
+    last = stored[-1]
+    count = len(stored) - int(np.searchsorted(stored, last, side='left'))
+    del stored
+    timestamps = self._timestamps(df)
+    left = int(np.searchsorted(timestamps, last, side='left'))
+    right = int(np.searchsorted(timestamps, last, side='right'))
+    return df.iloc[min(left + count, right):]
+
+  def columns(self, ticker, period):
+    meta = self.meta(ticker, period)
+    assert meta, 'No stored series: %s %s' % (ticker, period.slug())
+    result = {}
+    for key in STORE_COLUMNS:
+      if meta['rows']:
+        result[key] = np.memmap(self._column_path(ticker, period, key, meta['generation']),
+                                dtype=STORE_DTYPES[key], mode='r', shape=(meta['rows'], ))
+      else:
+        result[key] = np.empty(0, dtype=STORE_DTYPES[key])
+    return result
+
+  def locate(self, ticker, period, start=None, end=None, columns=None):
+    # `start` and `end` are inclusive, the lookup is a binary search over the timestamps.
+    timestamp = (columns or self.columns(ticker, period))['timestamp']
+    lo = int(np.searchsorted(timestamp, _to_ns(start), side='left')) if start is not None else 0
+    hi = int(np.searchsorted(timestamp, _to_ns(end), side='right')) if end is not None else len(timestamp)
+    return lo, hi
+
+  def slice(self, ticker, period, start=None, end=None):
+    # Zero-copy views into the mapped files.
+    columns = self.columns(ticker, period)
+    lo, hi = self.locate(ticker, period, start, end, columns=columns)
+    result = {key: array[lo:hi] for key, array in columns.items()}
+    result['timestamp'] = result['timestamp'].view('datetime64[ns]')
+    return result
+
+  def frame(self, ticker, period, start=None, end=None):
+    columns = self.slice(ticker, period, start, end)
+    index = pd.DatetimeIndex(columns.pop('timestamp'), name='timestamp')
+    return pd.DataFrame(columns, index=index, columns=STORE_COLUMNS[1:], copy=False)
+
+  def import_file(self, ticker, period, path):
+    self.write(ticker, period, load(path))
+
+  def sync_file(self, ticker, period, path):
+    # Imports the text file when it's newer than the stored series.
+    meta_path = os.path.join(self._dir(ticker, period), 'meta.json')
+    if not os.path.exists(meta_path) or os.path.getmtime(meta_path) < os.path.getmtime(path):
+      self.import_file(ticker, period, path)
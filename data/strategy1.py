@@ -21,14 +21,18 @@ import matplotlib.pyplot as plt
 import pandas as pd
 import statsmodels.api as sm
 
+from data.fetcher import Period
 from data.loader import load, to_returns
+from data.store import BarStore
 
 
 def main():
-  day_df = load('.storage/SBER_2000-01-01_2018-12-30_day.txt')
+  # Note: `sync_file` (re)imports the text file into the column store (.storage/bars) when the file is newer.
+  store = BarStore()
+  store.sync_file('SBER', Period.DAY, '.storage/SBER_2000-01-01_2018-12-30_day.txt')
+  day_df = store.frame('SBER', Period.DAY)
   day_rets = to_returns(day_df, keys=('high',))
-  day_rets = day_rets.set_index('timestamp')
-  day_rets = day_rets.ix['2012-01-01':]
+  day_rets = day_rets.loc['2012-01-01':]  # after the returns: the first one is from the last bar of 2011
   day_rets = day_rets[['high_return']]
 
   # Get first hour returns
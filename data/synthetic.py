@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from datetime import datetime, timedelta
+import io
+import os
+import threading
+import zlib
+
+import numpy as np
+import pandas as pd
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import parse_qs, urlsplit
+
+from data.fetcher import Period, canonical_name
+from data.loader import COLUMNS
+from data.resample import FINAM_PERIOD, INTRADAY_SECONDS
+
+__author__ = 'maxim'
+
+
+# Synthetic Finam exports: the same layout and `%d/%m/%y` dates as the real files, MOEX-like sessions
+# (business days, 10:00-18:40), a geometric random walk for the prices. Reproducible by `seed`.
+
+SESSION_OPEN = pd.Timedelta('10:00:00')
+SESSION_LENGTH = pd.Timedelta('8h40min')
+TRADING_DAYS = 252
+
+
+def session_timestamps(period, years, start='2010-01-04', ticks_per_day=2000, seed=0):
+  # Built in microseconds, the unit of `bdate_range`; the spans past the datetime64[ns] range of the loader
+  # and the store are rejected rather than wrapped around.
+  days = pd.bdate_range(start, periods=int(years * TRADING_DAYS), unit='us')
+  if len(days) and days[-1] + pd.Timedelta(days=1) > pd.Timestamp.max:
+    raise ValueError('%s years from %s end past %s' % (years, start, pd.Timestamp.max.date()))
+  if period == Period.DAY:
+    return days
+  if period == Period.WEEK:
+    return days[days.weekday == 0]
+  if period == Period.MONTH:
+    return pd.DatetimeIndex(days.to_series().groupby(days.to_period('M')).first().values)
+  if period == Period.TICK:
+    random = np.random.RandomState(seed)
+    seconds = np.sort(random.randint(0, int(SESSION_LENGTH.total_seconds()), size=(len(days), ticks_per_day)), axis=1)
+  else:
+    seconds = np.arange(0, int(SESSION_LENGTH.total_seconds()), INTRADAY_SECONDS[period])
+  offsets = SESSION_OPEN.value // 10 ** 3 + seconds * 10 ** 6
+  stamps = days.values.astype('datetime64[us]').view(np.int64)[:, None] + offsets
+  return pd.DatetimeIndex(stamps.ravel().view('datetime64[us]'))
+
+
+def random_bars(timestamps, ticker, period, seed=0, start_price=100.0):
+  # A frame in the `loader.load` layout.
+  random = np.random.RandomState(seed)
+  size = len(timestamps)
+  volatility = 0.02 / np.sqrt(max(size / 252.0 / 10, 1))
+  close = start_price * np.exp(np.cumsum(random.normal(0, volatility, size=size)))
+  if period == Period.TICK:
+    open_ = high = low = close
+  else:
+    open_ = close * np.exp(random.normal(0, volatility / 4, size=size))
+    spread = np.abs(random.normal(0, volatility / 2, size=size))
+    high = np.maximum(open_, close) * (1 + spread)
+    low = np.minimum(open_, close) * (1 - spread)
+  return pd.DataFrame({
+    'timestamp': pd.DatetimeIndex(timestamps),
+    'ticker': ticker,
+    'period': FINAM_PERIOD[period],
+    'open': np.round(open_, 2),
+    'high': np.round(high, 2),
+    'low': np.round(low, 2),
+    'close': np.round(close, 2),
+    'volume': random.randint(1, 10 ** 5, size=size),
+  }, columns=['timestamp', 'ticker', 'period', 'open', 'high', 'low', 'close', 'volume'])
+
+
+def _write_rows(file, df):
+  out = df.assign(date=df['timestamp'].dt.strftime('%d/%m/%y'), time=df['timestamp'].dt.strftime('%H:%M:%S'))
+  file.write(','.join('<%s>' % name.upper() for name in COLUMNS) + '\n')
+  out[COLUMNS].to_csv(file, header=False, index=False)
+
+
+def write_finam(path, df):
+  with open(path, 'w') as file:
+    _write_rows(file, df)
+
+
+def generate(storage, tickers, years, period, seed=0):
+  # Writes `<storage>/<TICKER>_<period>.txt` for every ticker, returns the paths.
+  if not os.path.exists(storage):
+    os.makedirs(storage)
+  timestamps = session_timestamps(period, years, seed=seed)
+  paths = []
+  for i, ticker in enumerate(tickers):
+    path = os.path.join(storage, canonical_name(ticker, period))
+    write_finam(path, random_bars(timestamps, ticker, period, seed=seed + i))
+    paths.append(path)
+  return paths
+
+
+# A local stand-in of the export endpoint (`host` of `fetcher.generate_url`) whose market moves with `clock`
+# (`poller.Clock`): a request gets the bars of the asked days that have opened by `clock.now()`, from
+# a fixed random walk per ticker and period. E.g. with a `poller.VirtualClock`:
+#
+#   finam = FakeFinam(clock, start='2020-01-06')
+#   Poller([('SBER', Period.MIN_1)], clock=clock, host=finam.serve(), history_days=5).run(until=...)
+
+class _ThreadingServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+
+
+class FakeFinam(object):
+  def __init__(self, clock, start='2020-01-06', years=1, seed=0):
+    self.clock = clock
+    self.start = start
+    self.years = years
+    self.seed = seed
+    self.requests = 0
+    self._bars = {}
+    self._lock = threading.Lock()
+    self._server = None
+
+  def bars(self, ticker, period):
+    with self._lock:
+      if (ticker, period) not in self._bars:
+        timestamps = session_timestamps(period, self.years, start=self.start, seed=self.seed)
+        seed = self.seed + zlib.crc32(ticker.encode()) % 1000
+        self._bars[ticker, period] = random_bars(timestamps, ticker, period, seed=seed)
+      return self._bars[ticker, period]
+
+  def export(self, ticker, period, from_dt, to_dt):
+    # The days from_dt..to_dt, both inclusive; a day bar opens with the session.
+    df = self.bars(ticker, period)
+    opened = df['timestamp'] + (SESSION_OPEN if period in (Period.DAY, Period.WEEK, Period.MONTH) else pd.Timedelta(0))
+    mask = (df['timestamp'] >= from_dt) & (df['timestamp'] < to_dt + timedelta(days=1)) & (opened <= self.clock.now())
+    text = io.StringIO()
+    _write_rows(text, df[mask])
+    return text.getvalue().encode()
+
+  def serve(self):
+    # Starts the server in a thread, returns the host to request.
+    finam = self
+
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+      protocol_version = 'HTTP/1.1'  # keep-alive, as the pooled client expects
+      disable_nagle_algorithm = True  # the headers and the body are separate writes
+
+      def do_GET(self):
+        query = {key: values[0] for key, values in parse_qs(urlsplit(self.path).query).items()}
+        with finam._lock:
+          finam.requests += 1
+        try:
+          body = finam.export(query['code'], Period(int(query['p'])), datetime.strptime(query['from'], '%d-%m-%Y'),
+                              datetime.strptime(query['to'], '%d-%m-%Y'))
+          status = 200
+        except (KeyError, ValueError) as e:
+          body, status = str(e).encode(), 400
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+      def log_message(self, *args):
+        pass
+
+    self._server = _ThreadingServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=self._server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return 'http://127.0.0.1:%d' % self._server.server_address[1]
+
+  def close(self):
+    if self._server is not None:
+      self._server.shutdown()
+      self._server.server_close()
+      self._server = None
@@ -0,0 +1,15 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from stub import StubFinam
+
+__author__ = 'maxim'
+
+
+@pytest.fixture
+def finam():
+  stub = StubFinam().start()
+  yield stub
+  stub.stop()
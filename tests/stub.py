@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from datetime import datetime, timedelta
+import hashlib
+import threading
+
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import parse_qs, urlsplit
+
+__author__ = 'maxim'
+
+
+# A local stand-in of the Finam export host for the tests: `host` goes to `generate_url(..., host=...)`.
+# The export has hourly bars 10:00-18:00 of the weekdays in the requested days. The first `failures[code]`
+# requests of a code get a 500, the next response of a code in `cuts` is dropped after that many bytes.
+# The responses have an ETag and support `If-None-Match` (304) and `Range` with `If-Range` (206, or the whole
+# body when the ETag doesn't match). Changing `revision` changes the volumes, so the ETags too.
+
+HEADER = b'<TICKER>,<PER>,<DATE>,<TIME>,<OPEN>,<HIGH>,<LOW>,<CLOSE>,<VOL>'
+
+
+def hourly_rows(code, from_dt, to_dt, revision=0):
+  rows = []
+  day = from_dt
+  while day <= to_dt:
+    if day.weekday() < 5:
+      for hour in range(10, 19):
+        bar = day + timedelta(hours=hour)
+        rows.append(('%s,60,%s,%s,%d.0,%d.5,%d.5,%d.25,%d' % (
+          code, bar.strftime('%d/%m/%y'), bar.strftime('%H:%M:%S'), hour, hour, hour - 1, hour, revision * 10000 + bar.day * 100 + hour)
+        ).encode())
+    day += timedelta(days=1)
+  return rows
+
+
+def export(query, revision=0):
+  code = query['code']
+  from_dt = datetime.strptime(query['from'], '%d-%m-%Y')
+  to_dt = datetime.strptime(query['to'], '%d-%m-%Y')
+  return b'\r\n'.join([HEADER] + hourly_rows(code, from_dt, to_dt, revision)) + b'\r\n'
+
+
+class _ThreadingServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+
+
+class StubFinam(object):
+  def __init__(self):
+    self.failures = {}
+    self.cuts = {}
+    self.revision = 0
+    self.requests = []
+    self.headers = []
+    self._lock = threading.Lock()
+    self._server = None
+    self.host = None
+
+  def _respond(self, handler):
+    query = {key: values[0] for key, values in parse_qs(urlsplit(handler.path).query).items()}
+    code = query.get('code')
+    with self._lock:
+      self.requests.append(query)
+      self.headers.append(dict(handler.headers))
+      failing = self.failures.get(code, 0) > 0
+      if failing:
+        self.failures[code] -= 1
+      cut = self.cuts.pop(code, None)
+    if failing:
+      handler.send_response(500)
+      handler.send_header('Content-Length', '0')
+      handler.end_headers()
+      return
+
+    body = export(query, self.revision)
+    etag = '"%s"' % hashlib.sha1(body).hexdigest()[:16]
+    if handler.headers.get('If-None-Match') == etag:
+      handler.send_response(304)
+      handler.send_header('ETag', etag)
+      handler.send_header('Content-Length', '0')
+      handler.end_headers()
+      return
+    first = 0
+    requested = handler.headers.get('Range')
+    if requested and handler.headers.get('If-Range', etag) == etag:
+      first = int(requested.partition('=')[2].partition('-')[0])
+      if first >= len(body):
+        handler.send_response(416)
+        handler.send_header('Content-Range', 'bytes */%d' % len(body))
+        handler.send_header('Content-Length', '0')
+        handler.end_headers()
+        return
+      handler.send_response(206)
+      handler.send_header('Content-Range', 'bytes %d-%d/%d' % (first, len(body) - 1, len(body)))
+    else:
+      handler.send_response(200)
+    data = body[first:]
+    handler.send_header('ETag', etag)
+    handler.send_header('Content-Length', str(len(data)))
+    handler.end_headers()
+    if cut is not None:
+      handler.wfile.write(data[:cut])
+      handler.wfile.flush()
+      handler.close_connection = True
+      return
+    handler.wfile.write(data)
+
+  def start(self):
+    stub = self
+
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+      protocol_version = 'HTTP/1.1'
+      disable_nagle_algorithm = True
+
+      def do_GET(self):
+        stub._respond(self)
+
+      def log_message(self, *args):
+        pass
+
+    self._server = _ThreadingServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=self._server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    self.host = 'http://127.0.0.1:%d' % self._server.server_address[1]
+    return self
+
+  def stop(self):
+    self._server.shutdown()
+    self._server.server_close()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+from data.analysis import build_panel, calc_sharpe, calc_sharpe_panel, get_returns, guess_path, process, \
+  run_parallel
+from data.fetcher import Period, canonical_name
+from data.synthetic import random_bars, session_timestamps, write_finam
+
+__author__ = 'maxim'
+
+
+# Listed at different dates: FIVE starts later, MFON has a gap.
+def _universe(storage):
+  days = session_timestamps(Period.DAY, 1)
+  frames = {
+    'SBER': random_bars(days, 'SBER', Period.DAY, seed=0),
+    'FIVE': random_bars(days[100:], 'FIVE', Period.DAY, seed=1),
+    'MFON': random_bars(days[:50].append(days[80:200]), 'MFON', Period.DAY, seed=2),
+  }
+  for ticker, df in frames.items():
+    write_finam(str(storage / canonical_name(ticker, Period.DAY)), df)
+  return list(frames)
+
+
+def test_panel_matches_per_ticker(tmp_path):
+  tickers = _universe(tmp_path)
+  prices = build_panel(tickers, storage=str(tmp_path))
+  assert list(prices.columns) == tickers
+  assert prices['FIVE'].isnull().sum() == 100
+  stats = calc_sharpe_panel(prices)
+  for ticker in tickers:
+    expected = calc_sharpe(get_returns(guess_path(ticker, str(tmp_path))))
+    np.testing.assert_allclose(stats.loc[ticker].values, expected, rtol=1e-10)
+
+
+def test_panel_duplicate_timestamps(tmp_path):
+  days = session_timestamps(Period.DAY, 0.2)
+  df = random_bars(days, 'SBER', Period.DAY)
+  repeated = pd.concat([df.iloc[:20], df.iloc[10:]], ignore_index=True)
+  write_finam(str(tmp_path / canonical_name('SBER', Period.DAY)), repeated)
+  prices = build_panel(['SBER'], storage=str(tmp_path))
+  assert len(prices) == len(df)
+  np.testing.assert_allclose(prices['SBER'].values, df['close'].values)
+
+
+def test_run_parallel(tmp_path):
+  tickers = _universe(tmp_path)
+  order = ['MFON', 'MISSING', 'SBER', 'FIVE']
+  results = run_parallel(order, func=partial(process, storage=str(tmp_path)), workers=2)
+  assert [result.ticker for result in results] == order
+  for result in results:
+    if result.ticker == 'MISSING':
+      assert result.value is None
+      assert result.error.startswith('AssertionError: No files match')
+    else:
+      assert result.error is None and result.elapsed >= 0
+      assert result.value == process(result.ticker, storage=str(tmp_path))
+  assert set(tickers) < set(order)
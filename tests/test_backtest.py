@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import math
+
+import numpy as np
+import pandas as pd
+
+from data.backtest import evaluate, momentum_signal, sweep
+
+__author__ = 'maxim'
+
+
+def _returns(bars=300, seed=0):
+  random = np.random.RandomState(seed)
+  returns = random.normal(0.0005, 0.02, size=(bars, 3))
+  returns[:40, 1] = np.nan  # listed later
+  returns[0] = np.nan
+  return pd.DataFrame(returns, columns=['SBER', 'FIVE', 'GAZP'])
+
+
+def _brute_force(returns, lookback, threshold, cost):
+  # One ticker, one combination, bar by bar.
+  bars = len(returns)
+  listed = [not math.isnan(value) for value in returns]
+  clean = [value if ok else 0.0 for value, ok in zip(returns, listed)]
+  positions = []
+  for t in range(bars):
+    if t < lookback - 1:
+      positions.append(0.0)
+      continue
+    momentum = sum(math.log1p(value) for value in clean[t - lookback + 1:t + 1])
+    position = 1.0 if momentum > threshold else -1.0 if momentum < -threshold else 0.0
+    positions.append(position if listed[t] else 0.0)
+  pnl, equity, peak, drawdown, turnover = [], 1.0, 1.0, 0.0, 0.0
+  for t in range(1, bars):
+    trade = abs(positions[t - 1] - (positions[t - 2] if t > 1 else 0.0))
+    value = positions[t - 1] * clean[t] - cost * trade
+    pnl.append(value)
+    turnover += trade
+    equity *= 1 + value
+    peak = max(peak, equity)
+    drawdown = max(drawdown, 1 - equity / peak)
+  count = sum(listed[1:])
+  mean = sum(pnl) / count
+  variance = (sum(value * value for value in pnl) - count * mean ** 2) / (count - 1)
+  return count ** 0.5 * mean / variance ** 0.5, drawdown, turnover / count
+
+
+def test_sweep_matches_brute_force():
+  returns = _returns()
+  grid = {'lookback': [1, 3, 10], 'threshold': [0.0, 0.02]}
+  result = sweep(returns, momentum_signal, grid, cost=0.001, chunk=4)
+  assert len(result) == 6 * 3
+  for row in result.itertuples():
+    expected = _brute_force(returns[row.ticker].values, row.lookback, row.threshold, 0.001)
+    np.testing.assert_allclose([row.sharpe, row.drawdown, row.turnover], expected, rtol=1e-4, atol=1e-6)
+
+
+def test_evaluate_broadcasts_over_combinations():
+  returns = _returns().values
+  positions = momentum_signal(returns, np.array([2, 5]), np.array([0.0, 0.0]))
+  sharpe, drawdown, turnover = evaluate(returns, positions, cost=0.002)
+  assert sharpe.shape == drawdown.shape == turnover.shape == (2, 3)
+  for i in range(2):
+    single = evaluate(returns, positions[i], cost=0.002)
+    for batch, one in zip((sharpe, drawdown, turnover), single):
+      np.testing.assert_allclose(batch[i], one)
+  assert ((drawdown >= 0) & (drawdown <= 1)).all()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+
+from data.analysis import calc_sharpe
+from data.bootstrap import bootstrap_sharpe
+
+__author__ = 'maxim'
+
+
+def _panel(tickers, bars, drift=0.0, seed=0):
+  random = np.random.RandomState(seed)
+  df = pd.DataFrame(random.normal(drift, 0.02, size=(bars, tickers)), columns=['T%d' % i for i in range(tickers)])
+  df.iloc[:bars // 3, 1] = np.nan  # listed later
+  return df
+
+
+def test_same_result_with_any_workers():
+  df = _panel(5, 300, drift=0.001)
+  for kind in ('stationary', 'block'):
+    serial = bootstrap_sharpe(df, draws=400, kind=kind, seed=7)
+    pd.testing.assert_frame_equal(bootstrap_sharpe(df, draws=400, kind=kind, seed=7, workers=2), serial)
+    pd.testing.assert_frame_equal(bootstrap_sharpe(df, draws=400, kind=kind, seed=7, workers=3), serial)
+    pd.testing.assert_frame_equal(bootstrap_sharpe({ticker: df[ticker] for ticker in df.columns}, draws=400,
+                                                   kind=kind, seed=7), serial)
+  assert not bootstrap_sharpe(df, draws=400, seed=8)['ci_low'].equals(serial['ci_low'])
+
+
+def test_estimate_is_calc_sharpe():
+  df = _panel(3, 200, drift=0.001)
+  result = bootstrap_sharpe(df, draws=100)
+  for ticker in df.columns:
+    values = df[ticker].dropna()
+    returns = pd.concat([pd.Series([np.nan]), values], ignore_index=True)  # the first bar has no return
+    expected = calc_sharpe(pd.DataFrame({'close_return': returns}))[2]
+    np.testing.assert_allclose(result.loc[ticker, 'sharpe'], expected, rtol=1e-12)
+    assert result.loc[ticker, 'nobs'] == len(values)
+
+
+def test_p_value_calibrated_under_the_null():
+  # Zero-mean returns: the p-values are close to uniform, about 5% of them are below 0.05.
+  p_values = bootstrap_sharpe(_panel(300, 250, seed=1), draws=500)['p_value'].values
+  assert 0.02 <= np.mean(p_values < 0.05) <= 0.09
+  assert 0.07 <= np.mean(p_values < 0.1) <= 0.14
+  assert 0.44 <= np.mean(p_values) <= 0.56
+
+  greater = bootstrap_sharpe(_panel(300, 250, seed=2), draws=500, alternative='greater')['p_value'].values
+  assert 0.02 <= np.mean(greater < 0.05) <= 0.09
+
+  trending = bootstrap_sharpe(_panel(20, 250, drift=0.008, seed=3), draws=500)['p_value'].values
+  assert np.mean(trending < 0.05) > 0.9
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+
+from data.analysis import guess_path
+from data.catalog import CATALOG_NAME, Catalog
+from data.fetcher import Period
+from data.synthetic import generate
+
+__author__ = 'maxim'
+
+
+def test_paths_are_absolute(tmp_path, monkeypatch):
+  storage = tmp_path / 'storage'
+  generate(str(storage), ['AAA'], 0.1, Period.DAY)
+  monkeypatch.chdir(str(tmp_path))
+  Catalog(os.path.join('storage', CATALOG_NAME)).rebuild('storage')
+  other = tmp_path / 'other'
+  other.mkdir()
+  monkeypatch.chdir(str(other))
+  path = guess_path('AAA', str(storage))
+  assert os.path.isabs(path)
+  assert os.path.exists(path)
+
+
+def test_lookup_refreshes_changed_files(tmp_path):
+  path, = generate(str(tmp_path), ['AAA'], 0.1, Period.DAY)
+  catalog = Catalog(str(tmp_path / CATALOG_NAME))
+  catalog.register(path)
+  (_, _, last_ts, rows), = catalog.find('AAA', Period.DAY)
+  with open(path, 'ab') as file:
+    file.write(b'AAA,D,03/01/11,00:00:00,1,1,1,1,1\n')
+  os.utime(path, (0, 0))  # a different mtime even on a coarse clock
+  (_, _, new_last_ts, new_rows), = catalog.find('AAA', Period.DAY)
+  assert new_rows == rows + 1
+  assert new_last_ts == '2011-01-03 00:00:00' != last_ts
+
+
+def test_lookup_drops_missing_files(tmp_path):
+  path, = generate(str(tmp_path), ['AAA'], 0.1, Period.DAY)
+  catalog = Catalog(str(tmp_path / CATALOG_NAME))
+  catalog.register(path)
+  os.remove(path)
+  assert catalog.find('AAA', Period.DAY) == []
+  assert catalog.latest('AAA', Period.DAY) is None
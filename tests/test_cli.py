@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from datetime import datetime, timedelta
+import os
+import subprocess
+import sys
+
+import pytest
+
+from data import events
+from data.cli import main
+from data.fetcher import Period, canonical_name
+from data.synthetic import random_bars, session_timestamps, write_finam
+from stub import HEADER, hourly_rows
+
+__author__ = 'maxim'
+
+
+@pytest.fixture(autouse=True)
+def _console():
+  yield
+  events.set_quiet(False)  # `--quiet` is global
+
+
+def test_no_command(capsys):
+  assert main([]) == 2
+  assert 'usage' in capsys.readouterr().out
+
+
+def test_unknown_period(tmp_path, capsys):
+  with pytest.raises(SystemExit):
+    main(['--storage', str(tmp_path), 'load', 'SBER', '--period', 'fortnight'])
+  assert 'unknown period fortnight' in capsys.readouterr().err
+
+
+def test_load(tmp_path, capsys):
+  path = tmp_path / canonical_name('SBER', Period.HOUR)
+  write_finam(str(path), random_bars(session_timestamps(Period.HOUR, 5 / 252.0), 'SBER', Period.HOUR))
+  assert main(['--storage', str(tmp_path), 'load', 'SBER', '--period', 'hour', '--rows', '3']) == 0
+  out = capsys.readouterr().out
+  assert out.startswith('%s: ' % path)
+  assert main(['load', str(path), '--rows', '3', '--no-cache']) == 0
+  assert capsys.readouterr().out == out
+
+
+def test_fetch(finam, tmp_path, capsys):
+  # An existing file: the update downloads only the days from its last bar on.
+  today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+  start = today - timedelta(days=10)
+  path = tmp_path / canonical_name('SBER', Period.HOUR)
+  path.write_bytes(b'\r\n'.join([HEADER] + hourly_rows('SBER', start, today - timedelta(days=3))) + b'\r\n')
+  args = ['--storage', str(tmp_path), 'fetch', '--tickers', 'SBER', '--period', 'hour', '--host', finam.host]
+  assert main(['--quiet'] + args) == 0
+  assert capsys.readouterr().out == ''
+  events.set_quiet(False)
+  assert path.read_bytes().splitlines() == [HEADER] + hourly_rows('SBER', start, today)
+
+  assert main(args) == 0
+  assert 'up-to-date' in capsys.readouterr().out
+
+
+def test_lazy_imports():
+  # The entry point and `Period` don't bring the network, numpy or pandas.
+  code = 'import sys, data.cli, data.fetcher; ' \
+         'print(sorted({"asyncio", "numpy", "pandas", "http.client"} & set(sys.modules)))'
+  out = subprocess.check_output([sys.executable, '-c', code], cwd=os.path.dirname(os.path.dirname(__file__)))
+  assert out.strip() == b'[]'
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+import os
+
+import pytest
+
+from data.client import PART_SUFFIX, Client, FetchError, is_complete, is_stored
+from data.fetcher import Job, Period, bulk_download, canonical_name, generate_url, update_all
+from stub import HEADER, export
+
+__author__ = 'maxim'
+
+
+FROM_DT = datetime(2020, 1, 6)
+TO_DT = datetime(2020, 1, 10)
+QUERY = {'code': 'SBER', 'from': '06-01-2020', 'to': '10-01-2020'}
+
+
+@pytest.fixture
+def client():
+  client = Client(timeout=5)
+  yield client
+  client.close()
+
+
+def _url(finam):
+  url, _ = generate_url(code='SBER', em='3', period=Period.HOUR, from_dt=FROM_DT, to_dt=TO_DT, host=finam.host)
+  return url
+
+
+def _read(path):
+  with open(path, 'rb') as file:
+    return file.read()
+
+
+def test_download_resumes_the_part(finam, client, tmp_path):
+  path = str(tmp_path / 'SBER.txt')
+  finam.cuts['SBER'] = 500
+  with pytest.raises(Exception):
+    client.download(_url(finam), path)
+  assert os.path.getsize(path + PART_SUFFIX) == 500
+  assert not os.path.exists(path)
+
+  result = client.download(_url(finam), path)
+  assert (result.status, result.received) == ('resumed', len(export(QUERY)) - 500)
+  assert finam.headers[-1]['Range'] == 'bytes=500-'
+  assert finam.headers[-1]['If-Range'].startswith('"')
+  assert _read(path) == export(QUERY)
+  assert not os.path.exists(path + PART_SUFFIX)
+
+
+def test_download_restarts_a_changed_resource(finam, client, tmp_path):
+  path = str(tmp_path / 'SBER.txt')
+  finam.cuts['SBER'] = 500
+  with pytest.raises(Exception):
+    client.download(_url(finam), path)
+  finam.revision = 1
+
+  result = client.download(_url(finam), path)
+  assert 'If-Range' in finam.headers[-1]
+  assert result.status == 'ok'  # the server sent the whole new body, not the rest of the old one
+  assert _read(path) == export(QUERY, revision=1)
+
+
+def test_download_not_modified(finam, client, tmp_path):
+  path = str(tmp_path / 'SBER.txt')
+  assert client.download(_url(finam), path).status == 'ok'
+  assert client.download(_url(finam), path).status == 'cached'
+  assert len(finam.requests) == 1
+
+  result = client.download(_url(finam), path, refresh=True)
+  assert result.status == 'not-modified'
+  assert 'If-None-Match' in finam.headers[-1]
+
+  finam.revision = 1
+  assert client.download(_url(finam), path, refresh=True).status == 'ok'
+  assert _read(path) == export(QUERY, revision=1)
+
+
+def test_header_only_file_is_fetched_again(finam, client, tmp_path):
+  path = str(tmp_path / 'SBER.txt')
+  with open(path, 'wb') as file:
+    file.write(HEADER + b'\r\n')
+  assert not is_complete(path)
+  assert is_complete(path, empty=True)
+  assert not is_stored(path)  # not recorded as an empty export
+  assert client.download(_url(finam), path).status == 'ok'
+  assert _read(path) == export(QUERY)
+
+
+def test_update_fetches_an_empty_series(finam, tmp_path):
+  path = tmp_path / canonical_name('SBER', Period.HOUR)
+  with open(str(path), 'wb') as file:
+    file.write(HEADER + b'\r\n')
+  result, = update_all(['SBER'], Period.HOUR, path=str(tmp_path), workers=1, min_interval=0, backoff=0,
+                       host=finam.host, window_days=100000)
+  assert result.status == 'created'
+  assert len(finam.requests) == 1
+  assert len(_read(str(path)).splitlines()) > 1
+
+
+def test_refresh_without_validators(finam, client, tmp_path):
+  # A complete file that the client didn't store (no ETag to revalidate with) is fetched unconditionally.
+  path = str(tmp_path / 'SBER.txt')
+  with open(path, 'wb') as file:
+    file.write(export(QUERY))
+  finam.revision = 1
+  assert client.download(_url(finam), path).status == 'cached'
+  assert client.download(_url(finam), path, refresh=True).status == 'ok'
+  assert 'If-None-Match' not in finam.headers[-1]
+  assert _read(path) == export(QUERY, revision=1)
+
+
+def test_empty_export_is_recorded(finam, client, tmp_path):
+  # A weekend: the export is just the header, stored once and not fetched again.
+  saturday, sunday = datetime(2020, 1, 11), datetime(2020, 1, 12)
+  url, name = generate_url(code='SBER', em='3', period=Period.HOUR, from_dt=saturday, to_dt=sunday, host=finam.host)
+  result, = bulk_download([Job('SBER', Period.HOUR, saturday, sunday)], path=str(tmp_path), workers=1,
+                          min_interval=0, backoff=0, host=finam.host)
+  assert result.status == 'ok'
+  assert _read(result.path).splitlines() == [HEADER]
+  assert is_stored(result.path)
+
+  result, = bulk_download([Job('SBER', Period.HOUR, saturday, sunday)], path=str(tmp_path), workers=1,
+                          min_interval=0, backoff=0, host=finam.host)
+  assert result.status == 'cached'
+  assert client.download(url, result.path).status == 'cached'
+  assert len(finam.requests) == 1
+  assert client.download(url, result.path, refresh=True).status == 'not-modified'
+  assert 'If-None-Match' in finam.headers[-1]
+
+
+def test_update_fetches_a_recorded_empty_series(finam, client, tmp_path):
+  # The series was empty at the last update: `update_all` still asks for it.
+  path = str(tmp_path / canonical_name('SBER', Period.HOUR))
+  url, _ = generate_url(code='SBER', em='3', period=Period.HOUR, from_dt=datetime(2020, 1, 11),
+                        to_dt=datetime(2020, 1, 12), host=finam.host)
+  client.download(url, path)
+  assert is_stored(path)
+  result, = update_all(['SBER'], Period.HOUR, path=str(tmp_path), workers=1, min_interval=0, backoff=0,
+                       host=finam.host, window_days=100000)
+  assert result.status == 'created'
+  assert len(finam.requests) == 2
+  assert len(_read(path).splitlines()) > 1
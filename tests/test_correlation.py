@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+
+from data.correlation import REFRESH_WINDOWS, iter_rolling, rolling_cov_corr
+
+__author__ = 'maxim'
+
+
+WINDOW = 30
+MIN_PERIODS = 10
+
+
+def _returns(size, tickers=4, seed=0):
+  # Missing bars scattered everywhere and a ticker that starts later.
+  random = np.random.RandomState(seed)
+  df = pd.DataFrame(random.normal(0, 0.02, size=(size, tickers)),
+                    index=pd.date_range('2020-01-06', periods=size, freq='h', name='timestamp'),
+                    columns=['T%d' % i for i in range(tickers)])
+  df = df.mask(random.rand(size, tickers) < 0.1)
+  df.iloc[:50, 2] = np.nan
+  return df
+
+
+def _pandas(df):
+  # cov, corr and the numbers of the bars where both tickers have a value, (bars, N, N).
+  shape = (len(df), df.shape[1], df.shape[1])
+  rolling = df.rolling(WINDOW, min_periods=MIN_PERIODS)
+  valid = df.notna().values.astype(np.int64)
+  both = np.cumsum(valid[:, :, None] * valid[:, None, :], axis=0)
+  both[WINDOW:] -= both[:-WINDOW].copy()
+  return rolling.cov().values.reshape(shape), rolling.corr().values.reshape(shape), both
+
+
+def test_rolling_matches_pandas():
+  # The strides of all the update paths: the cumulative sums, a product per bar and the recomputation.
+  df = _returns(REFRESH_WINDOWS * WINDOW + 300)
+  cov, corr, nobs = _pandas(df)
+  for stride in (1, 2, 5, WINDOW + 7):
+    result = rolling_cov_corr(df, WINDOW, stride=stride, min_periods=MIN_PERIODS)
+    assert (result.index == df.index[stride - 1::stride]).all()
+    np.testing.assert_allclose(result.cov, cov[stride - 1::stride], rtol=1e-9, atol=1e-14, equal_nan=True)
+    np.testing.assert_allclose(result.corr, corr[stride - 1::stride], rtol=1e-9, atol=1e-12, equal_nan=True)
+    np.testing.assert_array_equal(result.nobs, nobs[stride - 1::stride])
+
+
+def test_chunked_input():
+  df = _returns(400, seed=1)
+  bounds = [0, 1, 17, 18, 150, 151, 320, 400]
+  chunks = [df.iloc[begin:end] for begin, end in zip(bounds[:-1], bounds[1:])]
+  for stride in (1, 3):
+    whole = list(iter_rolling(df, WINDOW, stride=stride, min_periods=MIN_PERIODS))
+    streamed = list(iter_rolling(iter(chunks), WINDOW, stride=stride, min_periods=MIN_PERIODS))
+    assert [item[0] for item in streamed] == [item[0] for item in whole]
+    for (_, cov, corr, nobs), (_, expected_cov, expected_corr, expected_nobs) in zip(streamed, whole):
+      np.testing.assert_allclose(cov, expected_cov, rtol=1e-9, atol=1e-14, equal_nan=True)
+      np.testing.assert_allclose(corr, expected_corr, rtol=1e-9, atol=1e-12, equal_nan=True)
+      np.testing.assert_array_equal(nobs, expected_nobs)
+
+
+def test_empty():
+  result = rolling_cov_corr(_returns(5), WINDOW, stride=10)
+  assert len(result.index) == 0 and result.cov.shape == (0, 4, 4)
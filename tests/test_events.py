@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+import json
+import threading
+
+from data import events
+
+__author__ = 'maxim'
+
+
+def test_emit_to_listeners():
+  received = []
+  listener = events.subscribe(lambda name, fields: received.append((name, fields)))
+  try:
+    events.emit('parse', rows=10)
+    with events.stage('compute.returns', rows=5) as fields:
+      fields['extra'] = 1
+  finally:
+    events.unsubscribe(listener)
+  events.emit('parse', rows=20)
+  assert received[0] == ('parse', {'rows': 10})
+  name, fields = received[1]
+  assert name == 'compute.returns' and fields['rows'] == 5 and fields['extra'] == 1 and fields['elapsed'] >= 0
+  assert len(received) == 2
+
+
+def test_set_quiet():
+  try:
+    events.set_quiet()
+    assert events.console not in events._listeners
+    events.set_quiet()
+    events.set_quiet(False)
+    assert events._listeners.count(events.console) == 1
+  finally:
+    events.set_quiet(False)
+
+
+def test_metrics():
+  metrics = events.Metrics()
+  metrics('fetch.done', dict(bytes=100, elapsed=0.5, lag=3.0))
+  metrics('fetch.done', dict(bytes=300, elapsed=1.5, lag=1.0))
+  metrics('fetch.progress', dict(bytes=50, total=100))
+  metrics('log', dict(message='hi'))
+  summary = metrics.summary()
+  assert list(summary) == ['fetch.done']
+  done = summary['fetch.done']
+  assert (done['count'], done['bytes'], done['seconds'], done['max_seconds']) == (2, 400, 2.0, 1.5)
+  assert (done['bytes_per_sec'], done['lag'], done['max_lag']) == (200.0, 1.0, 3.0)
+
+
+def test_profile_report(tmp_path):
+  path = str(tmp_path / 'profile.json')
+  with events.profile(path) as metrics:
+    events.emit('parse', rows=7, elapsed=0.25)
+  assert metrics not in events._listeners
+  with open(path) as file:
+    report = json.load(file)
+  assert report['stages']['parse']['rows'] == 7 and report['wall_seconds'] >= 0
+
+
+def test_console_progress_per_download():
+  out, err = io.StringIO(), io.StringIO()
+  console = events.Console(stream=out, progress_stream=err)
+
+  def download(path):
+    for done in range(0, 1001, 10):
+      console('fetch.progress', dict(path=path, bytes=done, total=1000))
+
+  threads = [threading.Thread(target=download, args=('/storage/%s_hour.txt' % ticker, )) for ticker in 'ABCD']
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  console('log', dict(message='done'))
+
+  lines = err.getvalue().splitlines()
+  assert '\r' not in err.getvalue() and out.getvalue() == 'done\n'
+  for ticker in 'ABCD':
+    own = [line for line in lines if line.startswith('%s_hour.txt ' % ticker)]
+    assert len(own) == 11  # 0%, 10%, ..., 100%
+    assert own[-1].endswith('1000 / 1000')
+  assert len(lines) == 44
@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+
+from data.features import build_features
+from data.fetcher import Period
+from data.synthetic import random_bars, session_timestamps
+
+__author__ = 'maxim'
+
+
+def _bars():
+  timestamps = session_timestamps(Period.HOUR, 0.1)
+  return {ticker: random_bars(timestamps, ticker, Period.HOUR, seed=i) for i, ticker in enumerate(['AAA', 'BBB'])}
+
+
+def test_lags():
+  features = build_features(_bars(), lags=(0, 1, 2))
+  np.testing.assert_array_equal(features['close_return_lag0'].values, features['close_return'].values)
+  for ticker in ['AAA', 'BBB']:
+    one = features.loc[ticker]
+    np.testing.assert_array_equal(one['close_return_lag2'].values[2:], one['close_return'].values[:-2])
+    assert one['close_return_lag2'].iloc[:2].isnull().all()
+
+
+def test_negative_lag():
+  with pytest.raises(ValueError):
+    build_features(_bars(), lags=(-1, ))
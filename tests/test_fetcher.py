@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from datetime import datetime, timedelta
+import os
+
+from data.fetcher import Job, Period, _stitch, bulk_download, canonical_name, split_range, update_all
+from stub import HEADER, hourly_rows
+
+__author__ = 'maxim'
+
+
+FROM_DT = datetime(2020, 1, 6)
+TO_DT = datetime(2020, 1, 10)
+
+
+def _download(finam, path, tickers=('SBER', ), retries=3):
+  jobs = [Job(ticker, Period.HOUR, FROM_DT, TO_DT) for ticker in tickers]
+  return bulk_download(jobs, path=str(path), workers=2, min_interval=0, retries=retries, backoff=0, host=finam.host)
+
+
+def test_bulk_download(finam, tmp_path):
+  results = _download(finam, tmp_path, tickers=('SBER', 'GAZP'))
+  assert [result.status for result in results] == ['ok', 'ok']
+  with open(results[0].path, 'rb') as file:
+    lines = file.read().splitlines()
+  assert lines[0].startswith(b'<TICKER>')
+  assert len(lines) == 1 + 5 * 9
+  assert lines[1].startswith(b'SBER,60,06/01/20,10:00:00')
+
+
+def test_bulk_download_retries(finam, tmp_path):
+  finam.failures['SBER'] = 2
+  result, = _download(finam, tmp_path)
+  assert (result.status, result.attempts, result.error) == ('ok', 3, None)
+  assert os.path.getsize(result.path) == result.size
+
+
+def test_bulk_download_gives_up(finam, tmp_path):
+  finam.failures['SBER'] = 10
+  result, = _download(finam, tmp_path, retries=1)
+  assert (result.status, result.attempts) == ('failed', 2)
+  assert '500' in result.error
+  assert not os.path.exists(result.path)
+
+
+def test_bulk_download_cached(finam, tmp_path):
+  _download(finam, tmp_path)
+  requests = len(finam.requests)
+  result, = _download(finam, tmp_path)
+  assert result.status == 'cached'
+  assert len(finam.requests) == requests
+
+
+def _stored(path):
+  with open(path, 'rb') as file:
+    return [line.strip() for line in file.read().splitlines() if line.strip()]
+
+
+def test_update_appends_the_tail(finam, tmp_path):
+  # The stored file ends in the middle of 08/01 with a bar that was still forming (a smaller volume).
+  rows = hourly_rows('SBER', FROM_DT, datetime(2020, 1, 8))[:2 * 9 + 5]
+  rows[-1] = rows[-1].rpartition(b',')[0] + b',1'
+  path = tmp_path / canonical_name('SBER', Period.HOUR)
+  with open(str(path), 'wb') as file:
+    file.write(b'\r\n'.join([HEADER] + rows) + b'\r\n')
+
+  result, = update_all(['SBER'], Period.HOUR, path=str(tmp_path), workers=1, min_interval=0, backoff=0,
+                       host=finam.host)
+  assert result.status == 'updated'
+  request, = finam.requests
+  assert request['from'] == '08-01-2020'  # only the days from the last stored bar
+  to_dt = datetime.strptime(request['to'], '%d-%m-%Y')
+  expected = [HEADER] + hourly_rows('SBER', FROM_DT, to_dt)
+  assert _stored(str(path)) == expected  # the forming bar replaced, no duplicates and no gaps
+
+  result, = update_all(['SBER'], Period.HOUR, path=str(tmp_path), workers=1, min_interval=0, backoff=0,
+                       host=finam.host)
+  assert result.status == 'up-to-date'
+  assert _stored(str(path)) == expected
+
+
+def test_split_range():
+  assert split_range(Period.HOUR, FROM_DT, TO_DT, days=2) == [
+    (datetime(2020, 1, 6), datetime(2020, 1, 7)), (datetime(2020, 1, 8), datetime(2020, 1, 9)),
+    (datetime(2020, 1, 10), datetime(2020, 1, 10))]
+  assert split_range(Period.DAY, FROM_DT, TO_DT) == [(FROM_DT, TO_DT)]  # no windows for the days
+  assert split_range(Period.HOUR, FROM_DT, FROM_DT + timedelta(hours=20), days=1) == [(FROM_DT, FROM_DT)]
+
+
+def _download_windows(finam, path, retries=3):
+  job = Job('SBER', Period.HOUR, FROM_DT, TO_DT)
+  return bulk_download([job], path=str(path), workers=1, min_interval=0, retries=retries, backoff=0, host=finam.host,
+                       window_days=2, window_workers=1)
+
+
+def test_windows(finam, tmp_path):
+  result, = _download_windows(finam, tmp_path)
+  assert (result.status, result.attempts) == ('ok', 3)
+  assert [(request['from'], request['to']) for request in finam.requests] == [
+    ('06-01-2020', '07-01-2020'), ('08-01-2020', '09-01-2020'), ('10-01-2020', '10-01-2020')]
+  assert _stored(result.path) == [HEADER] + hourly_rows('SBER', FROM_DT, TO_DT)
+  assert not os.path.exists(result.path + '.parts')
+
+
+def test_windows_retry_only_the_failed(finam, tmp_path):
+  finam.failures['SBER'] = 2  # the first window fails twice, i.e. for good with `retries=1`
+  result, = _download_windows(finam, tmp_path, retries=1)
+  assert result.status == 'failed'
+  assert result.error.startswith('1 of 3 windows failed, e.g. 2020-01-06..2020-01-07')
+  assert not os.path.exists(result.path)
+  parts = sorted(name for name in os.listdir(result.path + '.parts') if name.endswith('.txt'))
+  assert parts == ['20200108_20200109.txt', '20200110_20200110.txt']
+
+  del finam.requests[:]
+  result, = _download_windows(finam, tmp_path, retries=1)
+  assert (result.status, result.attempts) == ('ok', 1)
+  assert [(request['from'], request['to']) for request in finam.requests] == [('06-01-2020', '07-01-2020')]
+  assert _stored(result.path) == [HEADER] + hourly_rows('SBER', FROM_DT, TO_DT)
+  assert not os.path.exists(result.path + '.parts')
+
+
+def test_stitch_drops_the_boundary_rows(tmp_path):
+  # The exports of the neighbour windows overlap by a day, the second one is out of order:
+  # every row is written once, by the window of its day, in the time order.
+  windows = [(datetime(2020, 1, 6), datetime(2020, 1, 7)), (datetime(2020, 1, 8), datetime(2020, 1, 9))]
+  first = [HEADER] + hourly_rows('SBER', datetime(2020, 1, 6), datetime(2020, 1, 8))
+  second = [HEADER] + hourly_rows('SBER', datetime(2020, 1, 7), datetime(2020, 1, 9))[::-1]
+  parts = []
+  for i, lines in enumerate([first, second]):
+    part = tmp_path / ('part%d.txt' % i)
+    part.write_bytes(b'\r\n'.join(lines) + b'\r\n')
+    parts.append(str(part))
+  full_path = str(tmp_path / 'SBER_hour.txt')
+  size = _stitch(parts, windows, full_path)
+  assert size == os.path.getsize(full_path)
+  assert _stored(full_path) == [HEADER] + hourly_rows('SBER', datetime(2020, 1, 6), datetime(2020, 1, 9))
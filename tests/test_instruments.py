@@ -0,0 +1,14 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from data.fetcher import MOEX_CODES, MOEX_EQUITIES
+from data.instruments import registry
+
+__author__ = 'maxim'
+
+
+def test_compatibility_tables():
+  assert MOEX_CODES['SBER'] == registry.em('SBER')
+  assert 'SBER' in MOEX_CODES and '' not in MOEX_CODES
+  assert len(MOEX_EQUITIES) == len(registry)
+  assert {'name': u'Аэрофлот', 'code': '29', 'ticker': 'AFLT'} in list(MOEX_EQUITIES)
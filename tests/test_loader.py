@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from contextlib import contextmanager
+from datetime import datetime
+import os
+
+import numpy as np
+import pandas as pd
+
+from data import events
+from data.fetcher import Period
+from data.loader import CACHE_SUFFIX, iter_changes, iter_returns, load, load_chunks, parse_timestamps, to_changes, \
+  to_returns
+from data.synthetic import random_bars, session_timestamps, write_finam
+
+__author__ = 'maxim'
+
+
+def test_to_returns_matches_pandas():
+  bars = random_bars(session_timestamps(Period.DAY, 1), 'SBER', Period.DAY)
+  df = to_returns(bars, keys=['close', 'open', 'volume'])
+  for key in ['close', 'open', 'volume']:
+    np.testing.assert_allclose(df['%s_return' % key].values, bars[key].pct_change().values)
+  relative = to_returns(bars, keys=['open', 'low'], relative_to='close', kind='log')
+  for key in ['open', 'low']:
+    np.testing.assert_allclose(relative['%s_return' % key].values, np.log1p((bars['close'] - bars[key]) / bars[key]))
+
+
+def _strptime(dates, times):
+  return np.array([datetime.strptime(d + ' ' + t, '%d/%m/%y %H:%M:%S') for d, t in zip(dates, times)],
+                  dtype='datetime64[ns]')
+
+
+def test_parse_timestamps_matches_strptime():
+  stamps = pd.date_range('1969-01-01', '2068-12-31 23:59:59', periods=5000).round('s')
+  dates, times = list(stamps.strftime('%d/%m/%y')), list(stamps.strftime('%H:%M:%S'))
+  np.testing.assert_array_equal(parse_timestamps(dates, times), _strptime(dates, times))
+
+
+def test_parse_timestamps_fallback():
+  # Not the fixed width: parsed by pandas, the same values.
+  dates, times = ['6/1/20', '10/01/20', '31/12/99'], ['9:05:00', '10:00:00', '23:59:59']
+  np.testing.assert_array_equal(parse_timestamps(dates, times), _strptime(dates, times))
+  assert len(parse_timestamps([], [])) == 0
+
+
+@contextmanager
+def _captured():
+  names = []
+  listener = events.subscribe(lambda name, fields: names.append(name) if name.startswith('cache.') else None)
+  try:
+    yield names
+  finally:
+    events.unsubscribe(listener)
+
+
+def _sample(path, days=20, seed=0):
+  write_finam(str(path), random_bars(session_timestamps(Period.HOUR, days / 252.0), 'SBER', Period.HOUR, seed=seed))
+
+
+def test_load_cache(tmp_path):
+  path = tmp_path / 'SBER_hour.txt'
+  _sample(path)
+  first = load(str(path))
+  assert os.path.exists(str(path) + CACHE_SUFFIX)
+  with _captured() as names:
+    second = load(str(path))
+  assert names == ['cache.hit']
+  pd.testing.assert_frame_equal(first, second)
+  pd.testing.assert_frame_equal(first, load(str(path), cache=False))
+
+
+def test_load_cache_invalidated_by_source(tmp_path):
+  path = tmp_path / 'SBER_hour.txt'
+  _sample(path)
+  load(str(path))
+  _sample(path, days=10, seed=1)  # another size
+  pd.testing.assert_frame_equal(load(str(path)), load(str(path), cache=False))
+
+  cached = load(str(path))
+  stat = os.stat(str(path))
+  with open(str(path), 'r+b') as file:  # the same size, another volume of the last bar and another mtime
+    file.seek(-2, os.SEEK_END)
+    digit = file.read(1)
+    file.seek(-2, os.SEEK_END)
+    file.write(b'1' if digit != b'1' else b'2')
+  os.utime(str(path), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+  assert os.path.getsize(str(path)) == stat.st_size
+  reloaded = load(str(path))
+  assert reloaded['volume'].iloc[-1] != cached['volume'].iloc[-1]
+  pd.testing.assert_frame_equal(reloaded, load(str(path), cache=False))
+
+
+def test_load_cache_corrupt(tmp_path):
+  path = tmp_path / 'SBER_hour.txt'
+  _sample(path)
+  expected = load(str(path), cache=False)
+  cache_path = str(path) + CACHE_SUFFIX
+  for damage in [b'garbage', None]:
+    load(str(path))
+    if damage is None:  # a half-written sidecar
+      with open(cache_path, 'r+b') as file:
+        file.truncate(os.path.getsize(cache_path) // 2)
+    else:
+      with open(cache_path, 'wb') as file:
+        file.write(damage)
+    with _captured() as names:
+      pd.testing.assert_frame_equal(load(str(path)), expected)
+    assert names == ['cache.miss']
+    pd.testing.assert_frame_equal(load(str(path)), expected)  # rewritten
+
+
+def test_streaming_matches_in_memory(tmp_path):
+  path = str(tmp_path / 'SBER_hour.txt')
+  hours = session_timestamps(Period.HOUR, 5 / 252.0)
+  bars = pd.concat([random_bars(hours, 'SBER', Period.HOUR), random_bars(hours, 'GAZP', Period.HOUR, seed=1)],
+                   ignore_index=True)
+  write_finam(path, bars)
+  df = load(path, cache=False)
+
+  chunks = list(load_chunks(path, chunksize=7))
+  assert len(chunks) > 5
+  pd.testing.assert_frame_equal(pd.concat(chunks), df)
+  pd.testing.assert_frame_equal(pd.concat(iter_returns(load_chunks(path, chunksize=7), keys=['close', 'high'])),
+                                to_returns(df, keys=['close', 'high']))
+  pd.testing.assert_frame_equal(pd.concat(iter_returns(load_chunks(path, chunksize=7), relative_to='open')),
+                                to_returns(df, relative_to='open'))
+  pd.testing.assert_frame_equal(pd.concat(iter_changes(load_chunks(path, chunksize=7))), to_changes(df))
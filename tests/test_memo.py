@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from data import events
+from data.fetcher import Period
+from data.loader import to_returns
+from data.memo import Memo
+from data.synthetic import random_bars, session_timestamps
+
+__author__ = 'maxim'
+
+
+calls = []
+
+
+def scaled(values, factor=2.0, offset=None):
+  calls.append(factor)
+  return values * factor + (offset or 0)
+
+
+def _name(func):
+  return '%s.%s' % (func.__module__, func.__qualname__)
+
+
+def test_hit_and_miss(tmp_path):
+  memo = Memo(str(tmp_path))
+  values = np.arange(10.0)
+  del calls[:]
+  first = memo.call(scaled, values)
+  np.testing.assert_array_equal(memo.call(scaled, values), first)
+  np.testing.assert_array_equal(memo.call(scaled, values, 2.0, offset=None), first)  # the defaults spelled out
+  np.testing.assert_array_equal(memo.call(scaled, values=values, factor=2.0), first)
+  assert calls == [2.0]
+
+  memo.call(scaled, values, factor=3.0)
+  memo.call(scaled, values + 1)  # another content
+  assert calls == [2.0, 3.0, 2.0]
+  counts, size = memo.stats()
+  assert counts[_name(scaled)] == (3, 3, 0)
+  assert size > 0
+
+
+def test_frames_and_kwargs(tmp_path):
+  memo = Memo(str(tmp_path))
+  bars = random_bars(session_timestamps(Period.DAY, 1), 'SBER', Period.DAY)
+  expected = to_returns(bars, keys=['close'])
+  pd.testing.assert_frame_equal(memo.call(to_returns, bars, keys=['close']), expected)
+  pd.testing.assert_frame_equal(memo.call(to_returns, bars, keys=['close'], relative_to=None), expected)
+  assert memo.stats()[0][_name(to_returns)] == (1, 1, 0)
+
+
+def test_the_function_source_is_a_part_of_the_key(tmp_path):
+  memo = Memo(str(tmp_path))
+  namespace = {}
+  exec('def func(x):\n  return x + 1\n', namespace)
+  first = namespace['func']
+  exec('def func(x):\n  return x + 2\n', namespace)
+  # No source for the `exec` functions: the code objects tell them apart.
+  assert memo.call(first, 1) == 2
+  assert memo.call(namespace['func'], 1) == 3
+  assert memo.key(first, (1, ), {}) != memo.key(namespace['func'], (1, ), {})
+
+
+def test_unreadable_entry_is_a_miss(tmp_path):
+  memo = Memo(str(tmp_path))
+  values = np.arange(5.0)
+  memo.call(scaled, values)
+  path = os.path.join(str(tmp_path), memo.key(scaled, (values, ), {}) + '.pkl')
+  for damage in [b'garbage', b'\x80\x04\x95', b'cmissing_module\nThing\n.']:  # the last one: a class that is gone
+    with open(path, 'wb') as file:
+      file.write(damage)
+    np.testing.assert_array_equal(memo.call(scaled, values), values * 2)
+  np.testing.assert_array_equal(memo.call(scaled, values), values * 2)
+  assert memo.stats()[0][_name(scaled)] == (1, 4, 0)
+
+
+def test_lru_eviction(tmp_path):
+  probe = Memo(str(tmp_path / 'probe'))
+  probe.call(scaled, np.zeros(1000))
+  size = probe.stats()[1]
+  memo = Memo(str(tmp_path / 'memo'), max_bytes=2 * size + size // 2)  # room for two entries
+
+  evicted = []
+  listener = events.subscribe(lambda name, fields: evicted.append(name) if name == 'memo.evict' else None)
+  try:
+    arrays = [np.full(1000, float(i)) for i in range(3)]
+    memo.call(scaled, arrays[0])
+    memo.call(scaled, arrays[1])
+    memo.call(scaled, arrays[0])  # the first is the recent one now
+    memo.call(scaled, arrays[2])  # the second is evicted
+  finally:
+    events.unsubscribe(listener)
+  assert evicted == ['memo.evict']
+  assert memo.stats() == ({_name(scaled): (1, 3, 1)}, 2 * size)
+  del calls[:]
+  memo.call(scaled, arrays[0])
+  memo.call(scaled, arrays[2])
+  assert calls == []
+  memo.call(scaled, arrays[1])
+  assert calls == [2.0]
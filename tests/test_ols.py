@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import statsmodels.api as sm
+from statsmodels.regression.rolling import RollingOLS
+
+from data.ols import batch_ols, rolling_ols
+
+__author__ = 'maxim'
+
+
+def _prices(size, seed=0):
+  # Two price-scale regressors (random walks around 100) and a constant, y depends on both.
+  random = np.random.RandomState(seed)
+  walks = 100 * np.exp(np.cumsum(random.normal(0, 0.01, size=(size, 2)), axis=0))
+  x = sm.add_constant(walks)
+  y = 3 + x[:, 1] * 0.5 + x[:, 2] * 0.2 + random.normal(0, 1, size=size)
+  return x, y
+
+
+def test_batch_matches_statsmodels():
+  x, y = _prices(1000)
+  expected = sm.OLS(y, x).fit()
+  result = batch_ols(x, y)
+  np.testing.assert_allclose(result.params, expected.params, rtol=1e-8)
+  np.testing.assert_allclose(result.bse, expected.bse, rtol=1e-8)
+  np.testing.assert_allclose(result.rsquared, expected.rsquared, rtol=1e-8)
+
+
+def test_rolling_matches_statsmodels_on_long_series():
+  window = 60
+  x, y = _prices(50000)
+  expected = RollingOLS(y, x, window=window).fit()
+  result = rolling_ols(x, y, window=window)
+  full = slice(window - 1, None)  # statsmodels fits only the full windows
+  np.testing.assert_allclose(result.params[full], expected.params[full], rtol=1e-6, atol=1e-7)
+  np.testing.assert_allclose(result.bse[full], expected.bse[full], rtol=1e-6)
+  np.testing.assert_allclose(result.rsquared[full], expected.rsquared[full], rtol=1e-6)
+  assert (result.nobs[full] == window).all()
+
+
+def test_rolling_late_windows_match_exact_fit():
+  window = 60
+  x, y = _prices(50000, seed=1)
+  result = rolling_ols(x, y, window=window)
+  for t in (window - 1, 20000, 49999):
+    expected = sm.OLS(y[t - window + 1:t + 1], x[t - window + 1:t + 1]).fit()
+    np.testing.assert_allclose(result.params[t], expected.params, rtol=1e-7)
+    np.testing.assert_allclose(result.bse[t], expected.bse, rtol=1e-7)
+    np.testing.assert_allclose(result.rsquared[t], expected.rsquared, rtol=1e-7)
+
+
+def test_expanding_matches_exact_fit():
+  x, y = _prices(40000, seed=2)
+  result = rolling_ols(x, y)
+  assert np.isnan(result.params[:3]).all()
+  for t in (10, 16383, 16384, 39999):
+    expected = sm.OLS(y[:t + 1], x[:t + 1]).fit()
+    np.testing.assert_allclose(result.params[t], expected.params, rtol=1e-6)
+    np.testing.assert_allclose(result.rsquared[t], expected.rsquared, rtol=1e-6)
+
+
+def test_rolling_batch_and_gaps():
+  window = 30
+  x, y = _prices(3000, seed=3)
+  y[100:110] = np.nan
+  stacked = rolling_ols(np.stack([x, x]), np.stack([y, 2 * y]), window=window)
+  single = rolling_ols(x, y, window=window)
+  np.testing.assert_allclose(stacked.params[0], single.params, equal_nan=True)
+  np.testing.assert_allclose(stacked.params[1], 2 * single.params, rtol=1e-7, equal_nan=True)
+  assert stacked.nobs[0, 115] == window - 10
+  expected = sm.OLS(y[86:116], x[86:116], missing='drop').fit()
+  np.testing.assert_allclose(single.params[115], expected.params, rtol=1e-7)
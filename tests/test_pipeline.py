@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+import os
+
+import pytest
+
+from data.fetcher import Period
+from data.pipeline import stream_to_store
+from data.store import BarStore
+
+__author__ = 'maxim'
+
+
+def test_stream_to_store_archives_into_new_directory(finam, tmp_path):
+  store = BarStore(str(tmp_path / 'bars'))
+  archive_path = str(tmp_path / 'archive' / 'nested' / 'SBER_hour.txt')
+  rows, size = stream_to_store('SBER', Period.HOUR, datetime(2020, 1, 6), datetime(2020, 1, 7), store=store,
+                               archive_path=archive_path, host=finam.host)
+  assert rows == 18
+  assert os.path.getsize(archive_path) == size
+  assert len(store.frame('SBER', Period.HOUR)) == 18
+
+
+def test_stream_to_store_connect_failure_leaves_no_part(tmp_path):
+  archive = tmp_path / 'archive'
+  archive.mkdir()
+  with pytest.raises(IOError):
+    stream_to_store('SBER', Period.HOUR, datetime(2020, 1, 6), datetime(2020, 1, 7),
+                    store=BarStore(str(tmp_path / 'bars')), archive_path=str(archive / 'SBER_hour.txt'),
+                    host='http://127.0.0.1:1')
+  assert os.listdir(str(archive)) == []
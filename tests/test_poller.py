@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+from collections import defaultdict
+from datetime import datetime, time
+import os
+
+import numpy as np
+import pandas as pd
+
+from data import events
+from data.analysis import calc_sharpe
+from data.fetcher import Period, canonical_name
+from data.loader import load, to_returns
+from data.poller import Poller, VirtualClock, closed_until, next_poll
+from data.stats import RunningStats, stats_path
+from data.store import BarStore
+from data.synthetic import SESSION_OPEN, FakeFinam
+
+__author__ = 'maxim'
+
+
+def test_closed_until_in_session():
+  now = datetime(2020, 1, 10, 12, 30)
+  assert closed_until(Period.HOUR, now) == datetime(2020, 1, 10, 11, 30)
+  assert closed_until(Period.MIN_1, now) == datetime(2020, 1, 10, 12, 29)
+  assert closed_until(Period.DAY, now) == datetime(2020, 1, 9)
+
+
+def test_closed_until_after_the_close():
+  # The 18:00 hourly bar is cut short by the 18:50 close, final at 18:52 already.
+  now = datetime(2020, 1, 10, 18, 52)
+  assert closed_until(Period.HOUR, now) == now
+  assert closed_until(Period.DAY, now) == datetime(2020, 1, 10)
+  assert closed_until(Period.MIN_5, datetime(2020, 1, 11, 12)) == datetime(2020, 1, 11, 12)
+
+
+def test_next_poll():
+  assert next_poll(Period.MIN_1, datetime(2020, 1, 10, 18, 51)) == datetime(2020, 1, 10, 18, 51, 5)
+  assert next_poll(Period.MIN_1, datetime(2020, 1, 10, 18, 53)) == datetime(2020, 1, 13, 10, 0, 5)
+  assert next_poll(Period.HOUR, datetime(2020, 1, 13, 10, 30)) == datetime(2020, 1, 13, 11, 0, 5)
+  assert next_poll(Period.DAY, datetime(2020, 1, 13, 10, 30)) == datetime(2020, 1, 13, 18, 52)
+
+
+class _Polls(object):
+  # The `poll.done` events with the virtual time of the poll, per feed.
+  def __init__(self, clock):
+    self.clock = clock
+    self.done = defaultdict(list)
+
+  def __call__(self, name, fields):
+    if name == 'poll.done':
+      self.done[fields['ticker'], fields['period']].append((self.clock.now(), fields['rows'], fields['lag']))
+
+
+def _check_feed(finam, store, storage, ticker, period, since, polled_at):
+  # The file has every bar that has opened, the store and the stats have the closed ones as of the last poll.
+  path = os.path.join(storage, canonical_name(ticker, period))
+  stored = load(path, cache=False)
+  bars = finam.bars(ticker, period)
+  opened = bars['timestamp'] + (SESSION_OPEN if period == Period.DAY else pd.Timedelta(0))
+  expected = bars[(bars['timestamp'] >= since) & (opened <= polled_at)]
+  np.testing.assert_array_equal(stored['timestamp'].values, expected['timestamp'].values)
+  np.testing.assert_array_equal(stored[['open', 'high', 'low', 'close', 'volume']].values,
+                                expected[['open', 'high', 'low', 'close', 'volume']].values)
+
+  closed = stored[stored['timestamp'] <= closed_until(period, polled_at)].reset_index(drop=True)
+  frame = store.frame(ticker, period)
+  np.testing.assert_array_equal(frame.index.values, closed['timestamp'].values)
+  np.testing.assert_array_equal(frame['close'].values, closed['close'].values)
+  assert store.meta(ticker, period) == {'rows': len(closed), 'generation': 0}  # appended, never rewritten
+
+  stats = RunningStats.load(stats_path(path))
+  np.testing.assert_allclose(stats.values(), calc_sharpe(to_returns(closed)), rtol=1e-9)
+  return stored, closed
+
+
+def test_run(tmp_path):
+  clock = VirtualClock(datetime(2020, 1, 8, 9, 0))
+  finam = FakeFinam(clock, start='2020-01-06')
+  storage = str(tmp_path)
+  store = BarStore(os.path.join(storage, 'bars'))
+  feeds = [('SBER', Period.MIN_5), ('GAZP', Period.HOUR), ('LKOH', Period.DAY)]
+  polls = events.subscribe(_Polls(clock))
+  try:
+    poller = Poller(feeds, storage=storage, clock=clock, host=finam.serve(), store=store, history_days=3,
+                    min_interval=0, backoff=0)
+    # Before the session, during it, after the close and the next morning.
+    for until in [datetime(2020, 1, 8, 9, 30), datetime(2020, 1, 8, 12, 3), datetime(2020, 1, 8, 19),
+                  datetime(2020, 1, 9, 11, 3)]:
+      asyncio.run(poller.run(until=until))
+      for ticker, period in feeds:
+        polled_at, _, _ = polls.done[ticker, period.slug()][-1]
+        _check_feed(finam, store, storage, ticker, period, datetime(2020, 1, 5), polled_at)
+  finally:
+    events.unsubscribe(polls)
+    finam.close()
+
+  # Every run polls all the feeds at its start, then each at its bar boundaries. The synthetic session
+  # ends at 18:40: the last 5min bar (18:35) is closed at 18:40, the day bar (no forming one) at 18:50.
+  lags = {at: lag for at, _, lag in polls.done['SBER', '5min']}
+  assert {lag for at, lag in lags.items() if time(10) < at.time() < time(18, 40)} == {0.0}
+  assert [lags[datetime(2020, 1, 8, 18, 40, 5)], lags[datetime(2020, 1, 8, 18, 45, 5)],
+          lags[datetime(2020, 1, 8, 18, 52)]] == [5.0, 305.0, 720.0]
+  assert [(at, lag) for at, _, lag in polls.done['LKOH', 'day']] == [
+    (datetime(2020, 1, 8, 9), 51000.0), (datetime(2020, 1, 8, 9), 51000.0), (datetime(2020, 1, 8, 12, 0, 5), 0.0),
+    (datetime(2020, 1, 8, 18, 52), 120.0), (datetime(2020, 1, 8, 18, 52), 120.0)]
+
+  summary = poller.metrics.summary()['poll.done']
+  assert summary['count'] == sum(len(item) for item in polls.done.values())
+  assert summary['max_lag'] == max(lag for item in polls.done.values() for _, _, lag in item)
+  assert poller.status()['feeds']['LKOH_day']['lag'] == 120.0
+
+
+def test_run_ticks(tmp_path):
+  # The ticks of one second arrive in different polls: each tick is stored once.
+  clock = VirtualClock(datetime(2020, 1, 8, 10, 0))
+  finam = FakeFinam(clock, start='2020-01-06')
+  storage = str(tmp_path)
+  store = BarStore(os.path.join(storage, 'bars'))
+  polls = events.subscribe(_Polls(clock))
+  try:
+    poller = Poller([('SBER', Period.TICK)], storage=storage, clock=clock, host=finam.serve(), store=store,
+                    history_days=1, min_interval=0, backoff=0)
+    asyncio.run(poller.run(until=datetime(2020, 1, 8, 10, 20)))
+    polled_at, _, _ = polls.done['SBER', 'tick'][-1]
+    stored, closed = _check_feed(finam, store, storage, 'SBER', Period.TICK, datetime(2020, 1, 7), polled_at)
+  finally:
+    events.unsubscribe(polls)
+    finam.close()
+  assert len(polls.done['SBER', 'tick']) == 121
+  assert len(closed) == len(stored) and stored['timestamp'].duplicated().any()
@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from data.fetcher import Period
+from data.resample import resample
+from data.synthetic import random_bars, session_timestamps
+
+__author__ = 'maxim'
+
+
+def test_resample_hour_to_day():
+  hours = random_bars(session_timestamps(Period.HOUR, 0.1), 'SBER', Period.HOUR)
+  days = resample(hours, Period.DAY)
+  assert len(days) == len(session_timestamps(Period.DAY, 0.1))
+  first = hours[hours['timestamp'].dt.normalize() == days['timestamp'][0]]
+  assert days['open'][0] == first['open'].iloc[0]
+  assert days['close'][0] == first['close'].iloc[-1]
+  assert days['high'][0] == first['high'].max()
+  assert days['low'][0] == first['low'].min()
+  assert days['volume'][0] == first['volume'].sum()
+  assert (days['period'] == 'D').all()
+
+
+@pytest.mark.parametrize('source, target', [(Period.DAY, Period.HOUR), (Period.HOUR, Period.HOUR),
+                                            (Period.MIN_10, Period.MIN_15), (Period.WEEK, Period.MONTH)])
+def test_resample_rejects_finer_periods(source, target):
+  bars = random_bars(session_timestamps(source, 0.5), 'SBER', source)
+  with pytest.raises(ValueError):
+    resample(bars, target)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+
+from data.analysis import calc_sharpe, get_returns
+from data.fetcher import Period
+from data.loader import load
+from data.stats import REFRESH_WINDOWS, RollingStats, RunningStats, stats_path, update_rolling_stats, update_stats
+from data.synthetic import random_bars, session_timestamps, write_finam
+
+__author__ = 'maxim'
+
+
+def _sample(tmp_path, period=Period.DAY, years=2, ticks_per_day=2000):
+  path = str(tmp_path / ('SBER_%s.txt' % period.slug()))
+  write_finam(path, random_bars(session_timestamps(period, years, ticks_per_day=ticks_per_day), 'SBER', period))
+  return path
+
+
+def test_update_stats_matches_calc_sharpe(tmp_path):
+  path = _sample(tmp_path)
+  stats = update_stats(path, load(path))
+  np.testing.assert_allclose(stats.values(), calc_sharpe(get_returns(path)), rtol=1e-10)
+  assert RunningStats.load(stats_path(path)).state() == stats.state()
+
+
+def test_update_stats_incremental(tmp_path):
+  path = _sample(tmp_path)
+  df = load(path)
+  update_stats(path, df.iloc[:300])
+  stats = update_stats(path, df.iloc[250:])  # the overlapping rows are skipped
+  np.testing.assert_allclose(stats.values(), calc_sharpe(get_returns(path)), rtol=1e-10)
+  assert stats.bars == len(df)
+
+
+def test_update_stats_ticks_of_one_second(tmp_path):
+  # The ticks share the seconds: a split in the middle of a second keeps the rest of its ticks.
+  path = _sample(tmp_path, Period.TICK, years=2 / 252.0, ticks_per_day=20000)
+  df = load(path)
+  stamps = df['timestamp'].values
+  split = np.flatnonzero(stamps[1:] == stamps[:-1])[len(df) // 100] + 1
+  assert stamps[split] == stamps[split - 1]
+  update_stats(path, df.iloc[:split])
+  stats = update_stats(path, df.iloc[split - 1:])
+  assert stats.bars == len(df)
+  np.testing.assert_allclose(stats.values(), calc_sharpe(get_returns(path)), rtol=1e-10)
+
+
+def test_rolling_stats_long_stream():
+  window = 50
+  random = np.random.RandomState(0)
+  values = random.normal(0.01, 0.02, size=REFRESH_WINDOWS * window * 40 + 7)
+  stats = RollingStats(window)
+  for value in values:
+    stats.add_return(value)
+  last = values[-window:]
+  np.testing.assert_allclose(stats.mean(), last.mean(), rtol=1e-12)
+  np.testing.assert_allclose(stats.variance(), last.var(ddof=1), rtol=1e-10)
+
+
+def test_update_rolling_stats_incremental(tmp_path):
+  path = _sample(tmp_path)
+  df = load(path)
+  update_rolling_stats(path, df.iloc[:200], window=60)
+  stats = update_rolling_stats(path, df.iloc[150:], window=60)
+  returns = df['close'].pct_change().values[-60:]
+  np.testing.assert_allclose(stats.mean(), returns.mean(), rtol=1e-10)
+  np.testing.assert_allclose(stats.std(), returns.std(ddof=1), rtol=1e-10)
+  assert stats.last_timestamp == pd.Timestamp(df['timestamp'].iloc[-1]).isoformat()
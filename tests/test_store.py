@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+
+from data.fetcher import Period
+from data.store import BarStore
+
+__author__ = 'maxim'
+
+
+def _bars(start, size, price=100.0):
+  timestamps = pd.date_range(start, periods=size, freq='h')
+  return pd.DataFrame({'timestamp': timestamps, 'open': price, 'high': price + 1, 'low': price - 1,
+                       'close': price + np.arange(size), 'volume': np.arange(size)})
+
+
+def test_append_past_rows(tmp_path):
+  store = BarStore(str(tmp_path))
+  store.write('SBER', Period.HOUR, _bars('2020-01-06 10:00', 5))
+  store.append('SBER', Period.HOUR, _bars('2020-01-06 15:00', 3, price=200.0))
+  frame = store.frame('SBER', Period.HOUR)
+  assert len(frame) == 8
+  assert frame.index.is_monotonic_increasing
+  assert list(frame['close'][-3:]) == [200.0, 201.0, 202.0]
+  assert store.meta('SBER', Period.HOUR)['generation'] == 0
+
+
+def test_append_replaces_tail_without_touching_readers(tmp_path):
+  store = BarStore(str(tmp_path))
+  store.write('SBER', Period.HOUR, _bars('2020-01-06 10:00', 5))
+  reader = store.slice('SBER', Period.HOUR)
+  before = np.array(reader['close'])
+  store.append('SBER', Period.HOUR, _bars('2020-01-06 13:00', 4, price=200.0))
+  np.testing.assert_array_equal(reader['close'], before)  # the old generation is still mapped as it was
+  frame = store.frame('SBER', Period.HOUR)
+  assert list(frame['close']) == [100.0, 101.0, 102.0, 200.0, 201.0, 202.0, 203.0]
+  assert store.meta('SBER', Period.HOUR) == {'rows': 7, 'generation': 1}
+
+
+def test_unseen(tmp_path):
+  store = BarStore(str(tmp_path))
+  bars = _bars('2020-01-06 10:00', 6)
+  bars['timestamp'] = bars['timestamp'].values[[0, 1, 2, 2, 2, 3]]  # three ticks of one second
+  assert len(store.unseen('SBER', Period.TICK, bars)) == 6
+  store.write('SBER', Period.TICK, bars.iloc[:4])  # two of the three
+  unseen = store.unseen('SBER', Period.TICK, bars.iloc[1:])
+  assert list(unseen.index) == [4, 5]
+  store.append('SBER', Period.TICK, unseen, replace=False)
+  assert store.meta('SBER', Period.TICK) == {'rows': 6, 'generation': 0}
+  assert len(store.unseen('SBER', Period.TICK, bars)) == 0
+  assert list(store.frame('SBER', Period.TICK)['close']) == list(bars['close'])
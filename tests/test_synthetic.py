@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pandas as pd
+import pytest
+
+from data.bench import random_frame
+from data.fetcher import Period
+from data.synthetic import session_timestamps
+
+__author__ = 'maxim'
+
+
+def test_session_timestamps():
+  hours = session_timestamps(Period.HOUR, 2.0 / 252)
+  assert hours[0] == pd.Timestamp('2010-01-04 10:00')
+  assert hours[-1] == pd.Timestamp('2010-01-05 18:00')
+  assert len(hours) == 18
+
+
+def test_session_timestamps_past_range():
+  with pytest.raises(ValueError):
+    session_timestamps(Period.HOUR, 300)
+
+
+def test_random_frame_sorted_and_in_range():
+  df = random_frame(1000000)
+  assert len(df) == 1000000
+  assert df['timestamp'].is_monotonic_increasing
+  assert df['timestamp'].iloc[-1] < pd.Timestamp('2060-01-01')